@@ -1,16 +1,153 @@
 import asyncio
 import os
 import json
-from typing import List
+from typing import AsyncIterator, Callable, List
 from contextlib import AsyncExitStack
 from datetime import datetime
 import re
-from openai import OpenAI
+import time
+import hashlib
 from dotenv import load_dotenv
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+from llm_backend import get_backend, close_backend
+from plan_executor import PlanExecutor, PlanStep
+from retry_policy import RetryPolicy, PERMANENT, IRRELEVANT, classify_output, is_error_output
+from relevance import RelevanceJudge
+from plan_cache import PlanCache
+from context_builder import ContextBuilder, compress
+from file_access import workspace_root, resolve_path
+import telemetry
 load_dotenv()
 
+## 执行模式：plan 为规划工具链 -> 执行并判定相关性 -> 生成回答，
+## tools 为使用大模型原生的 tools / tool_calls 接口，由大模型在多轮对话中自行调用工具
+EXECUTION_MODES = ("plan", "tools")
+AGENT_PROMPT = ("你是一个可以调用工具的智能助手。需要外部信息或操作时调用工具，相互独立的工具调用请在同一轮中一起发出；"
+                "工具结果足以回答时，直接用中文回答用户的问题，工具结果不足以回答时如实说明。")
+
+
+class ToolRegistry:
+    """
+    客户端侧的工具目录缓存
+    在 connect_to_server 时填充一次，之后只在收到 tools/list_changed 通知或显式 refresh 时更新
+    预先构造好 OpenAI 格式的 function spec 以及规划用的 tool_list_text，避免每次 query 都重新 list_tools
+    """
+
+    def __init__(self):
+        # name -> server_id
+        self.tools_map = {}
+        # name -> OpenAI 格式的 function spec
+        self.specs = {}
+        # 规划 prompt 中使用的工具列表文本
+        self.tool_list_text = ""
+        # 工具集每变化一次 +1，便于依赖工具集的缓存判断是否失效
+        self.version = 0
+        # 工具目录内容的指纹，工具名、描述、参数不变则指纹不变
+        self.fingerprint = ""
+
+    def update_server(self, server_id: str, tools: list):
+        """
+        用某个 server 最新的工具列表替换其旧的条目
+        """
+        for name in [name for name, sid in self.tools_map.items() if sid == server_id]:
+            del self.tools_map[name]
+            del self.specs[name]
+        for tool in tools:
+            self.tools_map[tool.name] = server_id
+            self.specs[tool.name] = {
+                "type": "function",
+                "function": {
+                    "name": tool.name,
+                    "description": tool.description,
+                    "parameters": tool.inputSchema
+                }
+            }
+        self.tool_list_text = "\n".join([
+            f"- {spec['function']['name']}: {spec['function']['description']}"
+            for spec in self.specs.values()
+        ])
+        self.version += 1
+        self.fingerprint = hashlib.sha1(
+            json.dumps(self.specs, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def available_tools(self) -> List[dict]:
+        return list(self.specs.values())
+
+
+class ServerReplica:
+    """
+    一个 server 的一个副本：stdio 子进程或者一个网络地址
+    记录正在进行的调用数量与调用延迟的滑动平均，用于在多个副本之间做负载均衡
+    """
+
+    def __init__(self, server_id: str, index: int, transport: str, target):
+        self.server_id = server_id
+        self.index = index
+        self.transport = transport
+        # stdio 时为 StdioServerParameters，网络传输时为 url
+        self.target = target
+        self.session = None
+        self.task = None
+        self.stop = None
+        self.inflight = 0
+        self.latency = 0.0
+
+    @property
+    def name(self) -> str:
+        return f"{self.server_id}#{self.index}"
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self.task is not None and not self.task.done()
+
+    def record_latency(self, elapsed: float, alpha: float = 0.2):
+        self.latency = elapsed if self.latency == 0 else (1 - alpha) * self.latency + alpha * elapsed
+
+
+def load_server_config(path: str = None) -> dict:
+    """
+    读取 server 配置文件（默认为同目录下的 servers.json，可用环境变量 MCP_SERVERS_CONFIG 指定）
+    args 与 workspace 中的相对路径按配置文件所在目录解析
+    workspace 为文件工具的工作目录（未配置时使用环境变量 FS_WORKSPACE，默认为 ./Test box），
+    通过环境变量 FS_WORKSPACE 传给 stdio 方式启动的 server，server 的 env 中已经指定时以 server 的为准
+    stdio 的 server 只继承少数几个默认的环境变量，追踪与指标的设置（TELEMETRY_*）同样在这里传过去，
+    TELEMETRY_SERVICE 除外，server 的 span 以各自的脚本名作为服务名
+    """
+    path = path or os.getenv("MCP_SERVERS_CONFIG") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "servers.json")
+    with open(path, "r", encoding="utf-8") as file:
+        config = json.load(file)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    workspace = config.get("workspace")
+    config["workspace"] = os.path.join(base_dir, workspace) if workspace else workspace_root()
+    telemetry_env = {
+        key: value for key, value in os.environ.items()
+        if (key == "TELEMETRY" or key.startswith("TELEMETRY_")) and key != "TELEMETRY_SERVICE"
+    }
+    for server in config.get("servers", {}).values():
+        server.setdefault("command", "python")
+        server["env"] = {**telemetry_env, "FS_WORKSPACE": config["workspace"], **(server.get("env") or {})}
+        server["args"] = [
+            os.path.join(base_dir, arg) if arg.endswith(".py") and not os.path.isabs(arg) else arg
+            for arg in server.get("args", [])
+        ]
+    manifest_path = config.get("manifest_path", "tool_manifest.json")
+    config["manifest_path"] = manifest_path if os.path.isabs(manifest_path) else os.path.join(base_dir, manifest_path)
+    return config
+
+
+def replica_count(server_config: dict) -> int:
+    """
+    server 的副本数量：stdio 时为 replicas 个子进程，sse / streamable-http 时为 urls 中的地址数量
+    """
+    if server_config.get("transport", "stdio") == "stdio":
+        return max(1, int(server_config.get("replicas", 1)))
+    return len(server_config.get("urls") or [server_config["url"]])
+
+
 class MCPClient:
 
     def __init__(self):
@@ -18,189 +155,611 @@ class MCPClient:
         从环境变量中获取底层大模型的配置，使用 deepseek-chat 大模型
         需要创建多个服务端对话，所以使用字典来存
         """
-        self.exit_stack = AsyncExitStack()
-        self.deepseek_api_key = os.getenv("DASHSCOPE_API_KEY")
-        self.base_url = os.getenv("BASE_URL")
-        self.model = os.getenv("MODEL")
-        self.client = OpenAI(api_key=self.deepseek_api_key, base_url=self.base_url)
+        ## 异步的大模型调用层，与同进程内的其他组件共享连接池
+        self.llm = get_backend()
+        self.model = self.llm.model
         ## 连接多个服务端会话
-        # server_id -> session, stdio, write
+        # server_id -> session（第一个可用副本的会话）
         self.sessions = {}
-        ## 存储工具的映射关系 
+        ## 每个 server 的启动参数与生命周期
+        # server_id -> {"command", "args", "lazy"}
+        self.server_configs = {}
+        # server_id -> [ServerReplica]
+        self.replicas = {}
+        self._server_locks = {}
+        self._health_task = None
+        ## 工具清单缓存，lazy 模式的 server 依靠它在启动前注册工具
+        self.manifest_path = None
+        self.manifest = {}
+        ## 文件工具的工作目录，相对路径按它补全，connect_all 时以配置为准
+        self.workspace = workspace_root()
+        ## 工具目录缓存，tools_map 与 registry 共享同一个字典
         # name -> server_file_name
-        self.tools_map = {}
+        self.registry = ToolRegistry()
+        self.tools_map = self.registry.tools_map
+        ## 工具结果与 query 的相关性判定
+        self.relevance = RelevanceJudge(self.llm)
+        ## 工具调用链规划的缓存，命中时跳过规划的大模型调用
+        self.plan_cache = PlanCache()
+        ## 最终回答的上下文组装（去重、按 token 预算压缩）
+        self.context_builder = ContextBuilder()
+        ## 默认的执行模式，可以在每个 query 中单独指定
+        self.mode = os.getenv("AGENT_MODE", "plan")
+        ## tools 模式下大模型调用的轮数上限，最后一轮不再允许调用工具
+        self.agent_max_turns = max(1, int(os.getenv("AGENT_MAX_TURNS", 5)))
+        ## 工具调用失败时的重试策略（次数上限、退避、query 时限）
+        self.retry_policy = RetryPolicy()
+        # 由 tools/list_changed 通知触发的后台刷新任务
+        self._refresh_tasks = set()
+        ## 每个 server 同时进行的工具调用数量上限
+        # server_id -> Semaphore
+        self.server_concurrency = int(os.getenv("MCP_SERVER_CONCURRENCY", 4))
+        self.server_semaphores = {}
+        ## server 健康检查的间隔与超时（秒）
+        self.health_interval = float(os.getenv("MCP_HEALTH_INTERVAL", 30))
+        self.health_timeout = float(os.getenv("MCP_HEALTH_TIMEOUT", 5))
+
+    async def connect_all(self, config: dict):
+        """
+        按配置连接所有 server：非 lazy 的 server 并发启动
+        lazy 的 server 如果有缓存的工具清单，只注册工具，等到第一次调用其工具时再启动进程
+        """
+        self.manifest_path = config.get("manifest_path")
+        self.workspace = config.get("workspace") or self.workspace
+        self._load_manifest()
+        eager = []
+        for server_id, server_config in config.get("servers", {}).items():
+            self.server_configs[server_id] = server_config
+            if server_config.get("lazy") and server_id in self.manifest:
+                ## 与启动后的 server 相同，并发上限按副本数量放大
+                self.server_semaphores[server_id] = asyncio.Semaphore(
+                    self.server_concurrency * replica_count(server_config)
+                )
+                self.registry.update_server(
+                    server_id, [types.Tool.model_validate(tool) for tool in self.manifest[server_id]]
+                )
+                self._print_tools(server_id, lazy=True)
+            else:
+                eager.append(server_id)
+        results = await asyncio.gather(
+            *(self.connect_to_server(server_id) for server_id in eager), return_exceptions=True
+        )
+        for server_id, result in zip(eager, results):
+            if isinstance(result, Exception):
+                print(f"Server {server_id} 启动失败: {result}")
 
-    async def connect_to_server(self,server_id:str, server_path: str):
+    async def connect_to_server(self, server_id: str, server_path: str = None):
         """
         本项目都使用python，所以command设置为python即可，参数即为Server文件本身
         根据服务器参数，启动服务器进程并建立通信通道创建客户端会话，最后初始化会话
+        一个 server 可以有多个副本：stdio 时启动 replicas 个子进程，sse / streamable-http 时连接 urls 中的每个地址
+        每个副本的会话运行在单独的 task 中，可以单独关闭、重启，至少一个副本连接成功即可使用
         """
-        server_params = StdioServerParameters(
-            command="python", 
-            args=[server_path], 
-            env=None,
+        if server_path is not None:
+            self.server_configs[server_id] = {"command": "python", "args": [server_path]}
+        server_config = self.server_configs[server_id]
+        transport = server_config.get("transport", "stdio")
+        if transport == "stdio":
+            server_params = StdioServerParameters(
+                command=server_config.get("command", "python"),
+                args=server_config.get("args", []),
+                env=server_config.get("env"),
+            )
+            targets = [server_params] * replica_count(server_config)
+        else:
+            targets = server_config.get("urls") or [server_config["url"]]
+        self.replicas[server_id] = [ServerReplica(server_id, i, transport, target) for i, target in enumerate(targets)]
+        results = await asyncio.gather(
+            *(self._start_replica(replica) for replica in self.replicas[server_id]), return_exceptions=True
+        )
+        if not any(replica.alive for replica in self.replicas[server_id]):
+            raise results[0] if isinstance(results[0], BaseException) else RuntimeError(f"{server_id} 没有可用的副本")
+        self._sync_session(server_id)
+        self.server_semaphores.setdefault(
+            server_id, asyncio.Semaphore(self.server_concurrency * replica_count(server_config))
         )
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        stdio, write = stdio_transport
-        # MCP 客户端会话对象创建
-        session = await self.exit_stack.enter_async_context(ClientSession(stdio, write))
-        await session.initialize()
-        self.sessions[server_id] = {"session": session, "stdio":stdio, "write":write}
         # 更新工具的映射
-        response = await session.list_tools()
-        for tool in response.tools:
-            print(f"工具名称：{tool.name}\t\t对应Server：{server_id}")
-            self.tools_map[tool.name] = server_id
+        await self.refresh_tools(server_id)
+        self._print_tools(server_id)
+
+    async def _start_replica(self, replica: "ServerReplica"):
+        ready = asyncio.get_running_loop().create_future()
+        replica.stop = asyncio.Event()
+        replica.task = asyncio.create_task(self._run_replica(replica, ready, replica.stop))
+        await ready
+
+    async def _run_replica(self, replica: "ServerReplica", ready: asyncio.Future, stop: asyncio.Event):
+        """
+        在同一个 task 中进入与退出传输层 / ClientSession 的上下文，直到 stop 被设置
+        """
+        try:
+            async with AsyncExitStack() as stack:
+                if replica.transport == "stdio":
+                    stdio, write = await stack.enter_async_context(stdio_client(replica.target))
+                elif replica.transport == "sse":
+                    stdio, write = await stack.enter_async_context(sse_client(replica.target))
+                else:
+                    stdio, write, _ = await stack.enter_async_context(streamablehttp_client(replica.target))
+                # MCP 客户端会话对象创建
+                session = await stack.enter_async_context(
+                    ClientSession(stdio, write, message_handler=self._make_message_handler(replica.server_id))
+                )
+                await session.initialize()
+                replica.session = session
+                ready.set_result(None)
+                await stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                print(f"Server {replica.name} 连接中断: {e}")
+        finally:
+            if not ready.done():
+                ready.cancel()
+            # 已经被重启替换的旧 task 不能清掉新的会话
+            if replica.task in (None, asyncio.current_task()):
+                replica.session = None
+                self._sync_session(replica.server_id)
+
+    def _sync_session(self, server_id: str):
+        """
+        sessions 中保存每个 server 第一个可用副本的会话，用于 list_tools 等不需要负载均衡的请求
+        """
+        alive = [replica for replica in self.replicas.get(server_id, []) if replica.alive]
+        if alive:
+            self.sessions[server_id] = {"session": alive[0].session}
+        else:
+            self.sessions.pop(server_id, None)
+
+    def pick_replica(self, server_id: str) -> "ServerReplica":
+        """
+        选择处理本次调用的副本：只考虑可用的副本，排队中的调用最少者优先，其次是平均延迟最低者
+        """
+        alive = [replica for replica in self.replicas.get(server_id, []) if replica.alive]
+        if not alive:
+            raise RuntimeError(f"Server {server_id} 没有可用的副本")
+        return min(alive, key=lambda replica: (replica.inflight, replica.latency))
+
+    async def ensure_server(self, server_id: str):
+        """
+        确保 server 至少有一个可用副本：lazy 的 server 第一次使用时启动，全部副本退出后重新启动
+        """
+        if any(replica.alive for replica in self.replicas.get(server_id, [])):
+            return
+        lock = self._server_locks.setdefault(server_id, asyncio.Lock())
+        async with lock:
+            if any(replica.alive for replica in self.replicas.get(server_id, [])):
+                return
+            await self.stop_server(server_id)
+            print(f"启动 Server：{server_id}")
+            await self.connect_to_server(server_id)
+
+    async def stop_replica(self, replica: "ServerReplica"):
+        task, replica.task = replica.task, None
+        replica.session = None
+        self._sync_session(replica.server_id)
+        if task is None:
+            return
+        replica.stop.set()
+        try:
+            await asyncio.wait_for(task, timeout=5)
+        except (asyncio.TimeoutError, Exception):
+            task.cancel()
+
+    async def stop_server(self, server_id: str):
+        await asyncio.gather(*(self.stop_replica(replica) for replica in self.replicas.pop(server_id, [])))
+        self.sessions.pop(server_id, None)
+
+    async def probe_replica(self, replica: "ServerReplica") -> bool:
+        """
+        向副本发送 ping，没有响应时关闭该副本
+        """
+        try:
+            if not replica.alive:
+                raise RuntimeError("会话不存在")
+            await asyncio.wait_for(replica.session.send_ping(), timeout=self.health_timeout)
+            return True
+        except Exception as e:
+            print(f"Server {replica.name} 健康检查失败: {e}")
+            await self.stop_replica(replica)
+            return False
+
+    async def health_check(self):
+        """
+        检查所有已启动的副本，没有响应的副本重新启动
+        """
+        for server_id in list(self.replicas):
+            for replica in list(self.replicas.get(server_id, [])):
+                if await self.probe_replica(replica):
+                    continue
+                try:
+                    await self._start_replica(replica)
+                    self._sync_session(server_id)
+                except Exception as e:
+                    print(f"Server {replica.name} 重启失败: {e}")
 
+    def start_health_checks(self):
+        async def loop():
+            while True:
+                await asyncio.sleep(self.health_interval)
+                await self.health_check()
+        if self.health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(loop())
 
-    async def query_match_tools(self, query: str) -> str:
+    async def refresh_tools(self, server_id: str = None):
+        """
+        重新拉取工具列表并更新工具目录，不指定 server_id 时刷新全部 server
+        拉取到的工具同时写入工具清单缓存，供 lazy 模式下次启动使用
+        """
+        server_ids = [server_id] if server_id else list(self.sessions)
+        for sid in server_ids:
+            response = await self.sessions[sid]["session"].list_tools()
+            self.registry.update_server(sid, response.tools)
+            self.manifest[sid] = [
+                {"name": tool.name, "description": tool.description, "inputSchema": tool.inputSchema}
+                for tool in response.tools
+            ]
+        self._save_manifest()
+
+    def _load_manifest(self):
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as file:
+                self.manifest = json.load(file)
+        except Exception as e:
+            print(f"工具清单加载失败: {e}")
+
+    def _save_manifest(self):
+        if not self.manifest_path:
+            return
+        try:
+            with open(self.manifest_path, "w", encoding="utf-8") as file:
+                json.dump(self.manifest, file, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"工具清单保存失败: {e}")
+
+    def _print_tools(self, server_id: str, lazy: bool = False):
+        for tool_name, sid in self.tools_map.items():
+            if sid == server_id:
+                print(f"工具名称：{tool_name}\t\t对应Server：{server_id}" + ("（按需启动）" if lazy else ""))
+
+    def _make_message_handler(self, server_id: str):
+        """
+        收到 tools/list_changed 通知时，在后台刷新对应 server 的工具列表
+        不能在 handler 中直接 await list_tools，否则会阻塞会话的接收循环
+        """
+        async def handler(message):
+            if isinstance(message, types.ServerNotification) and \
+                    isinstance(message.root, types.ToolListChangedNotification):
+                task = asyncio.create_task(self.refresh_tools(server_id))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+        return handler
+
+
+    def resolve_mode(self, mode: str = None) -> str:
+        mode = mode or self.mode
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"未知的执行模式: {mode}，可选：{'、'.join(EXECUTION_MODES)}")
+        return mode
+
+    async def query_match_tools(self, query: str, mode: str = None) -> str:
         """
         根据 query 进行子任务拆分，并且为子任务分配工具
         按照生成的 tools 工作流执行 call_tool，并且保存到 massage 中
         以上步骤相当于为 query 提供了丰富的上下文，最后整体放入大模型中生成最终答案
+        mode 为 tools 时改用原生的 tool_calls，见 run_agent
         """
-        messages = [{"role": "user", "content": query}]
-        available_tools = []
-        for tool_name, server_id in self.tools_map.items():
-            session = self.sessions[server_id]["session"]
-            response = await session.list_tools()
-            for tool in response.tools:
-                if tool.name == tool_name:
-                    available_tools.append({
-                        "type": "function",
-                        "function": {
-                            "name": tool.name,
-                            "description": tool.description,
-                            "input_schema": tool.inputSchema
-                        }
-                    })
-        ### 拆分子任务，并且为子任务分配工具
-        tool_plan = await self.plan_tool_usage(query, available_tools)
-        print(tool_plan)
+        mode = self.resolve_mode(mode)
+        with telemetry.span("query", query=query, mode=mode):
+            if mode == "tools":
+                return await self.run_agent(query)
+            messages = await self.build_context(query)
+            ## 最后再将以上内容作为上下文，调用 LLM 生成回复信息，并输出保存结果
+            final_response = await self.llm.chat(messages=messages, call_site="final")
+            final_output = final_response.choices[0].message.content
+            return final_output
+
+    async def stream_query(self, query: str, mode: str = None) -> AsyncIterator[dict]:
+        """
+        query_match_tools 的流式版本，按顺序产出事件：
+            {"type": "plan", "plan": [...]}
+            {"type": "step_start", "index", "name", "arguments", "attempt"}
+            {"type": "step_finish", "index", "name", "status", "attempts"}
+            {"type": "context", "budget", "tokens", "original_tokens", "results", "duplicates", "compressed"}  最终回答的上下文大小（估算）
+            {"type": "token", "content"}  最终回答的增量
+            {"type": "done", "content", "query_id"}  完整的最终回答，query_id 为追踪中的 trace_id（关闭追踪时为 None）
+        mode 为 tools 时没有 plan 与 context 事件，每一轮大模型发起的工具调用产出一个
+            {"type": "tool_calls", "turn", "calls": [{"name", "arguments"}]}
+        之后是这些调用的 step_start / step_finish，index 在整个 query 中连续编号
+        """
+        mode = self.resolve_mode(mode)
+        with telemetry.span("query", query=query, mode=mode) as query_span:
+            if mode == "tools":
+                queue = asyncio.Queue()
+                agent_task = asyncio.create_task(self.run_agent(query, on_event=queue.put_nowait))
+                agent_task.add_done_callback(lambda _: queue.put_nowait(None))
+                try:
+                    while True:
+                        event = await queue.get()
+                        if event is None:
+                            break
+                        yield event
+                    answer = await agent_task
+                finally:
+                    if not agent_task.done():
+                        agent_task.cancel()
+                yield {"type": "done", "content": answer, "query_id": query_span.trace_id}
+                return
 
-        outputs_histoy = {}
-        # 依次执行工具调用，并收集结果
-        calltimes = 0
-        for step in tool_plan:
-            tool_name = step["name"]
-            tool_args = step["arguments"]
-            calltimes += 1 
-            tool_info = {"name":tool_name, "arguments":tool_args}
-            ## 用于判定调用的历史tool是否存在error，若存在，则当前tool直接加入到tool 流的尾部
-            error_flag = False
-            for key, val in tool_args.items():
-                ## 针对串联工具的情况，需要记录之前使用过的工具得到的结果
-                # 用 {{name}} 标识出，替换为之前使用过的工具得到的结果
-                if isinstance(val, str) and "{{" in val and "}}" in val:
-                    # 提取所有 {{ }} 的格式的引用并逐个替换
-                    matches = re.findall(r"\{\{(.*?)\}\}", val)
-                    for match in matches:
-                        ref_key = match.strip()
-                        resolved_val = outputs_histoy.get(ref_key, f"{{{{{ref_key}}}}}")
-                        val = val.replace(f"{{{{{ref_key}}}}}", str(resolved_val))
-                    # 再匹配一次，看是否还有 {{}}
-                    matches = re.findall(r"\{\{(.*?)\}\}", val)
-                    if matches:
-                        error_flag = True
+            queue = asyncio.Queue()
+            context_task = asyncio.create_task(self.build_context(query, on_event=queue.put_nowait))
+            context_task.add_done_callback(lambda _: queue.put_nowait(None))
+            try:
+                while True:
+                    event = await queue.get()
+                    if event is None:
                         break
-                    tool_args[key] = val
-            ### 涉及文件路径的地方，在此处理，需要统一
-            ## 由于只是 demo，所以全部暂存进相对目录 ./Test box/ 中
-            ## 文件地址
-            abs_file_path = "E:/Sysu MCP-Based Agent/mywork/Test box/"
-            if self.tools_map.get(tool_name) == "Server_filesystem":
-                if "file_name" not in tool_args:
-                    tool_args["file_name"] = "temp.txt"
-                # 当然，如果给定了绝对地址，也可以按照绝对地址进行文件操作，为了操作方便，就设定全在E盘
-                if "E:/" not in tool_args["file_name"]:
-                    tool_args["file_name"] = abs_file_path + tool_args["file_name"]
-            ## email的附件地址：
-            if tool_name == "send_email" and tool_args["attachmentfilename"] != "noattach":
-                if "E:/" not in tool_args["attachmentfilename"]:
-                    tool_args["attachmentfilename"] = abs_file_path + tool_args["attachmentfilename"]
-
-            ## 用于判定调用的历史tool是否存在error，若存在，则当前tool直接加入到tool 流的尾部，维护各数据结构
-            if error_flag:
-                print(f"\nTool Call #{calltimes}: {tool_name} with {tool_args}")
-                print("error")
-                tool_plan.append(tool_info)
+                    yield event
+                messages = await context_task
+            finally:
+                if not context_task.done():
+                    context_task.cancel()
+
+            ## 最终回答使用流式输出，首个 token 的延迟与回答长度无关
+            stream = await self.llm.chat(messages=messages, stream=True, call_site="final")
+            answer = []
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    answer.append(delta)
+                    yield {"type": "token", "content": delta}
+            yield {"type": "done", "content": "".join(answer), "query_id": query_span.trace_id}
+
+    async def run_agent(self, query: str, on_event: Callable = None) -> str:
+        """
+        tools 模式：把工具以 OpenAI 的 tools 格式交给大模型，大模型返回 tool_calls 时执行这些调用，
+        结果作为 tool 消息放回对话，直到大模型直接给出回答
+        同一轮中的多个调用并发执行（重试与每个 server 的并发上限与 plan 模式相同），工具结果不再经过相关性判定，
+        由大模型自己取舍；超出 token 预算的结果按 plan 模式的方式压缩
+        每一轮都使用流式输出，回答的 token 通过 on_event 以 token 事件实时上报，返回完整的回答
+        工具调用的总时限与 plan 模式相同（retry_policy.deadline），所有轮次共用，超时后的一轮直接要求回答
+        """
+        messages = [{"role": "system", "content": AGENT_PROMPT}, {"role": "user", "content": query}]
+        tools = self.registry.available_tools()
+        step_count = 0
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.retry_policy.deadline
+        for turn in range(self.agent_max_turns):
+            ## 最后一轮或者已经超时，不再允许调用工具，保证有回答
+            last_turn = turn == self.agent_max_turns - 1 or loop.time() >= deadline_at
+            with telemetry.span("agent.turn", turn=turn) as turn_span:
+                content, tool_calls = await self._agent_turn(messages, tools, last_turn, on_event)
+                turn_span.set(tool_calls=len(tool_calls))
+            if not tool_calls or last_turn:
+                return content
+            messages.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
+
+            plan, outputs = [], {}
+            for call in tool_calls:
+                try:
+                    arguments = json.loads(call["function"]["arguments"] or "{}")
+                    if not isinstance(arguments, dict):
+                        raise ValueError("参数应为 JSON 对象")
+                except ValueError as e:
+                    outputs[call["id"]] = f"error: 工具参数不是合法的 JSON 对象: {e}"
+                    continue
+                plan.append({"id": call["id"], "name": call["function"]["name"], "arguments": arguments})
+            print(f"第 {turn + 1} 轮工具调用：{[(step['name'], step['arguments']) for step in plan]}")
+            if on_event:
+                on_event({"type": "tool_calls", "turn": turn,
+                          "calls": [{"name": step["name"], "arguments": step["arguments"]} for step in plan]})
+
+            executor = PlanExecutor(
+                run_step=lambda step, tool_args: self.execute_step(query, step, tool_args, judge=False),
+                server_of=self.tools_map.get,
+                semaphores=self.server_semaphores,
+                retry_policy=self.retry_policy,
+                on_event=self._step_event_reporter(on_event, offset=step_count),
+                resolve_references=False,
+            )
+            steps = await executor.run(plan, deadline_at=deadline_at)
+            step_count += len(steps)
+            budget = self.context_builder.budget // len(tool_calls) if self.context_builder.budget else 0
+            for item, step in zip(plan, steps):
+                output = step.output if step.status == "done" else f"error: 工具调用失败: {step.output}"
+                outputs[item["id"]] = compress(query, str(output), budget) if budget else str(output)
+            for call in tool_calls:
+                messages.append({"role": "tool", "tool_call_id": call["id"], "content": outputs[call["id"]]})
+
+    async def _agent_turn(self, messages: List[dict], tools: List[dict], last_turn: bool, on_event: Callable = None):
+        """
+        tools 模式的一轮：流式调用大模型，文本增量作为 token 事件上报，同时拼接分块返回的 tool_calls
+        返回 (文本, tool_calls)，tool_calls 为可以直接放回 assistant 消息的列表
+        """
+        kwargs = {"tools": tools, "tool_choice": "none" if last_turn else "auto"} if tools else {}
+        stream = await self.llm.chat(messages=messages, stream=True, call_site="agent", **kwargs)
+        content = []
+        # 分块中的 index -> 拼接中的 tool_call
+        calls = {}
+        async for chunk in stream:
+            if not chunk.choices:
                 continue
-            
-            ## 通过 tool_name 找到对应的 session
-            server_id = self.tools_map.get(tool_name)
-            session = self.sessions[server_id]["session"]
-            print(f"\nTool Call #{calltimes}: {tool_name} with {tool_args}")
-            result = await session.call_tool(tool_name, tool_args)
-
-            ### 让大模型来判断query与result的关联程度
-            judge_flag = "True"
-            if tool_name != "calculate":
-                judgement = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": ("你是一个判断能力很强的问题助手，擅长分析两段文本之间的关系。"
-                                                    "现在需要你判定answer是否能够作为解决用户的query的上下文，或者answer是否与用户的query相关，或者answer是否对query的解决有帮助。"
-                                                    "能作为上下文的answer可能是获取到的时间比如“2025年05月29日 10:00:26”，可能是与query相关的一段文本，比如可供query参考的资料，也可能是解决query过程中的阶段状态，比如文件创建、写入成功、邮件发送成功等状态，这些都能算是上下文"
-                                                    "能作为上下文则回复“True”，否则回复“False”"
-                                                    "不回复多余文字，直接输出True或者False即可")},
-                        {"role": "user", "content": f"这是用户的query：“{query}”\n这是answer：{result.content[0].text}"}
-                    ],
-                )
-                judge_flag = judgement.choices[0].message.content.strip()
-
-            if "error" not in result.content[0].text and "Error" not in result.content[0].text and "False" not in judge_flag:
-                messages.append({
-                    "role": "assistant",
-                    "content": "null",
-                    "tool_calls": [{ 
-                        "id": tool_name,
-                        "type": "function",
-                        "function": {
-                            "name": tool_name,
-                            "arguments": f"{tool_args}"
-                        }
-                    }]
-                })
-                outputs_histoy[tool_name] = result.content[0].text
-            
-                if tool_name == "calculate":
-                    calculate_prompt = "不使用latex或者markdown格式输出:"
-                    output_text = calculate_prompt + result.content[0].text
-                else:
-                    output_text = result.content[0].text
-            
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_name,
-                    "content": output_text
-                })
-                #print(output_text)
-            else:
-                ## 出现error，则加入到tool流的末尾，重新执行
-                # 由于是队列操作，所以如果存在链式调用，则全部重新依次加入到tool流的末尾，确保输出的完整性
-                tool_plan.append(tool_info)
-                #print(result.content[0].text)
-                print("error")
-
-        ## 最后再将以上内容作为上下文，调用 LLM 生成回复信息，并输出保存结果
-        final_response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content.append(delta.content)
+                if on_event:
+                    on_event({"type": "token", "content": delta.content})
+            for part in delta.tool_calls or []:
+                call = calls.setdefault(part.index, {"id": None, "type": "function",
+                                                     "function": {"name": "", "arguments": ""}})
+                if part.id:
+                    call["id"] = part.id
+                if part.function is not None:
+                    call["function"]["name"] += part.function.name or ""
+                    call["function"]["arguments"] += part.function.arguments or ""
+        tool_calls = []
+        for index in sorted(calls):
+            call = calls[index]
+            call["id"] = call["id"] or f"call_{index}"
+            tool_calls.append(call)
+        return "".join(content), tool_calls
+
+    async def build_context(self, query: str, on_event: Callable = None) -> List[dict]:
+        """
+        规划并执行工具链，返回用于生成最终回答的 messages
+        on_event 用于上报规划结果与各个步骤的进度，事件格式见 stream_query
+        """
+        ### 拆分子任务，并且为子任务分配工具，工具目录直接使用 registry 中的缓存
+        with telemetry.span("plan") as plan_span:
+            tool_plan = await self.plan_tool_usage(query)
+            plan_span.set(steps=len(tool_plan))
+        print(tool_plan)
+        if on_event:
+            on_event({"type": "plan", "plan": tool_plan})
+
+        ## 按 {{name}} 引用构建依赖图，相互独立的步骤并发执行
+        executor = PlanExecutor(
+            run_step=lambda step, tool_args: self.execute_step(query, step, tool_args),
+            server_of=self.tools_map.get,
+            semaphores=self.server_semaphores,
+            retry_policy=self.retry_policy,
+            on_event=self._step_event_reporter(on_event),
         )
-        final_output = final_response.choices[0].message.content
-        return final_output
+        steps = await executor.run(tool_plan)
 
+        ## 成功的结果经过去重、按预算压缩后组装成上下文，工具结果在前、query 在后，便于复用 prompt 缓存
+        messages, report = self.context_builder.build(query, steps)
+        print(f"上下文约 {report['tokens']} tokens（预算 {report['budget']}，原始 {report['original_tokens']}，"
+              f"去重 {report['duplicates']} 个，压缩 {report['compressed']} 个结果）")
+        telemetry.metrics.inc("context_tokens_total", report["tokens"])
+        telemetry.metrics.inc("context_tokens_saved_total", report["original_tokens"] - report["tokens"])
+        current = telemetry.current_span()
+        if current is not None:
+            current.set(context_tokens=report["tokens"], context_original_tokens=report["original_tokens"])
+        if on_event:
+            on_event({"type": "context", **report})
+        return messages
 
-    async def plan_tool_usage(self, query: str, tools: List[dict]) -> List[dict]:
+    @staticmethod
+    def _step_event_reporter(on_event: Callable, offset: int = 0):
+        """
+        将执行器的步骤回调转换为 stream_query 中的事件，offset 加在步骤的 index 上（tools 模式中每轮连续编号）
+        """
+        if on_event is None:
+            return None
+
+        def report(event_type: str, step: PlanStep):
+            if event_type == "step_start":
+                on_event({"type": event_type, "index": step.index + offset, "name": step.name,
+                          "arguments": step.call_arguments, "attempt": step.attempts})
+            else:
+                on_event({"type": event_type, "index": step.index + offset, "name": step.name,
+                          "status": step.status, "attempts": step.attempts})
+        return report
+
+    async def execute_step(self, query: str, step: PlanStep, tool_args: dict, judge: bool = True):
+        """
+        执行工具链中的一个步骤，参数中的 {{name}} 已经由执行器替换完成
+        返回 (是否成功, 工具输出文本, 错误类型)，失败包括工具报错以及大模型判定结果与 query 无关
+        judge 为 False 时不判定相关性（tools 模式由大模型自己取舍）
+        """
+        tool_name = step.name
+        ### 涉及文件路径的地方，在此处理，需要统一
+        ## 相对路径全部放在工作目录（self.workspace）中，给定绝对路径时按绝对路径操作
+        spec = self.registry.specs.get(tool_name)
+        takes_file = spec is not None and "file_name" in spec["function"]["parameters"].get("properties", {})
+        # search_files 等不操作单个文件的工具不需要补全路径
+        if self.tools_map.get(tool_name) == "Server_filesystem" and takes_file:
+            tool_args["file_name"] = resolve_path(tool_args.get("file_name", "temp.txt"), self.workspace)
+        ## 批量文件操作中每个操作的文件名同样补全
+        if tool_name == "batch_file_operations":
+            for operation in tool_args.get("operations", []):
+                if isinstance(operation, dict) and operation.get("file_name"):
+                    operation["file_name"] = resolve_path(operation["file_name"], self.workspace)
+        ## email的附件地址：
+        if tool_name in ("send_email", "queue_email") and tool_args.get("attachmentfilename", "noattach") != "noattach":
+            tool_args["attachmentfilename"] = resolve_path(tool_args["attachmentfilename"], self.workspace)
+
+        ## 通过 tool_name 找到对应的 session
+        server_id = self.tools_map.get(tool_name)
+        if server_id is None:
+            return False, f"error: 未知工具 {tool_name}", PERMANENT
+        await self.ensure_server(server_id)
+        replica = self.pick_replica(server_id)
+        print(f"\nTool Call #{step.index + 1}: {tool_name} with {tool_args}")
+        with telemetry.span(f"tool.{tool_name}", server=server_id, replica=replica.name, attempt=step.attempts) as tool_span:
+            ok, result_text, error_class = await self._call_step(query, tool_name, tool_args, replica, tool_span, judge)
+            tool_span.set(ok=ok, error_class=error_class)
+        telemetry.metrics.inc("tool_calls_total", tool=tool_name, status="ok" if ok else error_class)
+        return ok, result_text, error_class
+
+    async def _call_step(self, query: str, tool_name: str, tool_args: dict, replica: "ServerReplica", tool_span,
+                         judge: bool = True):
+        request_bytes = len(json.dumps(tool_args, ensure_ascii=False).encode("utf-8"))
+        telemetry.metrics.inc("tool_payload_bytes_total", request_bytes, tool=tool_name, direction="request")
+        replica.inflight += 1
+        start = time.perf_counter()
+        try:
+            result = await self.call_tool(replica.session, tool_name, tool_args)
+            replica.record_latency(time.perf_counter() - start)
+        except Exception as e:
+            telemetry.metrics.inc("tool_calls_total", tool=tool_name, status=type(e).__name__)
+            # 调用异常可能是副本已经退出，检查一下，重试时会换用其他副本或自动重启
+            await self.probe_replica(replica)
+            raise
+        finally:
+            replica.inflight -= 1
+        result_text = result.content[0].text
+        response_bytes = len(result_text.encode("utf-8"))
+        telemetry.metrics.inc("tool_payload_bytes_total", response_bytes, tool=tool_name, direction="response")
+        tool_span.set(request_bytes=request_bytes, response_bytes=response_bytes)
+
+        if is_error_output(result_text):
+            return False, result_text, classify_output(result_text)
+        if not judge:
+            return True, result_text, None
+        ### 判断 result 能否作为 query 的上下文，默认先用本地打分，模糊时才调用大模型
+        with telemetry.span("judge", tool=tool_name):
+            relevant = await self.relevance.judge(query, tool_name, result_text)
+        if not relevant:
+            return False, result_text, IRRELEVANT
+        return True, result_text, None
+
+    @staticmethod
+    async def call_tool(session: ClientSession, tool_name: str, tool_args: dict) -> types.CallToolResult:
+        """
+        调用工具，开启追踪时在请求的 _meta 中带上 trace_id 与当前 span，server 端的 span 据此挂到同一条链路下
+        """
+        meta = telemetry.trace_meta()
+        if meta is None:
+            return await session.call_tool(tool_name, tool_args)
+        request = types.ClientRequest(types.CallToolRequest(
+            method="tools/call",
+            params=types.CallToolRequestParams(name=tool_name, arguments=tool_args, _meta=meta),
+        ))
+        return await session.send_request(request, types.CallToolResult)
+
+    async def plan_tool_usage(self, query: str, tools: List[dict] = None) -> List[dict]:
         """
         使用prompt，让底层大模型根据query，从Server提供的tools中构造出一条json数组格式的tools chain，从而能够链式执行
+        不传 tools 时使用 registry 中预先构造好的工具列表文本
         """
-        tool_list_text = "\n".join([
-            f"- {tool['function']['name']}: {tool['function']['description']}"
-            for tool in tools
-        ])
-        response = self.client.chat.completions.create(
-            model=self.model,
+        if tools is None:
+            tool_list_text = self.registry.tool_list_text
+            cached_plan = self.plan_cache.get(query, self.registry.fingerprint)
+            telemetry.metrics.inc("plan_cache_total", result="miss" if cached_plan is None else "hit")
+            if cached_plan is not None:
+                return cached_plan
+        else:
+            tool_list_text = "\n".join([
+                f"- {tool['function']['name']}: {tool['function']['description']}"
+                for tool in tools
+            ])
+        response = await self.llm.chat(
             messages=[
                 {"role": "system",
                 "content": (
@@ -214,7 +773,8 @@ class MCPClient:
                 },
                 {"role": "user", "content": query}
             ],
-            stream=False
+            stream=False,
+            call_site="plan",
         )
         ## 提取出模型返回的 JSON 内容
         ## 并且匹配带```json或```的代码块
@@ -224,37 +784,60 @@ class MCPClient:
         json_text = match.group(1) if match else content
         try:
             plan = json.loads(json_text)
-            return plan if isinstance(plan, list) else []
+            plan = plan if isinstance(plan, list) else []
+            if tools is None:
+                self.plan_cache.put(query, self.registry.fingerprint, plan)
+            return plan
         except Exception as e:
             print(f"工具调用链规划失败: {e}\n原始返回: {content}")
             return []
 
     async def cleanup(self):
-        await self.exit_stack.aclose()
+        if self._health_task is not None:
+            self._health_task.cancel()
+        await asyncio.gather(*(self.stop_server(server_id) for server_id in list(self.replicas)))
+        await close_backend()
 
     async def chat_loop(self):
         """
         循环，维持会话，输入 quit 退出循环
+        以 /tools 或 /plan 开头的输入使用对应的执行模式，例如：/tools 今天的天气怎么样
         """
         while True:
             try:
-                query = input("\n用户: ").strip()
+                # 在线程中读取输入，避免阻塞事件循环中的健康检查等后台任务
+                query = (await asyncio.to_thread(input, "\n用户: ")).strip()
                 if query == 'quit':
                     break
-                response = await self.query_match_tools(query)
-                print(f"回答:\n{response}\n")
+                mode = None
+                if query.startswith("/") and query[1:].split(" ", 1)[0] in EXECUTION_MODES:
+                    mode, _, query = query[1:].partition(" ")
+                    query = query.strip()
+                answer_started = False
+                async for event in self.stream_query(query, mode=mode):
+                    if event["type"] == "step_finish":
+                        print(f"步骤 #{event['index'] + 1} {event['name']}：{event['status']}")
+                    elif event["type"] == "token":
+                        if not answer_started:
+                            print("回答:")
+                            answer_started = True
+                        print(event["content"], end="", flush=True)
+                print("\n")
             except Exception as e:
                 print(f"发生错误: {str(e)}")
 
 async def main():
     client = MCPClient()
     print("MCP 客户端已启动！输入'quit'退出\n可使用的工具包括：")
+    metrics_server = None
     try:
-        await client.connect_to_server("Server_main","E:\\Sysu MCP-Based Agent\\mywork\\Server_main.py")
-        await client.connect_to_server("Server_filesystem","E:\\Sysu MCP-Based Agent\\mywork\\Server_filesystem.py")
-        await client.connect_to_server("Server_web_brower","E:\\Sysu MCP-Based Agent\\mywork\\Server_web_brower.py")
+        await client.connect_all(load_server_config())
+        client.start_health_checks()
+        metrics_server = await telemetry.start_metrics_server()
         await client.chat_loop()
     finally:
+        if metrics_server is not None:
+            metrics_server.close()
         await client.cleanup()
 
 
@@ -0,0 +1,127 @@
+"""
+以本地服务的方式运行 MCPClient，同时服务多个用户
+所有连接共享同一组 MCP server 会话与大模型连接池，每个 query 的状态相互独立
+协议为按行分隔的 JSON（TCP 或 Unix socket）：
+    请求：{"id": "q1", "query": "查询今天的天气", "stream": true, "mode": "tools"}，mode 可选（plan 或 tools，默认为 AGENT_MODE）
+    响应：与请求 id 相同的若干事件，事件格式见 MCPClient.stream_query；stream 为 false 时只返回 done
+         出错或服务繁忙时返回 {"id": ..., "type": "error", "error": ...}
+同一个连接上可以同时发送多个请求，响应按 id 区分
+环境变量：
+    MCP_SERVICE_HOST / MCP_SERVICE_PORT: 监听地址（默认 127.0.0.1:8765）
+    MCP_SERVICE_SOCKET: 指定时改为监听该 Unix socket
+    MCP_SERVICE_MAX_INFLIGHT: 同时执行的 query 数量上限（默认 16）
+    MCP_SERVICE_MAX_QUEUE: 等待执行的 query 数量上限，超过后直接拒绝（默认 64）
+"""
+import os
+import json
+import asyncio
+import itertools
+import telemetry
+from Client import MCPClient, load_server_config
+
+
+class ClientService:
+
+    def __init__(self, client: MCPClient, max_inflight: int = None, max_queue: int = None):
+        self.client = client
+        self.max_inflight = max_inflight or int(os.getenv("MCP_SERVICE_MAX_INFLIGHT", 16))
+        self.max_queue = max_queue or int(os.getenv("MCP_SERVICE_MAX_QUEUE", 64))
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        self._waiting = 0
+        self._conversation_ids = itertools.count(1)
+        self.stats = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        一个连接即一个会话，连接内的每个请求作为独立的 task 并发处理
+        """
+        conversation_id = next(self._conversation_ids)
+        write_lock = asyncio.Lock()
+        request_ids = itertools.count(1)
+        tasks = set()
+
+        async def send(message: dict):
+            async with write_lock:
+                writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    query = request["query"]
+                except Exception as e:
+                    await send({"type": "error", "error": f"请求格式错误: {e}"})
+                    continue
+                request_id = request.get("id", f"{conversation_id}-{next(request_ids)}")
+                task = asyncio.create_task(
+                    self.handle_query(request_id, query, request.get("stream", True), send, request.get("mode"))
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def handle_query(self, request_id, query: str, stream: bool, send, mode: str = None):
+        ## 准入控制：等待的请求过多时直接拒绝，避免无限排队
+        if self._waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            telemetry.metrics.inc("service_requests_total", status="rejected")
+            await send({"id": request_id, "type": "error", "error": "服务繁忙，请稍后重试"})
+            return
+        self.stats["accepted"] += 1
+        self._waiting += 1
+        try:
+            await self._inflight.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            async for event in self.client.stream_query(query, mode=mode):
+                if stream or event["type"] == "done":
+                    await send({"id": request_id, **event})
+            self.stats["completed"] += 1
+            telemetry.metrics.inc("service_requests_total", status="completed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            telemetry.metrics.inc("service_requests_total", status="failed")
+            await send({"id": request_id, "type": "error", "error": str(e)})
+        finally:
+            self._inflight.release()
+
+    async def serve(self):
+        socket_path = os.getenv("MCP_SERVICE_SOCKET")
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            print(f"MCP 服务已启动：{socket_path}")
+        else:
+            host = os.getenv("MCP_SERVICE_HOST", "127.0.0.1")
+            port = int(os.getenv("MCP_SERVICE_PORT", 8765))
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"MCP 服务已启动：{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+async def main():
+    client = MCPClient()
+    metrics_server = None
+    try:
+        await client.connect_all(load_server_config())
+        client.start_health_checks()
+        metrics_server = await telemetry.start_metrics_server()
+        await ClientService(client).serve()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+        await client.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
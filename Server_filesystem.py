@@ -1,5 +1,61 @@
 import os
+import sys
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List
 from mcp.server.fastmcp import FastMCP
+from server_runner import run_server
+from file_access import (read_range, read_chunk, read_lines, tail_lines, atomic_write, append_text, apply_operations,
+                         ChunkedUpload, AppendBuffer)
+from text_index import TextIndex
+
+uploads = ChunkedUpload()
+## 工作目录的全文索引，第一次使用时打开
+_text_index = None
+
+
+def get_text_index() -> TextIndex:
+    global _text_index
+    if _text_index is None:
+        _text_index = TextIndex()
+    return _text_index
+
+
+async def reindex(file_name: str, removed: bool = False, appended_after: tuple = None):
+    """
+    文件被写入、追加或删除后更新索引，索引出错不影响文件操作本身
+    整体写入的文件只标记为待更新，在下一次搜索前重建，不在工具调用中重新读取、分词整个文件；
+    追加时 appended_after 为追加前的 (mtime_ns, 大小)，只对追加的部分分词
+    """
+    try:
+        index = get_text_index()
+        if removed:
+            await asyncio.to_thread(index.remove, file_name)
+        elif appended_after is not None:
+            await asyncio.to_thread(index.append, file_name, *appended_after)
+        else:
+            index.mark_dirty(file_name)
+    except Exception as e:
+        # stdio 传输时标准输出用于协议通信，只能写到 stderr
+        print(f"更新索引失败: {e}", file=sys.stderr)
+
+
+## 高频追加的写缓冲，落盘后增量更新索引
+append_buffer = AppendBuffer(on_flush=lambda file_name, previous: reindex(file_name, appended_after=previous))
+
+
+@asynccontextmanager
+async def lifespan():
+    """
+    进程退出时把写缓冲中的内容落盘，由 run_server 在整个进程中只执行一次
+    """
+    try:
+        yield {}
+    finally:
+        await append_buffer.close()
+
 
 mcp = FastMCP("Server")
 
@@ -14,8 +70,9 @@ async def create_file(file_name: str, content: str) -> str:
     	(str) 创建成功消息
     """
     try:
-        with open(file_name, "w", encoding="utf-8") as file:
-            file.write(content)
+        await append_buffer.flush(file_name)
+        await asyncio.to_thread(atomic_write, file_name, content)
+        await reindex(file_name)
         return f"文件'{file_name}'创建成功"
     except Exception as e:
         return {"error": f"创建文件失败: {str(e)}"}
@@ -23,13 +80,14 @@ async def create_file(file_name: str, content: str) -> str:
 @mcp.tool()
 async def read_file(file_name: str) -> str:
     """
-    读取文件内容
+    读取文件的全部内容，大文件请使用 read_file_lines、head_file、tail_file 或 read_file_chunk 按需读取
     arguments: 
     	file_name (str): 文件名
     return: 
     	(str) 文件内容或错误消息
     """
     try:
+        await append_buffer.flush(file_name)
         with open(file_name, "r", encoding="utf-8") as file:
             return file.read()
     except FileNotFoundError:
@@ -37,6 +95,105 @@ async def read_file(file_name: str) -> str:
     except Exception as e:
         return {"error": f"读取文件失败: {str(e)}"}
 
+@mcp.tool()
+async def read_file_range(file_name: str, offset: int = 0, length: int = 4096) -> str:
+    """
+    按字节范围读取文件内容，适合大文件，起止位置会对齐到完整的字符
+    arguments:
+        file_name (str): 文件名
+        offset (int): 起始字节偏移，负数表示从文件末尾倒数
+        length (int): 读取的字节数，单次有上限
+    return:
+        (str) JSON：text（内容）、offset、next_offset（下一段的起始偏移）、size（文件大小）、eof（是否读到末尾）
+    """
+    try:
+        await append_buffer.flush(file_name)
+        result = await asyncio.to_thread(read_range, file_name, offset, length)
+        return json.dumps(result, ensure_ascii=False)
+    except FileNotFoundError:
+        return {"error": f"文件'{file_name}'未找到"}
+    except Exception as e:
+        return {"error": f"读取文件失败: {str(e)}"}
+
+@mcp.tool()
+async def read_file_lines(file_name: str, start_line: int = 1, num_lines: int = 100) -> str:
+    """
+    按行号读取文件内容，适合大文件
+    arguments:
+        file_name (str): 文件名
+        start_line (int): 起始行号，从 1 开始
+        num_lines (int): 读取的行数
+    return:
+        (str) JSON：text（内容）、start_line、end_line（实际读到的最后一行）、truncated（最后一行是否过长被截断）、eof（是否读到末尾）
+    """
+    try:
+        await append_buffer.flush(file_name)
+        result = await asyncio.to_thread(read_lines, file_name, start_line, num_lines)
+        return json.dumps(result, ensure_ascii=False)
+    except FileNotFoundError:
+        return {"error": f"文件'{file_name}'未找到"}
+    except Exception as e:
+        return {"error": f"读取文件失败: {str(e)}"}
+
+@mcp.tool()
+async def head_file(file_name: str, num_lines: int = 20) -> str:
+    """
+    读取文件开头的若干行
+    arguments:
+        file_name (str): 文件名
+        num_lines (int): 行数(默认为：20)
+    return:
+        (str) JSON：text（内容）、start_line、end_line（实际读到的最后一行）、truncated（最后一行是否过长被截断）、eof（是否读到末尾）
+    """
+    try:
+        await append_buffer.flush(file_name)
+        result = await asyncio.to_thread(read_lines, file_name, 1, num_lines)
+        # 返回 JSON 而不是原文：内容中的 "error" 字样会被 client 当作工具调用失败
+        return json.dumps(result, ensure_ascii=False)
+    except FileNotFoundError:
+        return {"error": f"文件'{file_name}'未找到"}
+    except Exception as e:
+        return {"error": f"读取文件失败: {str(e)}"}
+
+@mcp.tool()
+async def tail_file(file_name: str, num_lines: int = 20) -> str:
+    """
+    读取文件末尾的若干行，比如查看日志的最新内容
+    arguments:
+        file_name (str): 文件名
+        num_lines (int): 行数(默认为：20)
+    return:
+        (str) JSON：text（内容）、num_lines（实际读到的行数）、offset（内容的起始字节偏移）、size（文件大小）
+    """
+    try:
+        await append_buffer.flush(file_name)
+        result = await asyncio.to_thread(tail_lines, file_name, num_lines)
+        return json.dumps(result, ensure_ascii=False)
+    except FileNotFoundError:
+        return {"error": f"文件'{file_name}'未找到"}
+    except Exception as e:
+        return {"error": f"读取文件失败: {str(e)}"}
+
+@mcp.tool()
+async def read_file_chunk(file_name: str, cursor: str = "", chunk_size: int = 16384) -> str:
+    """
+    分块顺序读取整个大文件：第一次调用 cursor 为空，之后传入上一次返回的 cursor，直到返回的 cursor 为空
+    arguments:
+        file_name (str): 文件名
+        cursor (str): 上一次返回的 cursor，第一次读取时为空
+        chunk_size (int): 每块的字节数，每块尽量在换行处结束
+    return:
+        (str) JSON：text（内容）、offset、size（文件大小）、cursor（下一块的 cursor，为空表示已读完）
+    """
+    try:
+        await append_buffer.flush(file_name)
+        result = await asyncio.to_thread(read_chunk, file_name, cursor, chunk_size)
+        return json.dumps(result, ensure_ascii=False)
+    except FileNotFoundError:
+        return {"error": f"文件'{file_name}'未找到"}
+    except Exception as e:
+        return {"error": f"读取文件失败: {str(e)}"}
+
 @mcp.tool()
 async def write_file(file_name: str, content: str) -> str:
     """
@@ -48,29 +205,84 @@ async def write_file(file_name: str, content: str) -> str:
     	(str) 写入成功消息
     """
     try:
-        with open(file_name, "w", encoding="utf-8") as file:
-            file.write(content)
+        await append_buffer.flush(file_name)
+        await asyncio.to_thread(atomic_write, file_name, content)
+        await reindex(file_name)
         return f"文件'{file_name}'写入成功"
     except Exception as e:
         return {"error": f"写入文件失败: {str(e)}"}
 
 @mcp.tool()
-async def append_file(file_name: str, content: str) -> str:
+async def append_file(file_name: str, content: str, buffered: bool = False) -> str:
     """
     向文件追加内容（不覆盖原有内容）
     arguments:
         file_name (str): 文件名
         content (str): 要追加的内容
+        buffered (bool): 是否先放入写缓冲，与之后的追加合并写入，适合日志等高频的小段追加(默认为：false)
     return:
         (str) 操作成功消息或错误消息
     """
     try:
-        with open(file_name, "a", encoding="utf-8") as file:
-            file.write(content)
+        if buffered:
+            await append_buffer.append(file_name, content)
+            return f"内容已成功追加到文件'{file_name}'（写缓冲中，稍后落盘）"
+        await append_buffer.flush(file_name)
+        previous = await asyncio.to_thread(append_text, file_name, content)
+        await reindex(file_name, appended_after=previous)
         return f"内容已成功追加到文件'{file_name}'"
     except Exception as e:
         return {"error": f"写入文件失败: {str(e)}"}
 
+@mcp.tool()
+async def write_file_chunk(file_name: str, content: str, upload_id: str = "", offset: int = -1, final: bool = False) -> str:
+    """
+    分块写入大文件（覆盖原有内容）：第一块 upload_id 为空，之后传入返回的 upload_id，最后一块 final 为 true
+    所有分块到齐后才替换原文件，中途失败时原文件保持不变
+    arguments:
+        file_name (str): 文件名
+        content (str): 本块的内容
+        upload_id (str): 第一块为空，之后为第一块返回的 upload_id
+        offset (int): 本块在整个内容中的字节偏移，用于检查分块是否重复或丢失，-1 表示不检查
+        final (bool): 是否为最后一块
+    return:
+        (str) JSON：upload_id、received（已接收的字节数）、final
+    """
+    return await upload_chunk(file_name, content, "write", upload_id, offset, final)
+
+@mcp.tool()
+async def append_file_chunk(file_name: str, content: str, upload_id: str = "", offset: int = -1, final: bool = False) -> str:
+    """
+    分块向文件追加大段内容：第一块 upload_id 为空，之后传入返回的 upload_id，最后一块 final 为 true
+    所有分块到齐后才一次性追加到文件末尾，中途失败时原文件保持不变
+    arguments:
+        file_name (str): 文件名
+        content (str): 本块的内容
+        upload_id (str): 第一块为空，之后为第一块返回的 upload_id
+        offset (int): 本块在整个内容中的字节偏移，用于检查分块是否重复或丢失，-1 表示不检查
+        final (bool): 是否为最后一块
+    return:
+        (str) JSON：upload_id、received（已接收的字节数）、final
+    """
+    return await upload_chunk(file_name, content, "append", upload_id, offset, final)
+
+async def upload_chunk(file_name: str, content: str, mode: str, upload_id: str, offset: int, final: bool):
+    try:
+        if final:
+            await append_buffer.flush(file_name)
+        result = await asyncio.to_thread(
+            uploads.write_chunk, file_name, content, mode, upload_id, None if offset < 0 else offset, final
+        )
+        if final:
+            await reindex(file_name)
+            if mode == "write":
+                return f"文件'{file_name}'写入成功"
+            return f"内容已成功追加到文件'{file_name}'"
+        return json.dumps(result, ensure_ascii=False)
+    except Exception as e:
+        # 出错时保留已接收的分块，client 可以按 received 重新发送，长时间没有新分块的上传会被清理
+        return {"error": f"写入文件失败: {str(e)}"}
+
 @mcp.tool()
 async def delete_file(file_name: str) -> str:
     """
@@ -81,14 +293,71 @@ async def delete_file(file_name: str) -> str:
         (str) 删除成功消息或错误消息
     """
     try:
+        await append_buffer.flush(file_name)
         if not os.path.exists(file_name):
             return {"error": f"文件'{file_name}'不存在"}
         os.remove(file_name)
-        return {"error": f"文件'{file_name}'删除成功"}
+        await reindex(file_name, removed=True)
+        return f"文件'{file_name}'删除成功"
     except PermissionError:
         return {"error": f"无权限删除文件'{file_name}'"}
     except Exception as e:
         return {"error": f"删除文件失败: {str(e)}"}
-    
+
+@mcp.tool()
+async def batch_file_operations(operations: List[Dict], all_or_nothing: bool = False) -> str:
+    """
+    一次执行多个文件操作，比逐个调用 create_file、write_file、append_file、delete_file 少很多次往返
+    同一个文件的多个操作按顺序合并后一次写入，每个文件通过临时文件替换，不会出现写了一半的文件
+    arguments:
+        operations (List[Dict]): 按顺序执行的操作，每项为 {"op": "create" | "write" | "append" | "delete", "file_name": 文件名, "content": 内容}
+        all_or_nothing (bool): 为 true 时任意一个操作失败则所有文件都保持原样；为 false 时只有出错的文件保持原样(默认为：false)
+    return:
+        (str) 全部成功时返回成功消息，否则返回 JSON：error、ok、changed / removed（已经生效的文件）、
+              results（每个操作的 status：ok、error 或未生效的 rolled_back，以及 error）
+              部分文件已经生效时 error 中注明不可重试，重新执行整个批量操作会重复已经生效的追加
+    """
+    try:
+        for file_name in {operation.get("file_name") for operation in operations if operation.get("file_name")}:
+            await append_buffer.flush(file_name)
+        result = await asyncio.to_thread(apply_operations, operations, all_or_nothing)
+        for file_name in result["changed"]:
+            await reindex(file_name)
+        for file_name in result["removed"]:
+            await reindex(file_name, removed=True)
+        if result["ok"]:
+            return f"{len(operations)}个文件操作已成功执行，涉及文件：{'、'.join(result['changed'] + result['removed'])}"
+        if result["changed"] or result["removed"]:
+            error = "批量文件操作部分生效，不可重试，请只重新执行出错的操作"
+        else:
+            error = "批量文件操作未生效，所有文件保持原样"
+        return {"error": error, **result}
+    except Exception as e:
+        return {"error": f"批量文件操作失败: {str(e)}"}
+
+@mcp.tool()
+async def search_files(query: str, top_k: int = 5) -> str:
+    """
+    在工作目录的所有文本文件中全文搜索，找出哪些文件提到了某些内容，不需要逐个读取文件
+    arguments:
+        query (str): 要查找的内容（关键词或一句话）
+        top_k (int): 返回的文件数量上限(默认为：5)
+    return:
+        (str) JSON：results 为按相关性排序的文件，每个文件包含 file（相对工作目录的路径）、score、
+              snippets（命中的片段，offset 为字节偏移，可配合 read_file_range 读取上下文，line 为行号），
+              没有命中时 results 为空，message 中说明
+    """
+    try:
+        start = time.perf_counter()
+        await append_buffer.flush_all()
+        results = await asyncio.to_thread(get_text_index().search, query, top_k)
+        took_ms = round((time.perf_counter() - start) * 1000, 2)
+        response = {"results": results, "took_ms": took_ms}
+        if not results:
+            response["message"] = f"工作目录中没有找到与'{query}'相关的内容"
+        return json.dumps(response, ensure_ascii=False)
+    except Exception as e:
+        return {"error": f"搜索失败: {str(e)}"}
+
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
\ No newline at end of file
+    run_server(mcp, lifespan=lifespan)
\ No newline at end of file
@@ -1,33 +1,40 @@
 import os
 import json
-import smtplib
-import ast
-import operator
-import math
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List
 from datetime import datetime
 from email.message import EmailMessage
 from mcp.server.fastmcp import FastMCP
+from server_runner import run_server
+from expression_eval import evaluate, evaluate_batch
+from mail_delivery import MailQueue
 from dotenv import load_dotenv
 
 load_dotenv()
+## 邮件后台发送队列，send_email 等待投递结果的最长秒数
+mail_queue = MailQueue()
+MAIL_SEND_WAIT = float(os.getenv("MAIL_SEND_WAIT", 30))
+
+
+@asynccontextmanager
+async def lifespan():
+    """
+    进程退出时把队列中的邮件发送完，再关闭 SMTP 连接，由 run_server 在整个进程中只执行一次
+    """
+    try:
+        yield {}
+    finally:
+        await mail_queue.close()
+
+
 mcp = FastMCP("Server")
 
-@mcp.tool()
-async def send_email(to: str, subject: str, body: str, attachmentfilename: str) -> str:
+def build_message(to: str, subject: str, body: str, attachmentfilename: str):
     """
-    发送邮件，支持带附件。
-    arguments:
-        to (str): 收件人邮箱地址
-        subject (str): 邮件标题(默认为：机器发送)
-        body (str): 邮件正文(默认为：您好)
-        attachmentfilename (str): 保存的 Markdown 文件名（不含路径），若无附件则为字符串："noattach"
-    return:
-        (str) 邮件发送状态说明
+    构造邮件，附件不存在或读取失败时返回 error 字典
     """
-    smtp_server = os.getenv("SMTP_SERVER")
-    smtp_port = int(os.getenv("SMTP_PORT", 465))
     sender_email = os.getenv("EMAIL_USER")
-    sender_pass = os.getenv("EMAIL_PASS")
 
     if attachmentfilename != "noattach":
         # 如果存在附件，则进一步检查地址合法性
@@ -39,7 +46,7 @@ async def send_email(to: str, subject: str, body: str, attachmentfilename: str)
     masage["To"] = to
     masage.set_content(body)
 
-    # 添加附件并发送邮件
+    # 添加附件
     if attachmentfilename != "noattach":
         try:
             with open(attachmentfilename, "rb") as f:
@@ -48,13 +55,65 @@ async def send_email(to: str, subject: str, body: str, attachmentfilename: str)
                 masage.add_attachment(file_data, maintype="application", subtype="octet-stream", filename=file_name)
         except Exception as e:
             return {"error": f"附件读取失败: {str(e)}"}
+    return masage
+
+@mcp.tool()
+async def send_email(to: str, subject: str, body: str, attachmentfilename: str) -> str:
+    """
+    发送邮件，支持带附件。
+    arguments:
+        to (str): 收件人邮箱地址
+        subject (str): 邮件标题(默认为：机器发送)
+        body (str): 邮件正文(默认为：您好)
+        attachmentfilename (str): 保存的 Markdown 文件名（不含路径），若无附件则为字符串："noattach"
+    return:
+        (str) 邮件发送状态说明
+    """
+    masage = build_message(to, subject, body, attachmentfilename)
+    if isinstance(masage, dict):
+        return masage
+    ## 通过后台队列复用已登录的连接发送，在 MAIL_SEND_WAIT 秒内等待投递结果
+    job = await mail_queue.submit(masage)
     try:
-        with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-            server.login(sender_email, sender_pass)
-            server.send_message(masage)
+        await asyncio.wait_for(asyncio.shield(job.done), timeout=MAIL_SEND_WAIT)
+    except asyncio.TimeoutError:
+        return f"邮件已加入发送队列，编号：{job.id}，仍在发送中"
+    if job.status == "sent":
         return f"邮件已成功发送给 {to}"
-    except Exception as e:
-        return {"error": f"邮件发送失败: {str(e)}"}
+    return {"error": f"邮件发送失败: {job.error}"}
+
+@mcp.tool()
+async def queue_email(to: str, subject: str, body: str, attachmentfilename: str) -> str:
+    """
+    将邮件加入后台发送队列，立即返回邮件编号，不等待发送完成，适合批量发送通知。
+    arguments:
+        to (str): 收件人邮箱地址
+        subject (str): 邮件标题(默认为：机器发送)
+        body (str): 邮件正文(默认为：您好)
+        attachmentfilename (str): 保存的 Markdown 文件名（不含路径），若无附件则为字符串："noattach"
+    return:
+        (str) 邮件编号，可用 email_status 查询发送状态
+    """
+    masage = build_message(to, subject, body, attachmentfilename)
+    if isinstance(masage, dict):
+        return masage
+    job = await mail_queue.submit(masage)
+    return f"邮件已加入发送队列，编号：{job.id}"
+
+@mcp.tool()
+async def email_status(message_id: str) -> str:
+    """
+    查询通过 queue_email 或 send_email 提交的邮件的发送状态。
+    arguments:
+        message_id (str): 邮件编号
+    return:
+        (str) JSON：id、status（queued 排队中、sending 发送中、retrying 等待重试、sent 已发送、failed 发送失败）、
+              attempts（已尝试的次数），曾经发送失败时还有 last_failure（最近一次失败的原因）
+    """
+    status = mail_queue.status(message_id)
+    if status is None:
+        return {"error": f"没找到该邮件: {message_id}"}
+    return json.dumps(status, ensure_ascii=False)
 
 @mcp.tool()
 async def calculate(expression: str) -> str:
@@ -65,53 +124,30 @@ async def calculate(expression: str) -> str:
     return:
         (str): 数学表达式的结果
     """
-    allowed_operators = {
-        ast.Add: operator.add,
-        ast.Sub: operator.sub,
-        ast.Mult: operator.mul,
-        ast.Div: operator.truediv,
-        ast.FloorDiv: operator.floordiv,
-        ast.Mod: operator.mod,
-        ast.Pow: operator.pow,
-        ast.USub: operator.neg,
-    }
-    allowed_names = {
-        k: getattr(math, k)
-        for k in dir(math)
-        if not k.startswith("__")
-    }
-    allowed_names.update({
-        "pi": math.pi,
-        "e": math.e,
-    })
-
-    def eval_expr(node):
-        if isinstance(node, ast.Constant):
-            return node.value
-        elif isinstance(node, ast.Name):
-            if node.id in allowed_names:
-                return allowed_names[node.id]
-            raise ValueError(f"Unknown identifier: {node.id}")
-        elif isinstance(node, ast.BinOp):
-            left = eval_expr(node.left)
-            right = eval_expr(node.right)
-            if type(node.op) in allowed_operators:
-                return allowed_operators[type(node.op)](left, right)
-        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
-            return -eval_expr(node.operand)
-        elif isinstance(node, ast.Call):
-            func = eval_expr(node.func)
-            args = [eval_expr(arg) for arg in node.args]
-            return func(*args)
-        raise ValueError(f"Unsupported operation: {ast.dump(node)}")
     try:
-        expression = expression.replace('^', '**').replace('×', '*').replace('÷', '/')
-        parsed_expr = ast.parse(expression, mode='eval')
-        result = eval_expr(parsed_expr.body)
+        ## 白名单在导入时构建，解析、校验后的表达式按归一化后的字符串缓存
+        result = evaluate(expression)
         return str(result)
     except Exception as e:
         return {"error": f"表达式计算失败: {str(e)}"}
 
+@mcp.tool()
+async def calculate_batch(expression: str = "", bindings: List[Dict[str, float]] = None, expressions: List[str] = None) -> str:
+    """
+    批量计算数学表达式，适合同一个公式代入多组数值，或者一次计算多个互不相关的表达式。
+    arguments:
+        expression (str): 含变量的数学表达式，例如 "x**2 + sin(y)"，符号要求与 calculate 相同
+        bindings (list): 变量取值的列表，例如 [{"x": 1, "y": 0}, {"x": 2, "y": 0.5}]，每组得到一个结果
+        expressions (list): 不含变量的多个表达式，提供时忽略 expression 与 bindings
+    return:
+        (str): JSON 数组，与输入一一对应，计算失败的位置为 {"failed": ...}
+    """
+    try:
+        results = evaluate_batch(expression, bindings, expressions)
+        return json.dumps(results, ensure_ascii=False, default=str)
+    except Exception as e:
+        return {"error": f"表达式计算失败: {str(e)}"}
+
 @mcp.tool()
 async def get_time() -> str:
     """
@@ -126,5 +162,5 @@ async def get_time() -> str:
     return str(formatted_time)
 
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
+    run_server(mcp, lifespan=lifespan)
 
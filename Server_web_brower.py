@@ -1,18 +1,130 @@
 import os
-from typing import Dict, List
-from urllib.parse import quote_plus
+import sys
+import asyncio
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List
+from urllib.parse import quote_plus, urlsplit
 import httpx
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from mcp.server.fastmcp import FastMCP
-from openai import OpenAI
+from server_runner import run_server
+from llm_backend import get_backend, close_backend
+from web_cache import WebCache
+from summary_cache import SummaryCache
+from html_extract import MainTextExtractor, extract_main_text
+import telemetry
 
 load_dotenv()
-mcp = FastMCP("Server")
 
 GOOGLE_SEARCH_API_KEY = os.getenv("GOOGLE_SEARCH_API_KEY")
 GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID")
+## Custom Search API 地址，离线测试时可以指向本地的 stub server
+GOOGLE_SEARCH_ENDPOINT = os.getenv("GOOGLE_SEARCH_ENDPOINT", "https://www.googleapis.com/customsearch/v1")
+## 是否启用本地的搜索结果与网页缓存
+WEB_CACHE_ENABLED = os.getenv("WEB_CACHE_ENABLED", "1") == "1"
+## 并发抓取网页的数量上限，以及一次 web_search 抓取与摘要的总时限（秒）
+WEB_FETCH_CONCURRENCY = int(os.getenv("WEB_FETCH_CONCURRENCY", 4))
+WEB_SEARCH_DEADLINE = float(os.getenv("WEB_SEARCH_DEADLINE", 30))
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+## 共享 HTTP 客户端的连接池配置，HTTP/2 需要安装 h2
+WEB_MAX_CONNECTIONS = int(os.getenv("WEB_MAX_CONNECTIONS", 20))
+WEB_PER_HOST_CONCURRENCY = int(os.getenv("WEB_PER_HOST_CONCURRENCY", 2))
+WEB_HTTP2 = os.getenv("WEB_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+## 整个 server 进程共享的 HTTP 客户端，以及每个 host 的并发信号量
+_http_client = None
+_host_semaphores = {}
+_web_cache = None
+## 网页摘要与最终摘要的缓存
+summary_cache = SummaryCache()
+
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=WEB_HTTP2,
+        headers={"User-Agent": USER_AGENT},
+        timeout=httpx.Timeout(10.0, connect=5.0),
+        limits=httpx.Limits(
+            max_connections=WEB_MAX_CONNECTIONS,
+            max_keepalive_connections=WEB_MAX_CONNECTIONS,
+            keepalive_expiry=30.0,
+        ),
+        follow_redirects=True,
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取共享的 HTTP 客户端，正常情况下在进程启动时由 lifespan 创建
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = create_http_client()
+    return _http_client
+
+
+def get_web_cache():
+    """
+    获取本地的搜索结果与网页缓存，未启用时返回 None
+    """
+    global _web_cache
+    if WEB_CACHE_ENABLED and _web_cache is None:
+        _web_cache = WebCache()
+    return _web_cache
+
+
+def host_semaphore(url: str) -> asyncio.Semaphore:
+    """
+    同一个 host 同时进行的请求数量上限，避免对单个站点并发过多
+    """
+    host = urlsplit(url).netloc
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(WEB_PER_HOST_CONCURRENCY)
+    return _host_semaphores[host]
+
+
+@asynccontextmanager
+async def lifespan():
+    """
+    进程启动时创建共享的 HTTP 客户端，进程退出时释放连接、关闭缓存与大模型客户端，由 run_server 在整个进程中只执行一次
+    """
+    global _http_client, _web_cache
+    _http_client = create_http_client()
+    try:
+        yield {}
+    finally:
+        await _http_client.aclose()
+        _http_client = None
+        if _web_cache is not None:
+            _web_cache.close()
+            _web_cache = None
+        # stdio 传输时标准输出用于协议通信，只能写到 stderr
+        print(f"摘要缓存：{summary_cache.stats}，省下的大模型调用 {summary_cache.saved_calls} 次", file=sys.stderr)
+        summary_cache.close()
+        await close_backend()
+
+
+mcp = FastMCP("Server")
+
+
+async def summarize(subquery: str, content: str, prompt: str) -> str:
+    """
+    调用大模型总结 content，相同内容、相同 subquery 的摘要会复用缓存，同时到达的相同请求只调用一次
+    """
+    backend = get_backend()
+
+    async def compute():
+        response = await backend.chat(
+            messages=[
+                {"role": "system", "content": "你是一个总结能力很强的阅读助手，擅长根据需求，整理、总结材料"},
+                {"role": "user", "content": prompt}
+            ],
+            call_site="summarize",
+        )
+        return response.choices[0].message.content.strip()
+
+    return await summary_cache.get_or_compute(content, subquery, backend.model, compute)
 
 
 async def google_search(query: str, num_results: int = 5) -> List[Dict[str, str]]:
@@ -24,21 +136,31 @@ async def google_search(query: str, num_results: int = 5) -> List[Dict[str, str]
     lang = "zh"
     country = "cn"
     if GOOGLE_SEARCH_API_KEY and GOOGLE_CSE_ID:
-        async with httpx.AsyncClient() as client:
-            url = f"https://www.googleapis.com/customsearch/v1?q={quote_plus(query)}&key={GOOGLE_SEARCH_API_KEY}&cx={GOOGLE_CSE_ID}&num={num_results}&lr=lang_{lang}&gl={country}"
-            response = await client.get(url)
-            if response.status_code == 200:
-                results = response.json()
-                structured_results = []
-                for item in results.get("items", []):
-                    structured_results.append({
-                        "title": item.get("title", ""),
-                        "link": item.get("link", ""),
-                        "snippet": item.get("snippet", "")
-                    })
-                return structured_results
-            else:
-                return [{"error": f"Google API error: {response.status_code} - {response.text}"}]
+        cache = get_web_cache()
+        if cache is not None:
+            cached_results = await asyncio.to_thread(cache.get_search, query, num_results, lang, country)
+            telemetry.metrics.inc("web_cache_total", kind="search", result="miss" if cached_results is None else "hit")
+            if cached_results is not None:
+                return cached_results
+        url = f"{GOOGLE_SEARCH_ENDPOINT}?q={quote_plus(query)}&key={GOOGLE_SEARCH_API_KEY}&cx={GOOGLE_CSE_ID}&num={num_results}&lr=lang_{lang}&gl={country}"
+        with telemetry.span("web.search", num_results=num_results) as search_span:
+            async with host_semaphore(url):
+                response = await get_http_client().get(url)
+            search_span.set(status=response.status_code)
+        if response.status_code == 200:
+            results = response.json()
+            structured_results = []
+            for item in results.get("items", []):
+                structured_results.append({
+                    "title": item.get("title", ""),
+                    "link": item.get("link", ""),
+                    "snippet": item.get("snippet", "")
+                })
+            if cache is not None:
+                await asyncio.to_thread(cache.put_search, query, num_results, lang, country, structured_results)
+            return structured_results
+        else:
+            return [{"error": f"Google API error: {response.status_code} - {response.text}"}]
     else:
         print("Google search API or engine 存在问题")
         return [{"error": "Google API error"}]
@@ -53,38 +175,69 @@ async def extract_webpage_content(subquery: str, url: str, max_length: int = 200
         "User-Agent": USER_AGENT,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8"
     }
+    ## 流式读取网页，收集到足够的正文后就停止下载，不构建完整的文档树
+    extractor = MainTextExtractor(max_length=max_length)
+
+    async def read_body(response):
+        return await extractor.consume(response.aiter_text())
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, follow_redirects=True, timeout=10.0)
-            
-            if response.status_code != 200:
-                return {"error": f"Failed to fetch URL: HTTP {response.status_code}"}
-            soup = BeautifulSoup(response.text, 'html.parser')
-            ## 把没用的内容除去，然后提取主要内容
-            for element in soup(["script", "style", "nav", "footer", "iframe"]):
-                element.decompose()
-            main_content = soup.find("main") or soup.find("article") or soup
-            text = " ".join(main_content.get_text().split())
-            text = text[:max_length] if max_length > 0 else text
-            try:
-                deepseek_api_key = os.getenv("DASHSCOPE_API_KEY")
-                base_url = os.getenv("BASE_URL")
-                model = os.getenv("MODEL")
-                client = OpenAI(api_key=deepseek_api_key, base_url=base_url)
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "你是一个总结能力很强的阅读助手，擅长根据需求，整理、总结材料"},
-                        {"role": "user", "content": f"你要解决“{subquery}”这个问题，现在需要你以解决问题为目标，将以下web的内容整理、总结，不多于200字：{text}"}
-                    ]
-                )
-                result = response.choices[0].message.content.strip()
-            except Exception as e:
-                result = str(e)
-            return result
+        cache = get_web_cache()
+        with telemetry.span("web.fetch", host=urlsplit(url).netloc) as fetch_span:
+            async with host_semaphore(url):
+                if cache is not None:
+                    status_code, html, from_cache = await cache.fetch_page(get_http_client(), url, headers, read_body)
+                else:
+                    async with get_http_client().stream("GET", url, headers=headers) as response:
+                        status_code, from_cache = response.status_code, False
+                        if status_code == 200:
+                            await read_body(response)
+            fetch_span.set(status=status_code, from_cache=from_cache)
+        telemetry.metrics.inc("web_fetch_total", status=status_code, from_cache=from_cache)
+
+        if status_code != 200:
+            return {"error": f"Failed to fetch URL: HTTP {status_code}"}
+        ## 缓存中保存的是之前读取过的 HTML 片段，重新提取即可
+        text = extract_main_text(html, max_length) if from_cache else extractor.text()
+        try:
+            result = await summarize(
+                subquery, text,
+                f"你要解决“{subquery}”这个问题，现在需要你以解决问题为目标，将以下web的内容整理、总结，不多于200字：{text}"
+            )
+        except Exception as e:
+            result = str(e)
+        return result
     except Exception as e:
         return {"error": f"网页处理出现错误: {str(e)}"}
 
+async def iter_summaries(subquery: str, links: List[str]) -> AsyncIterator[str]:
+    """
+    并发抓取并总结各个网页，按完成的先后顺序逐个产出摘要
+    同时进行的抓取数量受 WEB_FETCH_CONCURRENCY 限制，超过 WEB_SEARCH_DEADLINE 仍未完成的网页直接丢弃
+    """
+    semaphore = asyncio.Semaphore(WEB_FETCH_CONCURRENCY)
+
+    async def fetch(link: str):
+        async with semaphore:
+            return await extract_webpage_content(subquery, link)
+
+    tasks = [asyncio.create_task(fetch(link)) for link in links]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=WEB_SEARCH_DEADLINE):
+            try:
+                content = await next_done
+            except asyncio.TimeoutError:
+                break
+            except Exception:
+                continue
+            ## 抓取失败的网页返回的是 error 字典，直接跳过
+            if isinstance(content, str) and content:
+                yield content
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
 @mcp.tool()
 async def web_search(subquery: str, keyword: str, num_results: int) -> str:
     """
@@ -102,29 +255,21 @@ async def web_search(subquery: str, keyword: str, num_results: int) -> str:
     if "error" in search_results[0]:
         return {"error": f"网页处理出现错误"}
     
-    summaries = []
-    for result in search_results:
-        if "link" in result:
-            content = await extract_webpage_content(subquery, result["link"])
-            summaries.append(content)
+    links = [result["link"] for result in search_results if "link" in result]
+    summaries = [content async for content in iter_summaries(subquery, links)]
+    if not summaries:
+        return {"error": "网页抓取全部失败或超时"}
 
     ## 将每个url的摘要进一步总结
     try:
-        deepseek_api_key = os.getenv("DASHSCOPE_API_KEY")
-        base_url = os.getenv("BASE_URL")
-        model = os.getenv("MODEL")
-        client = OpenAI(api_key=deepseek_api_key, base_url=base_url)
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "你是一个总结能力很强的阅读助手，擅长根据需求，整理、总结材料"},
-                {"role": "user", "content": f"你要解决“{subquery}”这个问题，现在需要你以解决问题为目标，将以下材料整理总结，不能输出json等结构化文本，字数上限500字：{summaries}"}
-            ],
+        ## 摘要按完成顺序到达，排序后再作为缓存的 key，相同的一组摘要能够命中
+        summary = await summarize(
+            subquery, "\n".join(sorted(summaries)),
+            f"你要解决“{subquery}”这个问题，现在需要你以解决问题为目标，将以下材料整理总结，不能输出json等结构化文本，字数上限500字：{summaries}"
         )
-        summary = response.choices[0].message.content.strip()
         return summary
     except Exception as e:
         return {"error": f"总结处理出现错误: {str(e)}"}
 
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
\ No newline at end of file
+    run_server(mcp, lifespan=lifespan)
\ No newline at end of file
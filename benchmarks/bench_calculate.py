@@ -0,0 +1,100 @@
+"""
+calculate 的微基准：
+    original: 原先的实现，每次调用都重建白名单、ast.parse、递归遍历求值
+    compiled: expression_eval，白名单只构建一次，编译结果按表达式缓存
+    batch: evaluate_batch 对同一个表达式代入多组变量（安装 NumPy 时向量化）
+用法：
+    python benchmarks/bench_calculate.py [--n 20000]
+"""
+import os
+import sys
+import ast
+import math
+import time
+import argparse
+import operator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from expression_eval import evaluate, evaluate_batch, np
+
+EXPRESSIONS = [
+    "1 + 2 * 3",
+    "(3.5 + 4.25) * 2 ^ 3 / 7",
+    "sqrt(16) + sin(pi / 6) * log(e ** 2)",
+    "factorial(10) / (2 ** 5) - 100 % 7",
+]
+
+
+def original_calculate(expression: str):
+    allowed_operators = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+        ast.USub: operator.neg,
+    }
+    allowed_names = {
+        k: getattr(math, k)
+        for k in dir(math)
+        if not k.startswith("__")
+    }
+    allowed_names.update({
+        "pi": math.pi,
+        "e": math.e,
+    })
+
+    def eval_expr(node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        elif isinstance(node, ast.Name):
+            if node.id in allowed_names:
+                return allowed_names[node.id]
+            raise ValueError(f"Unknown identifier: {node.id}")
+        elif isinstance(node, ast.BinOp):
+            left = eval_expr(node.left)
+            right = eval_expr(node.right)
+            if type(node.op) in allowed_operators:
+                return allowed_operators[type(node.op)](left, right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -eval_expr(node.operand)
+        elif isinstance(node, ast.Call):
+            func = eval_expr(node.func)
+            args = [eval_expr(arg) for arg in node.args]
+            return func(*args)
+        raise ValueError(f"Unsupported operation: {ast.dump(node)}")
+    expression = expression.replace('^', '**').replace('×', '*').replace('÷', '/')
+    parsed_expr = ast.parse(expression, mode='eval')
+    return eval_expr(parsed_expr.body)
+
+
+def bench(name: str, func, n: int):
+    start = time.perf_counter()
+    for i in range(n):
+        func(EXPRESSIONS[i % len(EXPRESSIONS)])
+    elapsed = time.perf_counter() - start
+    print(f"{name:10s} {n} 次  总耗时 {elapsed:8.3f}s  每次 {elapsed / n * 1e6:8.2f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    args = parser.parse_args()
+
+    for expression in EXPRESSIONS:
+        assert math.isclose(original_calculate(expression), evaluate(expression)), expression
+    bench("original", original_calculate, args.n)
+    bench("compiled", evaluate, args.n)
+
+    bindings = [{"x": i * 0.001, "y": i * 0.002} for i in range(args.n)]
+    start = time.perf_counter()
+    evaluate_batch("x ** 2 + sin(y) * sqrt(x + 1)", bindings)
+    elapsed = time.perf_counter() - start
+    mode = "NumPy 向量化" if np is not None else "逐组计算"
+    print(f"{'batch':10s} {args.n} 组  总耗时 {elapsed:8.3f}s  每组 {elapsed / args.n * 1e6:8.2f}us（{mode}）")
+
+
+if __name__ == "__main__":
+    main()
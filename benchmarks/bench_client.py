@@ -0,0 +1,282 @@
+"""
+MCPClient 的离线端到端基准，不需要 .env 中的大模型、Google 搜索与邮箱账号：
+    启动 stub_services.py（模拟大模型、Google 搜索与网页、SMTP sink），以及真实的 Server_main.py、Server_web_brower.py 进程，
+    按 stub_services.SCENARIOS 中写好的工具链运行固定的负载：
+        single: 单个工具
+        chain: 通过 {{calculate}} 串联的工具链
+        web: web_search 并发抓取 5 个网页并摘要
+        email: web_search 的结果通过 send_email 发送到 SMTP sink
+        file: write_file 写入工作目录，再通过 {{write_file}} 串联 append_file
+    每个负载在不同的执行模式（plan：规划 -> 执行与相关性判定 -> 最终回答；tools：原生 tool_calls 的多轮调用）
+    与不同的并发用户数下运行，报告 p50/p95/p99 延迟、首个 token 延迟、每秒 query 数、每个 query 的大模型调用次数，
+    以及 client 与 server 进程的内存峰值
+    --save 保存结果，--baseline 与之前保存的结果比较，退化超过 --tolerance 时列出并以非 0 状态退出
+用法：
+    python benchmarks/bench_client.py [--workloads single chain web email file] [--modes plan tools] [--concurrency 1 8] [--queries 40]
+                                      [--llm-latency 0.05] [--page-latency 0.02] [--save result.json] [--baseline result.json]
+默认每个 query 的文本都不同，规划缓存与摘要缓存不会命中；--repeat-queries 时重复同一个 query，用于观察缓存的效果
+Server_filesystem 的工作目录与全文索引放在临时目录中
+"""
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import itertools
+import tempfile
+import contextlib
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+from stub_services import SCENARIOS
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    # nearest-rank 百分位
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def peak_rss():
+    """
+    返回 (client 进程, 已退出的子进程中最大的) 内存峰值，单位 MB，不支持时为 None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1024 / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1024 / 1024
+    return own, children or None
+
+
+async def start_stubs(args):
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(BENCH_DIR, "stub_services.py"),
+        "--llm-latency", str(args.llm_latency), "--page-latency", str(args.page_latency),
+        "--token-delay", str(args.token_delay), "--seed", str(args.seed),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    line = await asyncio.wait_for(process.stdout.readline(), timeout=10)
+    return process, json.loads(line)
+
+
+def configure_environment(ports: dict, args, work_dir: str):
+    """
+    client 与 server 进程都通过环境变量指向桩服务
+    """
+    http = f"http://127.0.0.1:{ports['http_port']}"
+    os.environ.update({
+        "BASE_URL": f"{http}/v1",
+        "DASHSCOPE_API_KEY": "bench",
+        "MODEL": "mock",
+        "GOOGLE_SEARCH_ENDPOINT": f"{http}/customsearch/v1",
+        "GOOGLE_SEARCH_API_KEY": "bench",
+        "GOOGLE_CSE_ID": "bench",
+        "WEB_CACHE_ENABLED": "1" if args.web_cache else "0",
+        "WEB_CACHE_PATH": os.path.join(work_dir, "web_cache.sqlite3"),
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(ports["smtp_port"]),
+        "SMTP_SSL": "0",
+        "EMAIL_USER": "bench@example.com",
+        "EMAIL_PASS": "",
+        "PLAN_CACHE_PATH": "",
+    })
+    return http
+
+
+def server_config(work_dir: str) -> dict:
+    workspace = os.path.join(work_dir, "workspace")
+    os.makedirs(workspace, exist_ok=True)
+    env = dict(os.environ, FS_WORKSPACE=workspace, FS_INDEX_PATH=os.path.join(work_dir, "fs_index.sqlite3"))
+    servers = {}
+    for server_id in ("Server_main", "Server_web_brower", "Server_filesystem"):
+        servers[server_id] = {
+            "command": sys.executable,
+            "args": [os.path.join(ROOT, f"{server_id}.py")],
+            "env": env,
+        }
+    return {"servers": servers, "workspace": workspace, "manifest_path": os.path.join(work_dir, "tool_manifest.json")}
+
+
+async def run_workload(client, stats_client: httpx.AsyncClient, workload: str, mode: str, users: int, queries: int,
+                       counter, repeat_queries: bool) -> dict:
+    await stats_client.post("/stats/reset")
+    latencies, first_tokens = [], []
+    failed_queries = 0
+    failed_steps = 0
+    remaining = iter(range(queries))
+
+    async def user():
+        nonlocal failed_queries, failed_steps
+        for _ in remaining:
+            query = f"{workload} 基准测试问题" if repeat_queries else f"{workload} 基准测试问题 {next(counter)}"
+            start = time.perf_counter()
+            first_token = None
+            try:
+                async for event in client.stream_query(query, mode=mode):
+                    if event["type"] == "token" and first_token is None:
+                        first_token = time.perf_counter() - start
+                    elif event["type"] == "step_finish" and event["status"] != "done":
+                        failed_steps += 1
+            except Exception:
+                failed_queries += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(users)))
+    elapsed = time.perf_counter() - start
+    stats = (await stats_client.get("/stats")).json()
+    llm_calls = {kind[len("llm_"):]: count for kind, count in stats["counts"].items() if kind.startswith("llm_")}
+    return {
+        "workload": workload,
+        "mode": mode,
+        "users": users,
+        "queries": queries,
+        "failed_queries": failed_queries,
+        "failed_steps": failed_steps,
+        "qps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "ttft_p50_ms": percentile(first_tokens, 50) * 1000,
+        "llm_calls_per_query": sum(llm_calls.values()) / queries,
+        "llm_calls": llm_calls,
+        "tokens_per_query": (stats["tokens"]["prompt"] + stats["tokens"]["completion"]) / queries,
+        "pages": stats["counts"].get("page", 0),
+        "mails": stats["counts"].get("mail", 0),
+    }
+
+
+def print_results(results: list):
+    header = f"{'负载':8s} {'模式':6s} {'用户':>4s} {'qps':>8s} {'p50ms':>9s} {'p95ms':>9s} {'p99ms':>9s} {'首token':>9s} {'LLM/次':>7s} {'失败':>5s}"
+    print(header)
+    for row in results:
+        print(f"{row['workload']:8s} {row['mode']:6s} {row['users']:>4d} {row['qps']:>8.2f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['ttft_p50_ms']:>9.1f} {row['llm_calls_per_query']:>7.2f} "
+              f"{row['failed_queries'] + row['failed_steps']:>5d}")
+        calls = "  ".join(f"{kind}={count / row['queries']:.2f}" for kind, count in sorted(row["llm_calls"].items()))
+        print(f"{'':15s} 大模型调用/次：{calls}  token/次：{row['tokens_per_query']:.0f}")
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """
+    与基线比较：p95 变慢、qps 下降超过 tolerance，或每个 query 的大模型调用变多，都视为退化
+    """
+    def key(row: dict) -> str:
+        # 旧的基线中没有 mode，视为 plan
+        return f"{row['workload']}/{row.get('mode', 'plan')}@{row['users']}"
+
+    previous = {key(row): row for row in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        name = key(row)
+        old = previous.get(name)
+        if old is None:
+            continue
+        if row["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name} p95 {old['p95_ms']:.1f}ms -> {row['p95_ms']:.1f}ms")
+        if row["qps"] < old["qps"] * (1 - tolerance):
+            regressions.append(f"{name} qps {old['qps']:.2f} -> {row['qps']:.2f}")
+        if row["llm_calls_per_query"] > old["llm_calls_per_query"] + 1e-9:
+            regressions.append(f"{name} 大模型调用/次 "
+                               f"{old['llm_calls_per_query']:.2f} -> {row['llm_calls_per_query']:.2f}")
+    return regressions
+
+
+async def run(args) -> int:
+    stubs, ports = await start_stubs(args)
+    work_dir = tempfile.mkdtemp(prefix="mcp-bench-")
+    http = configure_environment(ports, args, work_dir)
+    # 环境变量设置好之后再导入，client 创建的大模型连接指向模拟服务
+    from Client import MCPClient
+
+    devnull = open(os.devnull, "w")
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+    client = MCPClient()
+    results = []
+    counter = itertools.count()
+    try:
+        async with httpx.AsyncClient(base_url=http) as stats_client:
+            with quiet:
+                await client.connect_all(server_config(work_dir))
+                for workload in args.workloads:
+                    for mode in args.modes:
+                        for _ in range(args.warmup):
+                            async for _event in client.stream_query(f"{workload} 预热 {next(counter)}", mode=mode):
+                                pass
+                for workload in args.workloads:
+                    for mode in args.modes:
+                        for users in args.concurrency:
+                            results.append(await run_workload(
+                                client, stats_client, workload, mode, users, args.queries, counter, args.repeat_queries
+                            ))
+    finally:
+        with contextlib.redirect_stdout(devnull):
+            await client.cleanup()
+        devnull.close()
+        client_rss, server_rss = peak_rss()
+        stubs.terminate()
+        await stubs.wait()
+
+    print_results(results)
+    print(f"内存峰值：client {client_rss:.1f}MB" if client_rss else "内存峰值：当前平台不支持统计", end="")
+    print(f"，server 子进程 {server_rss:.1f}MB" if server_rss else "")
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("save", "baseline")},
+        "results": results,
+        "peak_rss_mb": {"client": client_rss, "server": server_rss},
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("相对基线的退化：")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("与基线相比没有退化")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workloads", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--modes", nargs="+", default=["plan", "tools"], choices=["plan", "tools"],
+                        help="client 的执行模式，可以给多个")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8], help="并发用户数，可以给多个")
+    parser.add_argument("--queries", type=int, default=40, help="每个负载、每种并发下的 query 数量")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--page-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat-queries", action="store_true")
+    parser.add_argument("--web-cache", action="store_true", help="启用 server 端的网页缓存")
+    parser.add_argument("--save")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--verbose", action="store_true", help="显示 client 的输出")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
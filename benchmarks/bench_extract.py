@@ -0,0 +1,100 @@
+"""
+对比网页正文提取的两种方式：
+    bs4: 原先的做法，完整读取后用 BeautifulSoup(html.parser) 建树，decompose 后 get_text 再截断
+    stream: html_extract.MainTextExtractor，按 16KB 分块送入，够用后停止
+用法：
+    python benchmarks/bench_extract.py [保存网页的目录] [--repeat N]
+目录中的 *.html / *.htm 作为语料，不指定目录或目录为空时使用生成的网页
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from html_extract import MainTextExtractor
+
+CHUNK_SIZE = 16 * 1024
+MAX_LENGTH = 2000
+
+
+def bs4_extract(html: str) -> str:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(["script", "style", "nav", "footer", "iframe"]):
+        element.decompose()
+    main_content = soup.find("main") or soup.find("article") or soup
+    text = " ".join(main_content.get_text().split())
+    return text[:MAX_LENGTH]
+
+
+def stream_extract(html: str) -> str:
+    extractor = MainTextExtractor(max_length=MAX_LENGTH)
+    for start in range(0, len(html), CHUNK_SIZE):
+        if extractor.feed(html[start:start + CHUNK_SIZE]):
+            break
+    return extractor.text()
+
+
+def synthetic_corpus() -> list:
+    """
+    生成大小不同的网页：有 main 的、只有 article 的、没有主要内容标签的
+    """
+    paragraph = "<p>这是一段用于测试的正文内容 some english words for the test 0123456789。</p>\n"
+    script = "<script>var data = [" + ",".join(str(i) for i in range(2000)) + "];</script>\n"
+    pages = []
+    for size in (20, 200, 2000):
+        body = paragraph * size
+        pages.append(f"<html><head>{script}</head><body><nav>导航</nav><main>{body}</main><footer>页脚</footer></body></html>")
+        pages.append(f"<html><head>{script}</head><body><div>{paragraph * 10}</div><article>{body}</article></body></html>")
+        pages.append(f"<html><head>{script}</head><body><div>{body}</div></body></html>")
+    return pages
+
+
+def load_corpus(directory: str) -> list:
+    pages = []
+    for path in glob.glob(os.path.join(directory, "*.htm*")):
+        with open(path, "r", encoding="utf-8", errors="ignore") as file:
+            pages.append(file.read())
+    return pages
+
+
+def run(name: str, extract, pages: list, repeat: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            extract(html)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_page = elapsed / (repeat * len(pages)) * 1000
+    print(f"{name:8s} 总耗时 {elapsed:8.3f}s  每页 {per_page:8.3f}ms  内存峰值 {peak / 1024 / 1024:8.2f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", nargs="?")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_corpus(args.directory) if args.directory else []
+    if not pages:
+        pages = synthetic_corpus()
+    total = sum(len(html.encode("utf-8")) for html in pages)
+    print(f"语料：{len(pages)} 个网页，共 {total / 1024 / 1024:.2f}MB，重复 {args.repeat} 次")
+
+    run("stream", stream_extract, pages, args.repeat)
+    try:
+        run("bs4", bs4_extract, pages, args.repeat)
+    except ImportError:
+        print("未安装 bs4，跳过对比")
+        return
+    mismatched = sum(stream_extract(html) != bs4_extract(html) for html in pages)
+    print(f"提取结果与 bs4 不一致的网页：{mismatched}/{len(pages)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Server_filesystem 文件操作的基准：通过 stdio 启动真实的 Server_filesystem.py，在临时工作目录中比较
+    create: 逐个调用 create_file 创建 N 个文件 vs 一次 batch_file_operations
+    append: 逐次调用 append_file 追加 N 段小内容 vs append_file(buffered=true) vs 一次 batch_file_operations
+每种方式报告总耗时、每个操作的平均耗时与每秒操作数，结束后读取文件内容确认结果一致
+（buffered 的内容在 read_file 之前落盘，读取本身不计入耗时）
+用法：
+    python benchmarks/bench_fileops.py [--files 200] [--appends 1000] [--size 64] [--repeat 3]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def text_of(result) -> str:
+    return "".join(getattr(item, "text", "") for item in result.content)
+
+
+async def per_op_create(session, paths: list, content: str):
+    for path in paths:
+        await session.call_tool("create_file", {"file_name": path, "content": content})
+
+
+async def batch_create(session, paths: list, content: str):
+    operations = [{"op": "create", "file_name": path, "content": content} for path in paths]
+    await session.call_tool("batch_file_operations", {"operations": operations})
+
+
+async def per_op_append(session, path: str, pieces: list):
+    for piece in pieces:
+        await session.call_tool("append_file", {"file_name": path, "content": piece})
+
+
+async def buffered_append(session, path: str, pieces: list):
+    for piece in pieces:
+        await session.call_tool("append_file", {"file_name": path, "content": piece, "buffered": True})
+
+
+async def batch_append(session, path: str, pieces: list):
+    operations = [{"op": "append", "file_name": path, "content": piece} for piece in pieces]
+    await session.call_tool("batch_file_operations", {"operations": operations})
+
+
+async def measure(name: str, operations: int, run, check, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await run()
+        timings.append(time.perf_counter() - start)
+        if not await check():
+            raise RuntimeError(f"{name} 的结果与预期不一致")
+    best = min(timings)
+    return {
+        "method": name,
+        "operations": operations,
+        "best_s": best,
+        "per_op_ms": best / operations * 1000,
+        "ops_per_s": operations / best,
+    }
+
+
+async def run(args) -> list:
+    work_dir = tempfile.mkdtemp(prefix="mcp-fileops-")
+    workspace = os.path.join(work_dir, "workspace")
+    os.makedirs(workspace)
+    env = dict(os.environ, FS_WORKSPACE=workspace, FS_INDEX_PATH=os.path.join(work_dir, "fs_index.sqlite3"))
+    params = StdioServerParameters(command=sys.executable, args=[os.path.join(ROOT, "Server_filesystem.py")], env=env)
+    content = "x" * args.size
+    pieces = [f"{i:06d} {content}\n" for i in range(args.appends)]
+    results = []
+    try:
+        async with stdio_client(params) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+
+                paths = [os.path.join(workspace, f"file_{i}.txt") for i in range(args.files)]
+
+                async def check_files():
+                    sample = await session.call_tool("read_file", {"file_name": paths[-1]})
+                    return text_of(sample) == content
+
+                results.append(await measure(
+                    "create_file x N", args.files, lambda: per_op_create(session, paths, content), check_files, args.repeat
+                ))
+                results.append(await measure(
+                    "batch create", args.files, lambda: batch_create(session, paths, content), check_files, args.repeat
+                ))
+
+                log = os.path.join(workspace, "bench.log")
+
+                def appender(method):
+                    async def run_once():
+                        await session.call_tool("create_file", {"file_name": log, "content": ""})
+                        await method(session, log, pieces)
+                    return run_once
+
+                async def check_log():
+                    return text_of(await session.call_tool("read_file", {"file_name": log})) == "".join(pieces)
+
+                for name, method in (("append_file x N", per_op_append), ("append_file buffered", buffered_append),
+                                     ("batch append", batch_append)):
+                    results.append(await measure(name, args.appends, appender(method), check_log, args.repeat))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200, help="创建的文件数量")
+    parser.add_argument("--appends", type=int, default=1000, help="追加的次数")
+    parser.add_argument("--size", type=int, default=64, help="每个文件或每次追加的字符数")
+    parser.add_argument("--repeat", type=int, default=3, help="每种方式运行的次数，取最快的一次")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'方式':24s} {'操作数':>6s} {'总耗时s':>9s} {'ms/操作':>9s} {'操作/s':>10s}")
+    for row in results:
+        print(f"{row['method']:24s} {row['operations']:>6d} {row['best_s']:>9.3f} {row['per_op_ms']:>9.3f} "
+              f"{row['ops_per_s']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
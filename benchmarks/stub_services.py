@@ -0,0 +1,363 @@
+"""
+离线基准测试使用的本地桩服务，全部基于 asyncio，不需要额外的依赖：
+    HTTP（同一个端口）：
+        POST /v1/chat/completions  OpenAI 兼容的模拟大模型，按系统提示词区分规划、相关性判定、摘要与最终回答，
+                                   规划按 query 的前缀返回 SCENARIOS 中预先写好的工具链，支持 stream 与 usage；
+                                   请求带 tools 时按原生 tool_calls 返回同一条工具链：相互独立的步骤在同一轮中一起调用，
+                                   {{name}} 引用的步骤放到下一轮，参数中的引用替换为对话中该工具的结果
+        GET  /customsearch/v1      模拟 Google Custom Search，返回指向本服务 /page/N 的结果
+        GET  /page/N               生成的网页
+        GET  /stats                各类请求的计数，POST /stats/reset 清零
+    SMTP：只接收不投递的 SMTP sink，不需要登录
+启动后在标准输出打印一行 JSON：{"http_port": ..., "smtp_port": ...}
+用法：
+    python benchmarks/stub_services.py [--llm-latency 0.05] [--page-latency 0.02] [--seed 0]
+"""
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+
+## 按 query 的前缀选择规划结果，参数中的 {query} 会替换为用户的 query
+SCENARIOS = {
+    "single": [
+        {"name": "calculate", "arguments": {"expression": "(1 + 2) * 3 ^ 2"}},
+    ],
+    "chain": [
+        {"name": "get_time", "arguments": {}},
+        {"name": "calculate", "arguments": {"expression": "2 ^ 10"}},
+        {"name": "calculate", "arguments": {"expression": "{{calculate}} + 1"}},
+    ],
+    "web": [
+        {"name": "web_search", "arguments": {"subquery": "{query}", "keyword": "{query}", "num_results": 5}},
+    ],
+    "email": [
+        {"name": "web_search", "arguments": {"subquery": "{query}", "keyword": "{query}", "num_results": 3}},
+        {"name": "send_email", "arguments": {
+            "to": "bench@example.com", "subject": "bench", "body": "{{web_search}}", "attachmentfilename": "noattach"
+        }},
+    ],
+    "file": [
+        {"name": "write_file", "arguments": {"file_name": "{query}.txt", "content": "{query} 的基准测试文件内容\n"}},
+        {"name": "append_file", "arguments": {"file_name": "{query}.txt", "content": "{{write_file}}\n"}},
+    ],
+}
+
+
+def fill_query(value, query: str):
+    if isinstance(value, str):
+        return value.replace("{query}", query)
+    if isinstance(value, list):
+        return [fill_query(item, query) for item in value]
+    if isinstance(value, dict):
+        return {key: fill_query(item, query) for key, item in value.items()}
+    return value
+
+
+## 工具链中的 {{name}} 引用
+REF_PATTERN = re.compile(r"\{\{(.*?)\}\}")
+
+
+def split_turns(plan: list) -> list:
+    """
+    把工具链按引用关系分成多轮：没有引用的步骤在第一轮，引用了其他步骤的放在被引用步骤的下一轮
+    """
+    turns = []
+    turn_of = {}
+    for step in plan:
+        refs = REF_PATTERN.findall(json.dumps(step.get("arguments", {}), ensure_ascii=False))
+        turn = max((turn_of[ref.strip()] + 1 for ref in refs if ref.strip() in turn_of), default=0)
+        turn_of[step["name"]] = turn
+        while len(turns) <= turn:
+            turns.append([])
+        turns[turn].append(step)
+    return turns
+
+
+def fill_refs(value, outputs: dict):
+    if isinstance(value, str):
+        return REF_PATTERN.sub(lambda match: outputs.get(match.group(1).strip(), match.group(0)), value)
+    if isinstance(value, list):
+        return [fill_refs(item, outputs) for item in value]
+    if isinstance(value, dict):
+        return {key: fill_refs(item, outputs) for key, item in value.items()}
+    return value
+
+
+PARAGRAPH = "<p>这是基准测试生成的网页正文，包含一些用于摘要的内容 benchmark page content for summarization。</p>\n"
+
+
+FINAL_ANSWER = "根据工具的结果，回答如下：" + "这是模拟大模型生成的最终回答。" * 4
+
+
+class Stats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+
+    def inc(self, name: str):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {"counts": self.counts, "tokens": self.tokens}
+
+
+class StubServices:
+
+    def __init__(self, llm_latency: float, page_latency: float, token_delay: float, seed: int):
+        self.llm_latency = llm_latency
+        self.page_latency = page_latency
+        self.token_delay = token_delay
+        self.random = random.Random(seed)
+        self.stats = Stats()
+
+    def _delay(self, base: float) -> float:
+        # 在基准延迟上加 ±20% 的抖动，随机数种子固定，结果可复现
+        return base * self.random.uniform(0.8, 1.2) if base > 0 else 0
+
+    # ---------- 模拟大模型 ----------
+
+    def classify(self, request: dict) -> str:
+        if request.get("tools"):
+            return "agent"
+        messages = request.get("messages", [])
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        if "任务规划助手" in system:
+            return "plan"
+        if "判断能力很强" in system:
+            return "judge"
+        if "总结能力很强" in system:
+            return "summarize"
+        return "final"
+
+    def reply(self, kind: str, messages: list) -> str:
+        user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        if kind == "plan":
+            prefix = user.split()[0] if user.split() else ""
+            plan = fill_query(SCENARIOS.get(prefix, []), user)
+            return f"```json\n{json.dumps(plan, ensure_ascii=False)}\n```"
+        if kind == "judge":
+            return "True"
+        if kind == "summarize":
+            # 摘要中带上 subquery，使 client 的本地相关性打分能直接判定为相关
+            match = re.search(r"“(.*?)”", user)
+            subquery = match.group(1) if match else ""
+            return f"关于{subquery}的摘要：网页中给出了与问题相关的说明与数据。"
+        return FINAL_ANSWER
+
+    def agent_reply(self, messages: list, tool_choice) -> tuple:
+        """
+        原生 tool_calls 模式：按对话中已经完成的工具调用轮数返回下一轮的调用，全部完成后返回最终回答
+        """
+        user = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+        prefix = user.split()[0] if user.split() else ""
+        turns = split_turns(fill_query(SCENARIOS.get(prefix, []), user))
+        done_turns = sum(1 for m in messages if m.get("role") == "assistant" and m.get("tool_calls"))
+        if done_turns >= len(turns) or tool_choice == "none":
+            return FINAL_ANSWER, []
+        names = {call["id"]: call["function"]["name"]
+                 for m in messages if m.get("role") == "assistant" for call in m.get("tool_calls") or []}
+        outputs = {names.get(m.get("tool_call_id")): m.get("content", "") for m in messages if m.get("role") == "tool"}
+        tool_calls = [
+            {"id": f"call_{done_turns}_{i}", "type": "function",
+             "function": {"name": step["name"],
+                          "arguments": json.dumps(fill_refs(step.get("arguments", {}), outputs), ensure_ascii=False)}}
+            for i, step in enumerate(turns[done_turns])
+        ]
+        return "", tool_calls
+
+    async def chat_completions(self, request: dict, writer: asyncio.StreamWriter):
+        messages = request.get("messages", [])
+        kind = self.classify(request)
+        self.stats.inc(f"llm_{kind}")
+        if kind == "agent":
+            content, tool_calls = self.agent_reply(messages, request.get("tool_choice"))
+        else:
+            content, tool_calls = self.reply(kind, messages), []
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 2
+        completion_tokens = (len(content) + len(json.dumps(tool_calls, ensure_ascii=False)) * bool(tool_calls)) // 2
+        self.stats.tokens["prompt"] += prompt_tokens
+        self.stats.tokens["completion"] += completion_tokens
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        model = request.get("model") or "mock"
+        await asyncio.sleep(self._delay(self.llm_latency))
+
+        if not request.get("stream"):
+            message = {"role": "assistant", "content": content or None}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            body = {
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+            await send_response(writer, 200, json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json")
+            return
+
+        ## 流式：按 SSE 逐块返回，最后按 stream_options 返回 usage
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+
+        def event(choices: list, extra: dict = None) -> bytes:
+            chunk = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices, **(extra or {})}
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        for start in range(0, len(content), 8):
+            writer.write(event([{"index": 0, "delta": {"content": content[start:start + 8]}, "finish_reason": None}]))
+            await writer.drain()
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        for i, call in enumerate(tool_calls):
+            writer.write(event([{"index": 0, "delta": {"tool_calls": [{"index": i, **call}]}, "finish_reason": None}]))
+        writer.write(event([{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            writer.write(event([], {"usage": usage}))
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
+        writer.close()
+
+    # ---------- 模拟搜索与网页 ----------
+
+    async def search(self, query: dict, writer: asyncio.StreamWriter, host: str):
+        self.stats.inc("search")
+        num = int(query.get("num", ["5"])[0])
+        keyword = query.get("q", [""])[0]
+        items = [
+            {"title": f"{keyword} 结果 {i}", "link": f"http://{host}/page/{i}?q={i}", "snippet": f"{keyword} 的摘要 {i}"}
+            for i in range(num)
+        ]
+        await send_response(writer, 200, json.dumps({"items": items}, ensure_ascii=False).encode("utf-8"),
+                            "application/json")
+
+    async def page(self, path: str, writer: asyncio.StreamWriter):
+        self.stats.inc("page")
+        await asyncio.sleep(self._delay(self.page_latency))
+        index = int(path.rsplit("/", 1)[-1] or 0)
+        body = (f"<html><head><script>var x = {index};</script></head><body><nav>导航</nav>"
+                f"<main>{PARAGRAPH * (20 + index * 10)}</main><footer>页脚</footer></body></html>")
+        await send_response(writer, 200, body.encode("utf-8"), "text/html; charset=utf-8")
+
+    # ---------- HTTP ----------
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                url = urlsplit(target)
+                if method == "POST" and url.path.endswith("/chat/completions"):
+                    request = json.loads(body)
+                    await self.chat_completions(request, writer)
+                    if request.get("stream"):
+                        return
+                elif url.path.endswith("/customsearch/v1"):
+                    await self.search(parse_qs(url.query), writer, headers.get("host", "127.0.0.1"))
+                elif url.path.startswith("/page/"):
+                    await self.page(url.path, writer)
+                elif url.path == "/stats/reset":
+                    self.stats.reset()
+                    await send_response(writer, 200, b"{}", "application/json")
+                elif url.path == "/stats":
+                    await send_response(writer, 200, json.dumps(self.stats.to_dict()).encode("utf-8"), "application/json")
+                else:
+                    await send_response(writer, 404, b"not found", "text/plain")
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # ---------- SMTP sink ----------
+
+    async def handle_smtp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def reply(line: str):
+            writer.write((line + "\r\n").encode("ascii"))
+            await writer.drain()
+
+        try:
+            await reply("220 stub ESMTP")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", errors="replace").strip().split(" ", 1)[0].upper()
+                if command in ("EHLO", "HELO"):
+                    await reply("250-stub\r\n250 8BITMIME" if command == "EHLO" else "250 stub")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    self.stats.inc("mail")
+                    await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    break
+                elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    await reply("250 OK")
+                else:
+                    await reply("502 Command not implemented")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def send_response(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str):
+    reason = {200: "OK", 404: "Not Found"}.get(status, "OK")
+    writer.write(
+        f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode("ascii")
+        + body
+    )
+    await writer.drain()
+
+
+async def serve(args):
+    stubs = StubServices(args.llm_latency, args.page_latency, args.token_delay, args.seed)
+    http_server = await asyncio.start_server(stubs.handle_http, "127.0.0.1", args.http_port)
+    smtp_server = await asyncio.start_server(stubs.handle_smtp, "127.0.0.1", args.smtp_port)
+    print(json.dumps({
+        "http_port": http_server.sockets[0].getsockname()[1],
+        "smtp_port": smtp_server.sockets[0].getsockname()[1],
+    }), flush=True)
+    async with http_server, smtp_server:
+        await asyncio.gather(http_server.serve_forever(), smtp_server.serve_forever())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--http-port", type=int, default=0)
+    parser.add_argument("--smtp-port", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="每次 completion 的延迟（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="流式返回时每块之间的延迟（秒）")
+    parser.add_argument("--page-latency", type=float, default=0.02, help="每个网页的延迟（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
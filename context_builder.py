@@ -0,0 +1,166 @@
+"""
+组装生成最终回答的 messages，控制在 token 预算内：
+    1. 去重：输出相同的工具结果只保留一份
+    2. 预算：结果的总量超出预算时，按与 query 的相关性分配各个结果的额度，
+       放得下的结果保持原样，超出额度的结果做抽取式压缩：按句子与 query 的重合度保留最相关的句子，保持原有顺序
+    3. 顺序：固定的 system 提示在最前，工具结果按（工具名、参数）排序，用户的 query 放在最后，
+       相同的工具结果在不同 query 中形成相同的前缀，便于服务端的 prompt 缓存复用
+token 数按字符估算（中文每字约 1 个 token，其他字符约 4 个一个 token），只用于预算，实际用量以返回的 usage 为准
+环境变量：
+    CONTEXT_TOKEN_BUDGET: 最终回答的 messages 的 token 预算（默认 6000，为 0 时不限制）
+"""
+import os
+import re
+import json
+import math
+import hashlib
+from relevance import CJK_PATTERN, overlap_score
+
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+## 每条消息的格式开销（role 等）
+MESSAGE_OVERHEAD = 4
+SYSTEM_PROMPT = "请根据以下工具调用的结果回答用户最后提出的问题，工具结果不足以回答时如实说明。"
+CALCULATE_PROMPT = "不使用latex或者markdown格式输出:"
+
+## 按换行与中英文句末标点切分句子，标点保留在句子末尾
+SENTENCE_PATTERN = re.compile(r"[^\n。！？!?；;]*(?:[。！？!?；;]+|\n+|$)")
+
+
+def estimate_tokens(text: str) -> int:
+    cjk = sum(len(run) for run in CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def split_sentences(text: str) -> list:
+    return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence]
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """
+    从开头截取不超过 max_tokens 的部分
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…"
+
+
+def compress(query: str, text: str, max_tokens: int) -> str:
+    """
+    抽取式压缩：与 query 重合度高的句子优先保留（同分时靠前的优先），再按原文顺序拼接，省略处用 … 标出
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sentences = split_sentences(text)
+    ranked = sorted(range(len(sentences)), key=lambda i: (-overlap_score(query, sentences[i]), i))
+    kept = set()
+    used = 0
+    for i in ranked:
+        cost = estimate_tokens(sentences[i])
+        if used + cost <= max_tokens:
+            kept.add(i)
+            used += cost
+    if not kept:
+        return truncate(text, max_tokens)
+    parts = []
+    for i in sorted(kept):
+        if parts and i - 1 not in kept:
+            parts.append("…")
+        parts.append(sentences[i])
+    if max(kept) < len(sentences) - 1:
+        parts.append("…")
+    return "".join(parts)
+
+
+def allocate(sizes: list, weights: list, budget: int) -> list:
+    """
+    按权重分配额度（加权的 water-filling）：需求小于份额的结果拿到全部需求，剩下的额度在其余结果中继续按权重分配
+    """
+    allocation = [0] * len(sizes)
+    remaining = set(range(len(sizes)))
+    left = max(0, budget)
+    while remaining:
+        total_weight = sum(weights[i] for i in remaining)
+        shares = {i: left * weights[i] / total_weight for i in remaining}
+        fits = [i for i in remaining if sizes[i] <= shares[i]]
+        if not fits:
+            for i in remaining:
+                allocation[i] = int(shares[i])
+            break
+        for i in fits:
+            allocation[i] = sizes[i]
+            left -= sizes[i]
+            remaining.discard(i)
+    return allocation
+
+
+class ContextBuilder:
+
+    def __init__(self, budget: int = None):
+        self.budget = TOKEN_BUDGET if budget is None else budget
+
+    def build(self, query: str, steps: list):
+        """
+        steps 为执行完的 PlanStep，只使用成功的步骤
+        返回 (messages, report)，report 中为预算、估算的 token 数、去重与压缩的结果数量
+        """
+        results = []
+        seen = set()
+        duplicates = 0
+        for step in steps:
+            if step.status != "done":
+                continue
+            output = CALCULATE_PROMPT + step.output if step.name == "calculate" else step.output
+            digest = hashlib.sha1(output.encode("utf-8")).hexdigest()
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+            arguments = json.dumps(step.call_arguments, ensure_ascii=False, sort_keys=True)
+            results.append({"name": step.name, "arguments": arguments, "output": output})
+        results.sort(key=lambda result: (result["name"], result["arguments"]))
+
+        fixed_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(query) + 2 * MESSAGE_OVERHEAD
+        for result in results:
+            fixed_tokens += estimate_tokens(result["name"]) + estimate_tokens(result["arguments"]) + 2 * MESSAGE_OVERHEAD
+        sizes = [estimate_tokens(result["output"]) for result in results]
+        original_tokens = fixed_tokens + sum(sizes)
+
+        compressed = 0
+        if self.budget and original_tokens > self.budget:
+            weights = [1 + overlap_score(query, result["output"]) for result in results]
+            for result, size, limit in zip(results, sizes, allocate(sizes, weights, self.budget - fixed_tokens)):
+                if size > limit:
+                    result["output"] = compress(query, result["output"], limit)
+                    compressed += 1
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        for i, result in enumerate(results):
+            call_id = f"call_{i}"
+            messages.append({
+                "role": "assistant",
+                "content": "null",
+                "tool_calls": [{
+                    "id": call_id,
+                    "type": "function",
+                    "function": {"name": result["name"], "arguments": result["arguments"]},
+                }],
+            })
+            messages.append({"role": "tool", "tool_call_id": call_id, "content": result["output"]})
+        messages.append({"role": "user", "content": query})
+
+        report = {
+            "budget": self.budget,
+            "tokens": fixed_tokens + sum(estimate_tokens(result["output"]) for result in results),
+            "original_tokens": original_tokens,
+            "results": len(results),
+            "duplicates": duplicates,
+            "compressed": compressed,
+        }
+        return messages, report
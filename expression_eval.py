@@ -0,0 +1,244 @@
+import os
+import ast
+import math
+import operator
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+## 白名单只在导入时构建一次
+ALLOWED_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+}
+ALLOWED_NAMES = {
+    k: getattr(math, k)
+    for k in dir(math)
+    if not k.startswith("__")
+}
+ALLOWED_NAMES.update({
+    "pi": math.pi,
+    "e": math.e,
+})
+## 批量计算时可以换成 NumPy 向量运算的函数
+NUMPY_FUNCTIONS = {
+    "sin": "sin", "cos": "cos", "tan": "tan", "asin": "arcsin", "acos": "arccos", "atan": "arctan",
+    "sinh": "sinh", "cosh": "cosh", "tanh": "tanh", "exp": "exp", "log10": "log10", "log2": "log2",
+    "sqrt": "sqrt", "fabs": "abs", "floor": "floor", "ceil": "ceil", "atan2": "arctan2", "hypot": "hypot",
+}
+
+## 资源限制：数组乘方的指数、整数乘方与 comb / perm 结果的位数、阶乘的参数上限
+MAX_EXPONENT = int(os.getenv("CALC_MAX_EXPONENT", 10000))
+MAX_RESULT_BITS = int(os.getenv("CALC_MAX_RESULT_BITS", 1000000))
+MAX_FACTORIAL = int(os.getenv("CALC_MAX_FACTORIAL", 5000))
+EXPRESSION_CACHE_SIZE = int(os.getenv("CALC_CACHE_SIZE", 1024))
+
+
+def _check_bits(bits: float):
+    if bits > MAX_RESULT_BITS:
+        raise ValueError(f"结果过大，上限为 {MAX_RESULT_BITS} 位")
+
+
+def safe_pow(base, exponent):
+    """
+    乘方前估算结果的位数（指数 × log2(底数)），避免 9**9**9、(9**9999)**999 这类表达式耗尽 CPU 与内存
+    只有整数的乘方会得到任意大的结果，浮数溢出时直接报错，不需要检查
+    """
+    if np is not None and isinstance(exponent, np.ndarray):
+        if np.abs(exponent).max(initial=0) > MAX_EXPONENT:
+            raise ValueError(f"指数过大，上限为 {MAX_EXPONENT}")
+    elif isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        _check_bits(exponent * math.log2(abs(base)))
+    return operator.pow(base, exponent)
+
+
+def _log2_factorial(n: int) -> float:
+    return math.lgamma(n + 1) / math.log(2)
+
+
+def safe_comb(n, k):
+    if isinstance(n, int) and isinstance(k, int) and 0 <= k <= n:
+        _check_bits(_log2_factorial(n) - _log2_factorial(k) - _log2_factorial(n - k))
+    return math.comb(n, k)
+
+
+def safe_perm(n, k=None):
+    if isinstance(n, int) and n >= 0 and (k is None or isinstance(k, int) and 0 <= k <= n):
+        _check_bits(_log2_factorial(n) - _log2_factorial(n - (n if k is None else k)))
+    return math.perm(n, k)
+
+
+def safe_factorial(x):
+    if x > MAX_FACTORIAL:
+        raise ValueError(f"阶乘参数过大，上限为 {MAX_FACTORIAL}")
+    return math.factorial(x)
+
+
+def _check_number(name: str, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"变量 {name} 的值必须是数字")
+    return value
+
+
+def normalize_expression(expression: str) -> str:
+    return " ".join(expression.replace('^', '**').replace('×', '*').replace('÷', '/').split())
+
+
+class CompiledExpression:
+    """
+    经过校验并编译的表达式
+    variables 为表达式中不属于白名单的名字，只能在批量计算时通过 bindings 提供
+    """
+
+    def __init__(self, code, variables: frozenset, functions: frozenset):
+        self.code = code
+        self.variables = variables
+        self.functions = functions
+
+    def evaluate(self, bindings: dict = None):
+        bindings = bindings or {}
+        missing = self.variables - bindings.keys()
+        if missing:
+            raise ValueError(f"Unknown identifier: {sorted(missing)[0]}")
+        scope = {name: _check_number(name, bindings[name]) for name in self.variables}
+        return eval(self.code, {"__builtins__": {}, **EVAL_GLOBALS}, scope)
+
+    def evaluate_vectorized(self, columns: dict):
+        """
+        用 NumPy 数组一次性计算所有绑定，表达式中的函数都能换成 NumPy 函数时才可用
+        数组统一为 float64，避免整数溢出时静默得到错误结果
+        """
+        scope = {
+            name: np.asarray([_check_number(name, value) for value in values], dtype=float)
+            for name, values in columns.items()
+        }
+        numpy_globals = {"__builtins__": {}, **EVAL_GLOBALS}
+        numpy_globals.update({name: getattr(np, NUMPY_FUNCTIONS[name]) for name in self.functions})
+        return eval(self.code, numpy_globals, scope)
+
+    @property
+    def vectorizable(self) -> bool:
+        return np is not None and all(name in NUMPY_FUNCTIONS for name in self.functions)
+
+
+EVAL_GLOBALS = dict(ALLOWED_NAMES)
+EVAL_GLOBALS.update({"_safe_pow": safe_pow, "factorial": safe_factorial, "comb": safe_comb, "perm": safe_perm})
+
+
+class _Validator(ast.NodeTransformer):
+    """
+    校验表达式只包含允许的节点，并把乘方改写为带资源限制的 _safe_pow 调用
+    """
+
+    def __init__(self):
+        self.variables = set()
+        self.functions = set()
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float, complex)):
+            raise ValueError(f"Unsupported operation: {ast.dump(node)}")
+        return node
+
+    def visit_Name(self, node):
+        if node.id not in ALLOWED_NAMES:
+            self.variables.add(node.id)
+        return node
+
+    def visit_BinOp(self, node):
+        if type(node.op) not in ALLOWED_OPERATORS:
+            raise ValueError(f"Unsupported operation: {ast.dump(node)}")
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        if isinstance(node.op, ast.Pow):
+            return ast.copy_location(
+                ast.Call(func=ast.Name(id="_safe_pow", ctx=ast.Load()), args=[left, right], keywords=[]), node
+            )
+        node.left, node.right = left, right
+        return node
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, ast.USub):
+            raise ValueError(f"Unsupported operation: {ast.dump(node)}")
+        node.operand = self.visit(node.operand)
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in ALLOWED_NAMES \
+                or not callable(ALLOWED_NAMES[node.func.id]) or node.keywords:
+            raise ValueError(f"Unsupported operation: {ast.dump(node)}")
+        self.functions.add(node.func.id)
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def generic_visit(self, node):
+        raise ValueError(f"Unsupported operation: {ast.dump(node)}")
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def _compile(normalized: str) -> CompiledExpression:
+    tree = ast.parse(normalized, mode='eval')
+    validator = _Validator()
+    tree = ast.fix_missing_locations(validator.visit(tree))
+    code = compile(tree, "<expression>", "eval")
+    return CompiledExpression(code, frozenset(validator.variables), frozenset(validator.functions))
+
+
+def compile_expression(expression: str) -> CompiledExpression:
+    """
+    解析、校验并编译表达式，结果按归一化后的表达式缓存
+    """
+    return _compile(normalize_expression(expression))
+
+
+def evaluate(expression: str):
+    return compile_expression(expression).evaluate()
+
+
+def evaluate_batch(expression: str = None, bindings: list = None, expressions: list = None) -> list:
+    """
+    批量计算：
+        一个表达式 + 多组变量绑定：能向量化时使用 NumPy 一次算完，否则逐组计算
+        多个表达式：逐个计算（共享编译缓存）
+    单个结果出错时该位置为 {"failed": ...}，不影响其他结果（不用 error 字段，否则 client 会把整个批量计算当作失败）
+    """
+    results = []
+    if expressions:
+        for item in expressions:
+            try:
+                results.append(evaluate(item))
+            except Exception as e:
+                results.append({"failed": f"表达式计算失败: {str(e)}"})
+        return results
+
+    compiled = compile_expression(expression)
+    bindings = bindings or [{}]
+    if compiled.vectorizable and len(bindings) > 1 and compiled.variables \
+            and all(compiled.variables <= binding.keys() for binding in bindings):
+        columns = {name: [binding[name] for binding in bindings] for name in compiled.variables}
+        try:
+            with np.errstate(all="raise"):
+                values = compiled.evaluate_vectorized(columns)
+            values = np.broadcast_to(values, (len(bindings),))
+            return [value.item() for value in values]
+        except Exception:
+            # 向量化失败（比如溢出、定义域错误）时逐组计算，使每个结果的报错与单独计算一致
+            pass
+    for binding in bindings:
+        try:
+            results.append(compiled.evaluate(binding))
+        except Exception as e:
+            results.append({"failed": f"表达式计算失败: {str(e)}"})
+    return results
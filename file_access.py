@@ -0,0 +1,617 @@
+"""
+大文件的分段读取与分块上传
+读取通过 mmap 按需映射，只有被访问到的页会载入内存，单次调用返回的数据量有上限（FILE_READ_MAX_BYTES），
+因此无论文件多大，server 的内存占用与传给 client 的数据量都只与请求的片段大小有关
+环境变量：
+    FILE_READ_MAX_BYTES: 单次读取返回的最大字节数（默认 64KB）
+    FILE_LINE_INDEX_STEP: 行索引每隔多少行记录一次偏移（默认 1000）
+    FILE_UPLOAD_TTL: 分块上传超过该秒数没有新分块时视为放弃，临时文件会被清理（默认 3600）
+    FS_WORKSPACE: 文件工具的工作目录，相对路径都按它解析，client 与 server 共用（默认为 ./Test box）
+写入同样先写临时文件再 os.replace，进程在写入中途退出时原文件保持不变：
+    atomic_write: 单个文件的原子写入
+    apply_operations: 一次执行多个文件操作，可以要求全部成功或全部不生效
+    AppendBuffer: 高频追加的写缓冲，合并小的写入，按大小、时间或关闭时落盘
+    FILE_APPEND_BUFFER_BYTES: 单个文件缓冲的字节数上限，超过后立即落盘（默认 64KB）
+    FILE_APPEND_FLUSH_INTERVAL: 缓冲的内容最多停留的秒数（默认 1）
+"""
+import os
+import sys
+import mmap
+import time
+import uuid
+import shutil
+import asyncio
+from contextlib import contextmanager
+from collections import OrderedDict
+
+DEFAULT_WORKSPACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Test box")
+MAX_READ_BYTES = int(os.getenv("FILE_READ_MAX_BYTES", 64 * 1024))
+LINE_INDEX_STEP = int(os.getenv("FILE_LINE_INDEX_STEP", 1000))
+UPLOAD_TTL = float(os.getenv("FILE_UPLOAD_TTL", 3600))
+APPEND_BUFFER_BYTES = int(os.getenv("FILE_APPEND_BUFFER_BYTES", 64 * 1024))
+APPEND_FLUSH_INTERVAL = float(os.getenv("FILE_APPEND_FLUSH_INTERVAL", 1))
+
+
+def workspace_root() -> str:
+    return os.path.abspath(os.getenv("FS_WORKSPACE") or DEFAULT_WORKSPACE)
+
+
+def resolve_path(file_name: str, workspace: str = None) -> str:
+    """
+    相对路径按工作目录解析，绝对路径保持不变
+    """
+    if os.path.isabs(file_name):
+        return file_name
+    return os.path.join(workspace or workspace_root(), file_name)
+
+
+@contextmanager
+def open_mapped(file_name: str):
+    """
+    以只读方式映射文件，空文件无法 mmap，返回 b""
+    """
+    with open(file_name, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            yield b""
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def align_start(data, position: int) -> int:
+    """
+    把起始位置向后移到 UTF-8 字符的开头（跳过续字节 10xxxxxx）
+    """
+    end = min(len(data), position + 3)
+    while position < end and data[position] & 0xC0 == 0x80:
+        position += 1
+    return position
+
+
+def align_end(data, position: int) -> int:
+    """
+    把结束位置向前移到 UTF-8 字符的开头，避免截断多字节字符
+    """
+    start = max(0, position - 3)
+    while position > start and position < len(data) and data[position] & 0xC0 == 0x80:
+        position -= 1
+    return position
+
+
+def at_least_one_char(data, start: int, end: int) -> int:
+    """
+    长度小于一个字符时，对齐后的结束位置会退回到起始位置，此时至少包含一个完整字符，保证读取能够前进
+    """
+    if end <= start < len(data):
+        return align_end(data, min(start + 4, len(data)))
+    return end
+
+
+def clamp_length(length: int) -> int:
+    if length is None or length <= 0:
+        return MAX_READ_BYTES
+    return min(length, MAX_READ_BYTES)
+
+
+def read_range(file_name: str, offset: int = 0, length: int = None) -> dict:
+    """
+    按字节范围读取，起止位置对齐到 UTF-8 字符边界
+    offset 为负数时从文件末尾倒数
+    """
+    length = clamp_length(length)
+    with open_mapped(file_name) as data:
+        size = len(data)
+        if offset < 0:
+            offset = max(0, size + offset)
+        start = align_start(data, min(offset, size))
+        end = at_least_one_char(data, start, align_end(data, min(start + length, size)))
+        text = bytes(data[start:end]).decode("utf-8", errors="replace")
+    return {"text": text, "offset": start, "next_offset": end, "size": size, "eof": end >= size}
+
+
+def read_chunk(file_name: str, cursor: str = "", chunk_size: int = None) -> dict:
+    """
+    按块顺序读取，每块尽量在换行处结束，返回下一块的 cursor，读完时 cursor 为空
+    cursor 中记录了文件的修改时间，文件在两次读取之间被修改时报错，需要从头读取
+    """
+    stat = os.stat(file_name)
+    version = f"{stat.st_mtime_ns:x}"
+    offset = 0
+    if cursor:
+        try:
+            offset_text, cursor_version = cursor.split(":", 1)
+            offset = int(offset_text)
+        except ValueError:
+            raise ValueError(f"cursor 格式错误: {cursor}")
+        if cursor_version != version:
+            raise ValueError("文件在读取过程中被修改，请重新从头读取")
+    chunk_size = clamp_length(chunk_size)
+    with open_mapped(file_name) as data:
+        size = len(data)
+        start = min(offset, size)
+        end = min(start + chunk_size, size)
+        if end < size:
+            newline = data.rfind(b"\n", start, end)
+            end = newline + 1 if newline >= 0 else at_least_one_char(data, start, align_end(data, end))
+        text = bytes(data[start:end]).decode("utf-8", errors="replace")
+    return {
+        "text": text,
+        "offset": start,
+        "size": size,
+        "cursor": f"{end}:{version}" if end < size else "",
+    }
+
+
+class LineIndex:
+    """
+    稀疏行索引：每隔 step 行记录一次行首的字节偏移
+    按需向后扩展，读取第 n 行时只需从最近的记录点开始扫描
+    """
+
+    def __init__(self, step: int):
+        self.step = step
+        self.offsets = [0]
+        self.complete = False
+
+    def locate(self, data, line: int) -> int:
+        """
+        返回第 line 行（从 0 开始）的行首偏移，超出文件行数时返回 None
+        """
+        checkpoint = line // self.step
+        while len(self.offsets) <= checkpoint and not self.complete:
+            self._extend(data)
+        if checkpoint >= len(self.offsets):
+            return None
+        position = self.offsets[checkpoint]
+        for _ in range(line - checkpoint * self.step):
+            newline = data.find(b"\n", position)
+            if newline < 0:
+                return None
+            position = newline + 1
+        return position if position < len(data) or line == 0 else None
+
+    def _extend(self, data):
+        position = self.offsets[-1]
+        for _ in range(self.step):
+            newline = data.find(b"\n", position)
+            if newline < 0 or newline + 1 >= len(data):
+                self.complete = True
+                return
+            position = newline + 1
+        self.offsets.append(position)
+
+
+class LineIndexCache:
+    """
+    按 (路径, 修改时间, 大小) 缓存行索引，文件变化后自动失效
+    """
+
+    def __init__(self, max_files: int = 64):
+        self.max_files = max_files
+        self._indexes = OrderedDict()
+
+    def get(self, file_name: str) -> LineIndex:
+        stat = os.stat(file_name)
+        key = os.path.abspath(file_name)
+        version = (stat.st_mtime_ns, stat.st_size)
+        entry = self._indexes.get(key)
+        if entry is None or entry[0] != version:
+            entry = (version, LineIndex(LINE_INDEX_STEP))
+            self._indexes[key] = entry
+        self._indexes.move_to_end(key)
+        while len(self._indexes) > self.max_files:
+            self._indexes.popitem(last=False)
+        return entry[1]
+
+
+line_indexes = LineIndexCache()
+
+
+def read_lines(file_name: str, start_line: int = 1, num_lines: int = 100) -> dict:
+    """
+    读取从 start_line（从 1 开始）起的 num_lines 行，返回内容不超过 MAX_READ_BYTES
+    """
+    start_line = max(1, start_line)
+    index = line_indexes.get(file_name)
+    with open_mapped(file_name) as data:
+        start = index.locate(data, start_line - 1)
+        if start is None:
+            return {"text": "", "start_line": start_line, "end_line": start_line - 1, "truncated": False, "eof": True}
+        end = start
+        count = 0
+        truncated = False
+        limit = start + MAX_READ_BYTES
+        while count < num_lines and end < len(data):
+            newline = data.find(b"\n", end, limit)
+            if newline < 0:
+                # 最后一行没有换行符，或者达到读取上限时只返回该行的前一部分
+                end = min(len(data), limit)
+                truncated = end < len(data)
+                if truncated:
+                    end = align_end(data, end)
+                count += 1
+                break
+            end = newline + 1
+            count += 1
+        text = bytes(data[start:end]).decode("utf-8", errors="replace")
+        eof = end >= len(data)
+    return {"text": text, "start_line": start_line, "end_line": start_line + count - 1,
+            "truncated": truncated, "eof": eof}
+
+
+def tail_lines(file_name: str, num_lines: int = 20) -> dict:
+    """
+    从文件末尾向前查找换行，只访问最后 num_lines 行所在的页
+    """
+    with open_mapped(file_name) as data:
+        size = len(data)
+        end = size
+        # 末尾的换行不算作一个空行
+        if end > 0 and data[end - 1:end] == b"\n":
+            end -= 1
+        start = end
+        limit = max(0, size - MAX_READ_BYTES)
+        count = 0
+        while count < num_lines and start > limit:
+            newline = data.rfind(b"\n", limit, start)
+            if newline < 0:
+                # 超出读取上限的行只返回末尾部分
+                start = align_start(data, limit)
+                count += 1
+                break
+            start = newline
+            count += 1
+        if start < size and data[start:start + 1] == b"\n":
+            start += 1
+        text = bytes(data[start:size]).decode("utf-8", errors="replace")
+    return {"text": text, "num_lines": count, "offset": start, "size": size}
+
+
+class ChunkedUpload:
+    """
+    分块上传：分块先写入目标文件旁的临时文件，最后一块到达后再一次性生效
+        write: 用临时文件原子替换目标文件
+        append: 把临时文件的内容追加到目标文件末尾
+    上传中断时目标文件保持原样
+    """
+
+    def __init__(self):
+        self._uploads = {}
+
+    def write_chunk(self, file_name: str, content: str, mode: str, upload_id: str = "",
+                    offset: int = None, final: bool = False) -> dict:
+        self._expire()
+        if upload_id:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                raise ValueError(f"上传编号'{upload_id}'不存在或已过期")
+            if upload["file_name"] != file_name or upload["mode"] != mode:
+                raise ValueError(f"上传编号'{upload_id}'不属于文件'{file_name}'")
+        else:
+            upload_id = uuid.uuid4().hex[:12]
+            upload = {
+                "file_name": file_name,
+                "mode": mode,
+                "temp_path": f"{file_name}.upload-{upload_id}",
+                "size": 0,
+            }
+            open(upload["temp_path"], "wb").close()
+            self._uploads[upload_id] = upload
+
+        # offset 与已接收的大小不一致说明分块重复或丢失，拒绝写入，client 可按 received 重新发送
+        if offset is not None and offset != upload["size"]:
+            raise ValueError(f"分块偏移不匹配，已接收 {upload['size']} 字节，收到的偏移为 {offset}")
+        data = content.encode("utf-8")
+        with open(upload["temp_path"], "ab") as file:
+            file.write(data)
+        upload["size"] += len(data)
+        upload["updated_at"] = time.monotonic()
+        if final:
+            self._commit(upload_id)
+        return {"upload_id": upload_id, "received": upload["size"], "final": final}
+
+    def _commit(self, upload_id: str):
+        upload = self._uploads.pop(upload_id)
+        temp_path = upload["temp_path"]
+        try:
+            if upload["mode"] == "write":
+                os.replace(temp_path, upload["file_name"])
+                return
+            with open(temp_path, "rb") as source, open(upload["file_name"], "ab") as target:
+                shutil.copyfileobj(source, target)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def abort(self, upload_id: str) -> bool:
+        upload = self._uploads.pop(upload_id, None)
+        if upload is None:
+            return False
+        if os.path.exists(upload["temp_path"]):
+            os.remove(upload["temp_path"])
+        return True
+
+    def _expire(self):
+        now = time.monotonic()
+        for upload_id, upload in list(self._uploads.items()):
+            if now - upload.get("updated_at", now) > UPLOAD_TTL:
+                self.abort(upload_id)
+
+
+def temp_path_for(file_name: str) -> str:
+    """
+    与目标文件在同一目录下的临时文件，保证 os.replace 不跨文件系统
+    """
+    return f"{file_name}.tmp-{uuid.uuid4().hex[:8]}"
+
+
+def atomic_write(file_name: str, content: str):
+    """
+    先写入临时文件并 fsync，再替换目标文件，保留原文件的权限
+    """
+    temp_path = temp_path_for(file_name)
+    try:
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(file_name):
+            shutil.copymode(file_name, temp_path)
+        os.replace(temp_path, file_name)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+FILE_OPERATIONS = ("create", "write", "append", "delete")
+
+
+class _StagedFile:
+    """
+    一个文件在批量操作中的暂存状态：新内容写在同目录的临时文件中，delete 只做标记，commit 时才修改原文件
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.temp_path = None
+        self.deleted = False
+        self.backup_path = None
+        self.created = False
+
+    def apply(self, op: str, content: str):
+        if os.path.isdir(self.file_name):
+            raise IsADirectoryError(f"'{self.file_name}'是目录")
+        if op == "delete":
+            if self.deleted or (self.temp_path is None and not os.path.exists(self.file_name)):
+                raise FileNotFoundError(f"文件'{self.file_name}'不存在")
+            self.discard()
+            self.deleted = True
+            return
+        if self.temp_path is None:
+            self.temp_path = temp_path_for(self.file_name)
+            # 追加到已有文件时先复制原内容；前面的操作删除了文件时，追加相当于创建新文件
+            if op == "append" and not self.deleted and os.path.exists(self.file_name):
+                shutil.copyfile(self.file_name, self.temp_path)
+            else:
+                open(self.temp_path, "wb").close()
+        elif op != "append":
+            open(self.temp_path, "wb").close()
+        self.deleted = False
+        with open(self.temp_path, "a", encoding="utf-8") as file:
+            file.write(content)
+
+    def flush(self):
+        if self.temp_path is not None:
+            with open(self.temp_path, "rb+") as file:
+                os.fsync(file.fileno())
+
+    def commit(self, keep_backup: bool = False):
+        """
+        生效；keep_backup 为 True 时原文件先改名为同目录下的备份，rollback 时可以恢复
+        """
+        exists = os.path.exists(self.file_name)
+        if exists and self.temp_path is not None:
+            shutil.copymode(self.file_name, self.temp_path)
+        if exists and keep_backup:
+            self.backup_path = f"{self.file_name}.bak-{uuid.uuid4().hex[:8]}"
+            os.replace(self.file_name, self.backup_path)
+        if self.deleted:
+            if exists and not keep_backup:
+                os.remove(self.file_name)
+        else:
+            os.replace(self.temp_path, self.file_name)
+            self.temp_path = None
+            self.created = not exists
+
+    def rollback(self):
+        if self.backup_path is not None:
+            os.replace(self.backup_path, self.file_name)
+            self.backup_path = None
+        elif self.created:
+            os.remove(self.file_name)
+        self.discard()
+
+    def drop_backup(self):
+        if self.backup_path is not None and os.path.exists(self.backup_path):
+            os.remove(self.backup_path)
+        self.backup_path = None
+
+    def discard(self):
+        if self.temp_path is not None and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+
+def apply_operations(operations: list, all_or_nothing: bool = False) -> dict:
+    """
+    批量执行文件操作，operations 中每一项为 {"op": create/write/append/delete, "file_name", "content"}
+    同一个文件的多个操作先在临时文件中依次合并，每个文件最后只替换一次
+    all_or_nothing 为 False 时各个文件相互独立，某个文件的操作出错时该文件保持原样，其余文件照常生效；
+    为 True 时任意一个操作出错则所有文件都不修改，替换过程中出错时用备份恢复已经替换的文件
+    返回 {"ok", "results": [{"index", "op", "file_name", "status", "error"}], "changed": [...], "removed": [...]}
+    status 为 ok、error，或者因为其他操作出错而没有生效的 rolled_back
+    """
+    staged = {}
+    results = []
+    failed_files = set()
+    for index, operation in enumerate(operations):
+        op = operation.get("op")
+        file_name = operation.get("file_name")
+        result = {"index": index, "op": op, "file_name": file_name, "status": "ok"}
+        results.append(result)
+        try:
+            if op not in FILE_OPERATIONS:
+                raise ValueError(f"不支持的操作: {op}")
+            if not file_name:
+                raise ValueError("缺少 file_name")
+            if file_name in failed_files:
+                raise RuntimeError("该文件前面的操作出错，后续操作不执行")
+            staged.setdefault(file_name, _StagedFile(file_name)).apply(op, operation.get("content", ""))
+        except Exception as e:
+            result.update(status="error", error=str(e))
+            if file_name:
+                failed_files.add(file_name)
+
+    def abandon(error: str = None):
+        for item in staged.values():
+            item.discard()
+        for result in results:
+            if result["status"] == "ok" or error is not None:
+                result["status"] = "rolled_back"
+                if error is not None:
+                    result["error"] = error
+        return {"ok": False, "results": results, "changed": [], "removed": []}
+
+    ok = not failed_files
+    if all_or_nothing and not ok:
+        return abandon()
+    for file_name in failed_files:
+        if file_name in staged:
+            staged.pop(file_name).discard()
+            for result in results:
+                if result["file_name"] == file_name and result["status"] == "ok":
+                    result["status"] = "rolled_back"
+
+    committed = []
+    current = None
+    try:
+        for item in staged.values():
+            item.flush()
+        for current in staged.values():
+            current.commit(keep_backup=all_or_nothing)
+            committed.append(current)
+    except Exception as e:
+        if not all_or_nothing:
+            # 各文件独立：已经替换的文件保留，剩下的文件标记为出错
+            for item in staged.values():
+                if item not in committed:
+                    item.discard()
+                    for result in results:
+                        if result["file_name"] == item.file_name:
+                            result.update(status="error", error=str(e))
+            return {
+                "ok": False,
+                "results": results,
+                "changed": [item.file_name for item in committed if not item.deleted],
+                "removed": [item.file_name for item in committed if item.deleted],
+            }
+        # 出错的文件可能已经移到了备份，与已经替换的文件一起恢复
+        for item in reversed(committed + ([current] if current is not None and current not in committed else [])):
+            item.rollback()
+        return abandon(str(e))
+    for item in committed:
+        item.drop_backup()
+
+    return {
+        "ok": ok,
+        "results": results,
+        "changed": [item.file_name for item in committed if not item.deleted],
+        "removed": [item.file_name for item in committed if item.deleted],
+    }
+
+
+def append_text(file_name: str, content: str):
+    """
+    向文件末尾追加文本，返回追加前的 (mtime_ns, 大小)，文件原来不存在时返回 None，用于增量更新索引
+    """
+    try:
+        stat = os.stat(file_name)
+        previous = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        previous = None
+    with open(file_name, "a", encoding="utf-8") as file:
+        file.write(content)
+    return previous
+
+
+class AppendBuffer:
+    """
+    追加写缓冲：同一个文件的多次追加先合并在内存中，超过 max_bytes、停留超过 flush_interval 秒，
+    或者关闭时一次性写入；读取、覆盖、删除该文件之前需要先 flush(file_name)，保证看到的是完整的内容
+    缓冲中的内容在进程异常退出时会丢失，只适合日志等允许少量丢失的高频追加
+    on_flush(file_name, previous) 在每次落盘后调用（例如更新索引），previous 为追加前的 (mtime_ns, 大小)，见 append_text
+    """
+
+    def __init__(self, max_bytes: int = None, flush_interval: float = None, on_flush=None):
+        self.max_bytes = max_bytes or APPEND_BUFFER_BYTES
+        self.flush_interval = flush_interval if flush_interval is not None else APPEND_FLUSH_INTERVAL
+        self.on_flush = on_flush
+        self._pending = {}
+        self._locks = {}
+        self._task = None
+
+    async def append(self, file_name: str, content: str):
+        entry = self._pending.setdefault(file_name, {"chunks": [], "size": 0, "since": time.monotonic()})
+        entry["chunks"].append(content)
+        entry["size"] += len(content.encode("utf-8"))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_periodically())
+        if entry["size"] >= self.max_bytes:
+            await self.flush(file_name)
+
+    async def flush(self, file_name: str):
+        lock = self._locks.setdefault(file_name, asyncio.Lock())
+        async with lock:
+            entry = self._pending.pop(file_name, None)
+            if entry is None:
+                return
+            data = "".join(entry["chunks"])
+            try:
+                previous = await asyncio.to_thread(self._write, file_name, data)
+            except Exception:
+                # 写入失败时放回缓冲，下次再试
+                current = self._pending.setdefault(file_name, {"chunks": [], "size": 0, "since": entry["since"]})
+                current["chunks"].insert(0, data)
+                current["size"] += entry["size"]
+                raise
+        if self.on_flush is not None:
+            await self.on_flush(file_name, previous)
+
+    @staticmethod
+    def _write(file_name: str, data: str):
+        return append_text(file_name, data)
+
+    async def flush_all(self):
+        for file_name in list(self._pending):
+            try:
+                await self.flush(file_name)
+            except Exception as e:
+                # 内容仍在缓冲中，下一轮再试；stdio 传输时只能写到 stderr
+                print(f"写入缓冲落盘失败 '{file_name}': {e}", file=sys.stderr)
+
+    async def _flush_periodically(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            now = time.monotonic()
+            for file_name, entry in list(self._pending.items()):
+                if now - entry["since"] >= self.flush_interval:
+                    try:
+                        await self.flush(file_name)
+                    except Exception as e:
+                        print(f"写入缓冲落盘失败 '{file_name}': {e}", file=sys.stderr)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush_all()
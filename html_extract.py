@@ -0,0 +1,145 @@
+from html.parser import HTMLParser
+from typing import AsyncIterator
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+## 不需要的内容（与原先 decompose 的标签一致）
+SKIP_TAGS = {"script", "style", "nav", "footer", "iframe"}
+## 主要内容所在的标签
+MAIN_TAGS = {"main", "article"}
+
+
+class MainTextExtractor:
+    """
+    流式的网页正文提取，不构建完整的文档树
+    边接收边解析，跳过 script/style/nav/footer/iframe 中的文本，优先使用第一个 main/article 中的文本
+    主要内容的文本够 max_length 个字符、第一个 main/article 结束，或者读取的 HTML 超过 max_bytes 时停止
+    安装了 lxml 时使用 lxml 的解析器，否则使用标准库的 html.parser
+    """
+
+    def __init__(self, max_length: int = 2000, max_bytes: int = 1024 * 1024):
+        self.max_length = max_length
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.done = False
+        self._skip_depth = 0
+        self._main_depth = 0
+        self._main_seen = False
+        self._main_parts = []
+        self._main_length = 0
+        self._all_parts = []
+        self._all_length = 0
+        self._backend = _LxmlBackend(self) if etree is not None else _StdlibBackend(self)
+
+    def feed(self, chunk: str) -> bool:
+        """
+        送入一段 HTML，返回是否已经收集到足够的文本
+        """
+        if self.done:
+            return True
+        self.bytes_read += len(chunk.encode("utf-8"))
+        self._backend.feed(chunk)
+        if self.max_bytes > 0 and self.bytes_read >= self.max_bytes:
+            self.done = True
+        return self.done
+
+    async def consume(self, chunks: AsyncIterator[str]) -> str:
+        """
+        逐块读取 HTML 直到收集到足够的文本，返回实际读取的 HTML 片段
+        """
+        consumed = []
+        async for chunk in chunks:
+            consumed.append(chunk)
+            if self.feed(chunk):
+                break
+        return "".join(consumed)
+
+    def text(self) -> str:
+        parts = self._main_parts if self._main_seen and self._main_length else self._all_parts
+        text = " ".join("".join(parts).split())
+        return text[:self.max_length] if self.max_length > 0 else text
+
+    ## 以下由解析后端回调
+    def start(self, tag: str):
+        tag = tag.lower()
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in MAIN_TAGS and (not self._main_seen or self._main_depth):
+            # 只使用第一个 main/article，嵌套在其中的 main/article 一并计入
+            self._main_seen = True
+            self._main_depth += 1
+
+    def end(self, tag: str):
+        tag = tag.lower()
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in MAIN_TAGS and self._main_depth:
+            self._main_depth -= 1
+            # 第一个 main/article 结束，后面的内容不再需要
+            if self._main_depth == 0:
+                self.done = True
+
+    def data(self, data: str):
+        if self._skip_depth or self.done:
+            return
+        ## 只保留有限的文本，超过 max_length 之后的内容不会被使用
+        limit = self.max_length * 2 if self.max_length > 0 else None
+        if limit is None or self._all_length < limit:
+            self._all_parts.append(data)
+            self._all_length += len(data)
+        if self._main_depth:
+            self._main_parts.append(data)
+            self._main_length += len(data.strip())
+            if self.max_length > 0 and self._main_length >= self.max_length:
+                self.done = True
+
+
+class _StdlibBackend(HTMLParser):
+
+    def __init__(self, extractor: MainTextExtractor):
+        super().__init__(convert_charrefs=True)
+        self.extractor = extractor
+
+    def handle_starttag(self, tag, attrs):
+        self.extractor.start(tag)
+
+    def handle_endtag(self, tag):
+        self.extractor.end(tag)
+
+    def handle_data(self, data):
+        self.extractor.data(data)
+
+
+class _LxmlBackend:
+
+    def __init__(self, extractor: MainTextExtractor):
+        self.extractor = extractor
+        self.parser = etree.HTMLParser(target=self, recover=True)
+
+    def feed(self, chunk: str):
+        self.parser.feed(chunk)
+
+    ## lxml parser target 接口
+    def start(self, tag, attrib):
+        self.extractor.start(tag)
+
+    def end(self, tag):
+        self.extractor.end(tag)
+
+    def data(self, data):
+        self.extractor.data(data)
+
+    def close(self):
+        return None
+
+
+def extract_main_text(html: str, max_length: int = 2000) -> str:
+    """
+    对已经完整获取的 HTML（例如缓存中的网页）提取正文
+    """
+    extractor = MainTextExtractor(max_length=max_length, max_bytes=0)
+    extractor.feed(html)
+    return extractor.text()
@@ -0,0 +1,121 @@
+import os
+import asyncio
+import httpx
+import telemetry
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class LLMBackend:
+    """
+    异步的大模型调用层，Client 与各个 Server 共用
+    使用 AsyncOpenAI，并且整个进程共享一个带连接池的 httpx.AsyncClient，避免阻塞事件循环
+    并发上限、超时、连接数都可以通过环境变量配置：
+        LLM_MAX_CONCURRENCY: 同时进行的 completion 数量上限（默认 8）
+        LLM_TIMEOUT: 单次请求超时秒数（默认 60）
+        LLM_MAX_CONNECTIONS: 连接池大小（默认 20）
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = None,
+                 max_concurrency: int = None, timeout: float = None, max_connections: int = None):
+        self.api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
+        self.base_url = base_url or os.getenv("BASE_URL")
+        self.model = model or os.getenv("MODEL")
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT", 60))
+        max_connections = max_connections or int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+        self.http_client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=self.timeout,
+            http_client=self.http_client,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def chat(self, messages: list, model: str = None, call_site: str = "default", **kwargs):
+        """
+        发起一次 chat completion，受并发上限约束，返回原始的 response 对象
+        call_site 标记调用位置（plan、judge、final、summarize 等），用于按位置统计耗时与 token 用量
+        stream=True 时返回分块的异步迭代器，见 _stream
+        """
+        model = model or self.model
+        if kwargs.get("stream", False):
+            if telemetry.ENABLED:
+                kwargs.setdefault("stream_options", {"include_usage": True})
+            return self._stream(messages, model, call_site, kwargs)
+        with telemetry.span(f"llm.{call_site}", model=model):
+            async with self._semaphore:
+                response = await self._create(messages, model, call_site, kwargs)
+            telemetry.record_llm_usage(call_site, getattr(response, "usage", None))
+            return response
+
+    async def _create(self, messages: list, model: str, call_site: str, kwargs: dict):
+        try:
+            response = await self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        except Exception as e:
+            telemetry.metrics.inc("llm_requests_total", call_site=call_site, status=type(e).__name__)
+            raise
+        telemetry.metrics.inc("llm_requests_total", call_site=call_site, status="ok")
+        return response
+
+    async def _stream(self, messages: list, model: str, call_site: str, kwargs: dict):
+        """
+        流式返回：开始读取时才发起请求，并发名额一直持有到流读完或被关闭，
+        上游的连接与 token 的生成都发生在读取的过程中，只在创建请求时持有名额起不到限流的作用
+        同时记录首个 token 的延迟、整个流的耗时，以及最后一个分块中的 token 用量
+        """
+        with telemetry.span(f"llm.{call_site}", model=model) as request_span:
+            await self._semaphore.acquire()
+            try:
+                stream = await self._create(messages, model, call_site, kwargs)
+            except BaseException:
+                self._semaphore.release()
+                raise
+        try:
+            with telemetry.span(f"llm.{call_site}.stream", trace_id=request_span.trace_id,
+                                parent_id=request_span.span_id) as current:
+                first_token = None
+                start = asyncio.get_running_loop().time()
+                async for chunk in stream:
+                    if first_token is None and chunk.choices:
+                        first_token = asyncio.get_running_loop().time() - start
+                        current.set(first_token_ms=round(first_token * 1000, 3))
+                    if getattr(chunk, "usage", None) is not None:
+                        telemetry.record_llm_usage(call_site, chunk.usage)
+                    yield chunk
+        finally:
+            # 调用方提前结束时关闭响应，把连接还给连接池
+            try:
+                await stream.close()
+            finally:
+                self._semaphore.release()
+
+    async def aclose(self):
+        await self.client.close()
+        await self.http_client.aclose()
+
+
+_backend = None
+
+
+def get_backend() -> LLMBackend:
+    """
+    获取进程内共享的 LLMBackend，第一次调用时创建
+    """
+    global _backend
+    if _backend is None:
+        _backend = LLMBackend()
+    return _backend
+
+
+async def close_backend():
+    global _backend
+    if _backend is not None:
+        await _backend.aclose()
+        _backend = None
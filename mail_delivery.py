@@ -0,0 +1,206 @@
+"""
+邮件投递子系统：后台队列 + 常驻的已登录 SMTP 连接
+    submit() 立即返回邮件编号，后台 worker 从队列中取出邮件，多封邮件复用同一个连接批量发送
+    发送失败时按退避时间重试，收件人被拒绝等永久性错误不重试，status() 查询投递状态
+环境变量：
+    SMTP_SERVER / SMTP_PORT / EMAIL_USER / EMAIL_PASS: SMTP 服务器与账号，EMAIL_PASS 为空时不登录
+    SMTP_SSL: 为 1（默认）时使用 SMTP_SSL，否则使用普通 SMTP（服务器支持时升级为 STARTTLS）
+    MAIL_WORKERS: worker 数量，即常驻连接的数量（默认 2）
+    MAIL_BATCH_SIZE: 一个连接一次连续发送的邮件数量上限（默认 20）
+    MAIL_MAX_ATTEMPTS: 每封邮件的最多尝试次数（默认 3）
+    MAIL_IDLE_TIMEOUT: 连接空闲超过该秒数后，复用前先检查连接（默认 60）
+本地调试时可以启动一个不校验账号的 SMTP 服务器代替真实服务器，例如：
+    python -m aiosmtpd -n -l localhost:1025      （或 Python 3.10 自带的 python -m smtpd -n -c DebuggingServer localhost:1025）
+并设置 SMTP_SERVER=localhost SMTP_PORT=1025 SMTP_SSL=0 EMAIL_PASS=
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+import smtplib
+from collections import OrderedDict
+from email.message import EmailMessage
+
+## 这些错误说明邮件本身有问题，重试不会成功
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPNotSupportedError)
+
+
+class SMTPConnection:
+    """
+    一个 worker 常驻的 SMTP 连接，断开或空闲过久时自动重连
+    只在 worker 的线程中使用
+    """
+
+    def __init__(self, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self.server = None
+        self.last_used = 0.0
+
+    def get(self) -> smtplib.SMTP:
+        if self.server is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            try:
+                self.server.noop()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self.server is None:
+            self.server = self._connect()
+        self.last_used = time.monotonic()
+        return self.server
+
+    @staticmethod
+    def _connect() -> smtplib.SMTP:
+        host = os.getenv("SMTP_SERVER")
+        port = int(os.getenv("SMTP_PORT", 465))
+        user = os.getenv("EMAIL_USER")
+        password = os.getenv("EMAIL_PASS")
+        if os.getenv("SMTP_SSL", "1") == "1":
+            server = smtplib.SMTP_SSL(host, port, timeout=30)
+        else:
+            server = smtplib.SMTP(host, port, timeout=30)
+            server.ehlo()
+            if server.has_extn("starttls"):
+                server.starttls()
+                server.ehlo()
+        if password:
+            server.login(user, password)
+        return server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+
+class MailJob:
+
+    def __init__(self, message: EmailMessage):
+        self.id = uuid.uuid4().hex[:12]
+        self.message = message
+        self.attempts = 0
+        self.status = "queued"
+        self.error = None
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class MailQueue:
+
+    def __init__(self, workers: int = None, batch_size: int = None, max_attempts: int = None,
+                 idle_timeout: float = None, max_status: int = 1000):
+        self.workers = workers or int(os.getenv("MAIL_WORKERS", 2))
+        self.batch_size = batch_size or int(os.getenv("MAIL_BATCH_SIZE", 20))
+        self.max_attempts = max_attempts or int(os.getenv("MAIL_MAX_ATTEMPTS", 3))
+        self.idle_timeout = idle_timeout or float(os.getenv("MAIL_IDLE_TIMEOUT", 60))
+        self.max_status = max_status
+        self._queue = None
+        self._tasks = []
+        self._connections = []
+        self._pending = set()
+        self._jobs = OrderedDict()
+
+    def _start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        for _ in range(self.workers):
+            connection = SMTPConnection(self.idle_timeout)
+            self._connections.append(connection)
+            self._tasks.append(asyncio.create_task(self._worker(connection)))
+
+    async def submit(self, message: EmailMessage) -> MailJob:
+        """
+        加入发送队列，立即返回 MailJob，可以 await job.done 等待投递结果
+        """
+        self._start()
+        job = MailJob(message)
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_status:
+            self._jobs.popitem(last=False)
+        await self._queue.put(job)
+        return job
+
+    def status(self, message_id: str):
+        job = self._jobs.get(message_id)
+        if job is None:
+            return None
+        status = {"id": job.id, "status": job.status, "attempts": job.attempts}
+        # 字段名不用 error：client 会把带 error 字段的结果当作工具调用失败
+        if job.error is not None:
+            status["last_failure"] = job.error
+        return status
+
+    async def _worker(self, connection: SMTPConnection):
+        while True:
+            batch = [await self._queue.get()]
+            ## 队列中已有的邮件一起取出，用同一个连接连续发送
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for job in batch:
+                job.status = "sending"
+                job.attempts += 1
+            results = await asyncio.to_thread(self._send_batch, connection, batch)
+            for job, error in zip(batch, results):
+                self._queue.task_done()
+                self._finish(job, error)
+
+    @staticmethod
+    def _send_batch(connection: SMTPConnection, batch: list) -> list:
+        """
+        在线程中执行，返回与 batch 对应的错误列表（成功为 None）
+        连接出错时关闭该连接，后面的邮件会重新建立连接
+        """
+        results = []
+        for job in batch:
+            try:
+                connection.get().send_message(job.message)
+                results.append(None)
+            except PERMANENT_ERRORS as e:
+                results.append(e)
+            except Exception as e:
+                connection.close()
+                results.append(e)
+        return results
+
+    def _finish(self, job: MailJob, error):
+        if error is None:
+            job.status = "sent"
+            job.error = None
+            job.done.set_result(job)
+            return
+        job.error = str(error)
+        if isinstance(error, PERMANENT_ERRORS) or job.attempts >= self.max_attempts:
+            job.status = "failed"
+            job.done.set_result(job)
+            return
+        ## 临时性错误：指数退避加抖动后重新入队
+        job.status = "retrying"
+        delay = random.uniform(0, min(30.0, 2 ** job.attempts))
+        task = asyncio.create_task(self._requeue(job, delay))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _requeue(self, job: MailJob, delay: float):
+        await asyncio.sleep(delay)
+        job.status = "queued"
+        await self._queue.put(job)
+
+    async def close(self, timeout: float = 10):
+        """
+        等待队列中的邮件发送完（最多 timeout 秒），然后关闭连接
+        """
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in [*self._tasks, *self._pending]:
+            task.cancel()
+        for connection in self._connections:
+            await asyncio.to_thread(connection.close)
+        self._queue = None
+        self._tasks = []
+        self._connections = []
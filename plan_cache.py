@@ -0,0 +1,102 @@
+import os
+import re
+import json
+import time
+import copy
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_query(query: str) -> str:
+    """
+    归一化 query：全角转半角、英文小写、合并空白、去掉首尾的标点
+    """
+    text = unicodedata.normalize("NFKC", query).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip(" 。.!！?？,，;；")
+
+
+class PlanCache:
+    """
+    plan_tool_usage 的结果缓存
+    key 为归一化后的 query 加上当前工具目录的指纹，工具集变化后旧的规划自动失效
+    使用 LRU 限制条目数，并且每个条目有 TTL；指定 path 时会持久化到本地 JSON 文件，重启后仍可命中
+    可通过环境变量配置：PLAN_CACHE_SIZE（默认 256）、PLAN_CACHE_TTL（秒，默认 3600）、PLAN_CACHE_PATH（默认不持久化）
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None, path: str = None):
+        self.max_size = max_size or int(os.getenv("PLAN_CACHE_SIZE", 256))
+        self.ttl = ttl or float(os.getenv("PLAN_CACHE_TTL", 3600))
+        self.path = path or os.getenv("PLAN_CACHE_PATH")
+        # key -> (写入时间, 工具目录指纹, plan)
+        self._entries = OrderedDict()
+        self.fingerprint = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._load()
+
+    def get(self, query: str, fingerprint: str):
+        self._check_fingerprint(fingerprint)
+        key = normalize_query(query)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] != fingerprint or time.time() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return copy.deepcopy(entry[2])
+
+    def put(self, query: str, fingerprint: str, plan: list):
+        ## 解析失败得到的空规划不缓存
+        if not plan:
+            return
+        self._check_fingerprint(fingerprint)
+        key = normalize_query(query)
+        self._entries[key] = (time.time(), fingerprint, copy.deepcopy(plan))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        self._save()
+
+    def invalidate(self):
+        self._entries.clear()
+        self.stats["invalidations"] += 1
+        self._save()
+
+    def _check_fingerprint(self, fingerprint: str):
+        """
+        工具目录变化时清空缓存
+        """
+        if self.fingerprint is not None and fingerprint != self.fingerprint:
+            self.invalidate()
+        self.fingerprint = fingerprint
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            now = time.time()
+            for key, created, fingerprint, plan in data.get("entries", []):
+                if now - created <= self.ttl:
+                    self._entries[key] = (created, fingerprint, plan)
+            self.fingerprint = data.get("fingerprint")
+        except Exception as e:
+            print(f"规划缓存加载失败: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({
+                    "fingerprint": self.fingerprint,
+                    "entries": [[key, *entry] for key, entry in self._entries.items()],
+                }, file, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"规划缓存保存失败: {e}")
@@ -0,0 +1,206 @@
+import re
+import asyncio
+from typing import Callable, Dict, List
+from retry_policy import RetryPolicy, PERMANENT, classify_exception
+import telemetry
+
+## 串联工具时使用的 {{name}} 占位符
+REF_PATTERN = re.compile(r"\{\{(.*?)\}\}")
+
+
+class PlanStep:
+    """
+    工具调用链中的一个步骤
+    deps 为依赖的步骤下标，由参数中的 {{name}} 引用推导得到
+    """
+
+    def __init__(self, index: int, name: str, arguments: dict):
+        self.index = index
+        self.name = name
+        self.arguments = arguments if isinstance(arguments, dict) else {}
+        self.deps = set()
+        # 引用名 -> 提供该结果的步骤下标
+        self.ref_sources = {}
+        # pending / running / done / failed / cancelled
+        self.status = "pending"
+        # 最近一次失败的错误类型，见 retry_policy
+        self.error_class = None
+        self.output = None
+        # 实际调用时使用的参数（引用已替换）
+        self.call_arguments = None
+        self.attempts = 0
+        self.done = asyncio.Event()
+
+
+def find_refs(arguments: dict) -> List[str]:
+    """
+    找出参数中所有 {{name}} 形式的引用
+    """
+    refs = []
+    for val in arguments.values():
+        if isinstance(val, str):
+            refs.extend(match.strip() for match in REF_PATTERN.findall(val))
+    return refs
+
+
+def build_dependency_graph(tool_plan: List[dict]) -> List[PlanStep]:
+    """
+    将 plan_tool_usage 返回的工具链转换为依赖图
+    {{name}} 指向它之前最近的一个同名步骤，若之前没有，则指向之后最近的同名步骤
+    找不到同名步骤的引用不会产生依赖，在执行时按无法解析处理
+    """
+    steps = [PlanStep(i, step.get("name"), step.get("arguments", {})) for i, step in enumerate(tool_plan)]
+    for step in steps:
+        for ref in find_refs(step.arguments):
+            before = [s.index for s in steps[:step.index] if s.name == ref]
+            after = [s.index for s in steps[step.index + 1:] if s.name == ref]
+            if before:
+                source = before[-1]
+            elif after:
+                source = after[0]
+            else:
+                continue
+            step.ref_sources[ref] = source
+            step.deps.add(source)
+    _break_cycles(steps)
+    return steps
+
+
+def _break_cycles(steps: List[PlanStep]):
+    """
+    向后引用可能形成环，去掉成环的那条依赖，该引用在执行时按无法解析处理，避免互相等待
+    """
+    state = {}
+
+    def visit(index):
+        state[index] = "visiting"
+        step = steps[index]
+        for dep in list(step.deps):
+            if state.get(dep) == "visiting":
+                step.deps.discard(dep)
+                step.ref_sources = {ref: src for ref, src in step.ref_sources.items() if src != dep}
+            elif dep not in state:
+                visit(dep)
+        state[index] = "done"
+
+    for step in steps:
+        if step.index not in state:
+            visit(step.index)
+
+
+def resolve_refs(step: PlanStep, steps: List[PlanStep]):
+    """
+    用依赖步骤的输出替换参数中的 {{name}}
+    返回 (替换后的参数, 是否全部解析成功)
+    """
+    resolved = {}
+    for key, val in step.arguments.items():
+        if isinstance(val, str) and "{{" in val and "}}" in val:
+            for match in REF_PATTERN.findall(val):
+                ref_key = match.strip()
+                source = step.ref_sources.get(ref_key)
+                if source is not None and steps[source].status == "done":
+                    val = val.replace(f"{{{{{match}}}}}", str(steps[source].output))
+            if REF_PATTERN.search(val):
+                return resolved, False
+        resolved[key] = val
+    return resolved, True
+
+
+class PlanExecutor:
+    """
+    按依赖图并发执行工具链
+    没有依赖关系的步骤同时执行，依赖的步骤在其输入全部完成后立即开始
+    每个 server 同时进行的调用数量由 semaphores 中对应的信号量限制
+    失败的步骤按 retry_policy 有限次地重试，依赖的步骤最终失败时，下游步骤直接取消
+    run_step(step, arguments) 返回 (是否成功, 输出文本, 错误类型)
+    on_event(event_type, step) 在每次尝试开始（step_start）与步骤结束（step_finish）时调用，用于上报进度
+    resolve_references 为 False 时不解析 {{name}} 引用，所有步骤相互独立、参数原样使用（原生 tool_calls 的参数）
+    """
+
+    def __init__(self, run_step: Callable, server_of: Callable, semaphores: Dict[str, asyncio.Semaphore] = None,
+                 retry_policy: RetryPolicy = None, on_event: Callable = None, resolve_references: bool = True):
+        self.run_step = run_step
+        self.server_of = server_of
+        self.semaphores = semaphores or {}
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.on_event = on_event
+        self.resolve_references = resolve_references
+
+    async def run(self, tool_plan: List[dict], deadline_at: float = None) -> List[PlanStep]:
+        """
+        deadline_at 为事件循环时间上的截止时刻，多次 run 共用一个 query 的时限时传入，默认为 retry_policy.deadline 秒后
+        """
+        if self.resolve_references:
+            steps = build_dependency_graph(tool_plan)
+        else:
+            steps = [PlanStep(i, step.get("name"), step.get("arguments", {})) for i, step in enumerate(tool_plan)]
+        now = asyncio.get_running_loop().time()
+        if deadline_at is None:
+            deadline_at = now + self.retry_policy.deadline
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(self._run_one(step, steps, deadline_at) for step in steps)),
+                timeout=max(0.0, deadline_at - now),
+            )
+        except asyncio.TimeoutError:
+            print("工具链执行超时，未完成的步骤已取消")
+            ## 时限已到时还没开始执行的步骤不会经过 _run_one 的 finally，这里统一标记为失败
+            for step in steps:
+                if step.status == "pending":
+                    step.status = "failed"
+                    step.output = "工具链执行超时"
+                    step.done.set()
+        return steps
+
+    async def _run_one(self, step: PlanStep, steps: List[PlanStep], deadline_at: float):
+        try:
+            for dep in step.deps:
+                await steps[dep].done.wait()
+            ## 依赖的步骤最终失败，当前步骤不可能拿到输入，直接取消
+            if any(steps[dep].status != "done" for dep in step.deps):
+                step.status = "cancelled"
+                step.output = "依赖的步骤执行失败"
+                return
+            if self.resolve_references:
+                arguments, ok = resolve_refs(step, steps)
+            else:
+                arguments, ok = dict(step.arguments), True
+            if not ok:
+                step.error_class = PERMANENT
+                step.output = "unresolved reference"
+                return
+            semaphore = self.semaphores.get(self.server_of(step.name))
+            while True:
+                step.attempts += 1
+                step.status = "running"
+                step.call_arguments = dict(arguments)
+                if self.on_event:
+                    self.on_event("step_start", step)
+                try:
+                    if semaphore is not None:
+                        async with semaphore:
+                            ok, output, error_class = await self.run_step(step, step.call_arguments)
+                    else:
+                        ok, output, error_class = await self.run_step(step, step.call_arguments)
+                except Exception as e:
+                    ok, output, error_class = False, f"error: {e}", classify_exception(e)
+                step.output = output
+                if ok:
+                    step.status = "done"
+                    step.error_class = None
+                    return
+                step.error_class = error_class
+                print(f"error（{error_class}），第 {step.attempts} 次尝试")
+                if not self.retry_policy.should_retry(error_class, step.attempts):
+                    return
+                if not await self.retry_policy.sleep_before_retry(step.attempts, deadline_at):
+                    return
+                telemetry.metrics.inc("tool_retries_total", tool=step.name, error_class=error_class)
+        finally:
+            if step.status not in ("done", "cancelled"):
+                step.status = "failed"
+            step.done.set()
+            telemetry.metrics.inc("plan_steps_total", status=step.status)
+            if self.on_event:
+                self.on_event("step_finish", step)
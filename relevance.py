@@ -0,0 +1,106 @@
+import os
+import re
+import hashlib
+from collections import OrderedDict
+
+## 阶段状态类的结果直接视为相关（文件创建、写入、邮件发送成功、获取到的时间等）
+STATUS_PATTERNS = [
+    re.compile(r"文件'.*'(创建|写入)成功"),
+    re.compile(r"内容已成功追加到文件"),
+    re.compile(r"个文件操作已成功执行"),
+    re.compile(r"删除成功"),
+    re.compile(r"邮件已成功发送"),
+    re.compile(r"邮件已加入发送队列"),
+    re.compile(r"^\d{4}年\d{2}月\d{2}日 \d{2}:\d{2}:\d{2}$"),
+]
+## 结果总是作为上下文使用，不需要判定的工具：计算结果，以及用户要求读取的文件内容
+## （文件内容与 query 的用词往往没有重合，例如“读取poem.txt然后发邮件给我”）
+ALWAYS_RELEVANT_TOOLS = {"calculate", "calculate_batch", "read_file", "read_file_range", "read_file_lines",
+                         "head_file", "tail_file", "read_file_chunk"}
+
+JUDGE_PROMPT = ("你是一个判断能力很强的问题助手，擅长分析两段文本之间的关系。"
+                "现在需要你判定answer是否能够作为解决用户的query的上下文，或者answer是否与用户的query相关，或者answer是否对query的解决有帮助。"
+                "能作为上下文的answer可能是获取到的时间比如“2025年05月29日 10:00:26”，可能是与query相关的一段文本，比如可供query参考的资料，也可能是解决query过程中的阶段状态，比如文件创建、写入成功、邮件发送成功等状态，这些都能算是上下文"
+                "能作为上下文则回复“True”，否则回复“False”"
+                "不回复多余文字，直接输出True或者False即可")
+
+CJK_PATTERN = re.compile(r"[一-鿿]+")
+WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
+
+def tokenize(text: str) -> list:
+    """
+    中英文混合分词：英文与数字按单词（小写），中文按相邻两字的 bigram，单字的中文片段保留单字
+    """
+    tokens = [word.lower() for word in WORD_PATTERN.findall(text)]
+    for run in CJK_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def overlap_score(query: str, text: str) -> float:
+    """
+    query 中的词有多大比例出现在 text 中，取值 [0, 1]
+    """
+    query_tokens = set(tokenize(query))
+    if not query_tokens:
+        return 0.0
+    text_tokens = set(tokenize(text))
+    return len(query_tokens & text_tokens) / len(query_tokens)
+
+
+class RelevanceJudge:
+    """
+    判定工具结果能否作为 query 的上下文
+    mode（环境变量 RELEVANCE_MODE）：
+        local: 默认，先用规则和本地的词重叠打分，重合度达到 high 时直接判定为相关，否则调用大模型；
+               本地打分只用于跳过大模型，不会单独判定为无关
+        llm: 每个结果都调用大模型判定（原先的行为）
+        off: 不判定，全部视为相关
+    判定结果按 (query, 结果哈希) 缓存
+    """
+
+    def __init__(self, llm, mode: str = None, high: float = None, cache_size: int = 1024):
+        self.llm = llm
+        self.mode = mode or os.getenv("RELEVANCE_MODE", "local")
+        self.high = high if high is not None else float(os.getenv("RELEVANCE_HIGH", 0.3))
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.stats = {"rule": 0, "local": 0, "llm": 0, "cache_hit": 0}
+
+    async def judge(self, query: str, tool_name: str, result_text: str) -> bool:
+        if self.mode == "off" or tool_name in ALWAYS_RELEVANT_TOOLS:
+            return True
+        key = (query, hashlib.sha1(result_text.encode("utf-8")).hexdigest())
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats["cache_hit"] += 1
+            return self._cache[key]
+        verdict = await self._judge(query, result_text)
+        self._cache[key] = verdict
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return verdict
+
+    async def _judge(self, query: str, result_text: str) -> bool:
+        if self.mode != "llm":
+            text = result_text.strip()
+            if any(pattern.search(text) for pattern in STATUS_PATTERNS):
+                self.stats["rule"] += 1
+                return True
+            score = overlap_score(query, text)
+            if score >= self.high:
+                self.stats["local"] += 1
+                return True
+        self.stats["llm"] += 1
+        judgement = await self.llm.chat(
+            messages=[
+                {"role": "system", "content": JUDGE_PROMPT},
+                {"role": "user", "content": f"这是用户的query：“{query}”\n这是answer：{result_text}"}
+            ],
+            call_site="judge",
+        )
+        return "False" not in judgement.choices[0].message.content.strip()
@@ -0,0 +1,108 @@
+import os
+import json
+import random
+import asyncio
+
+## 错误分类
+# transient: 网络、超时、限流等临时性错误，值得退避后重试
+# irrelevant: 工具执行成功但结果被判定与 query 无关，换个时机重试可能有帮助，但次数应更少
+# tool_error: 工具返回了 error，原因不明
+# permanent: 文件不存在、未知工具、参数非法等，重试不会成功
+TRANSIENT = "transient"
+IRRELEVANT = "irrelevant"
+TOOL_ERROR = "tool_error"
+PERMANENT = "permanent"
+
+TRANSIENT_MARKERS = ("timeout", "timed out", "超时", "connect", "连接", "network", "网络",
+                     "429", "rate limit", "HTTP 5", "temporarily", "503", "502", "504")
+PERMANENT_MARKERS = ("未找到", "不存在", "没找到", "未知工具", "无权限", "Unknown identifier",
+                     "Unsupported operation", "Invalid", "invalid", "HTTP 4", "validation")
+## 已经产生了部分副作用的结果（比如批量文件操作部分生效），重试会重复执行，优先于其他标记
+NOT_RETRYABLE_MARKER = "不可重试"
+
+
+def is_error_output(text: str) -> bool:
+    """
+    判断工具返回的文本是否表示失败
+    JSON 结果按结构判断：对象带有 error 字段，或数组中每一项都是带 error 字段的对象（比如全部失败的搜索结果）；
+    这样状态查询、批量计算等结果的字段值中出现 error 字样时不会被误判。其他文本按是否包含 error 判断
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return "error" in text or "Error" in text
+    if isinstance(data, dict):
+        return "error" in data
+    if isinstance(data, list):
+        return bool(data) and all(isinstance(item, dict) and "error" in item for item in data)
+    return False
+
+
+def classify_output(text: str) -> str:
+    """
+    根据工具返回的错误文本判断错误类型
+    """
+    if NOT_RETRYABLE_MARKER in text:
+        return PERMANENT
+    if any(marker in text for marker in TRANSIENT_MARKERS):
+        return TRANSIENT
+    if any(marker in text for marker in PERMANENT_MARKERS):
+        return PERMANENT
+    return TOOL_ERROR
+
+
+def classify_exception(exc: BaseException) -> str:
+    """
+    call_tool 抛出的异常大多来自传输层（子进程、网络、超时），按临时性错误处理
+    参数类错误按永久性错误处理
+    """
+    if isinstance(exc, (TypeError, ValueError, KeyError)):
+        return PERMANENT
+    return TRANSIENT
+
+
+class RetryPolicy:
+    """
+    有上限的重试策略：按错误类型给出每个步骤的尝试次数上限，重试间隔为带抖动的指数退避
+    默认值可以通过环境变量配置：
+        RETRY_MAX_ATTEMPTS: transient / tool_error 的最多尝试次数（默认 3）
+        RETRY_IRRELEVANT_ATTEMPTS: irrelevant 的最多尝试次数（默认 2）
+        RETRY_BASE_DELAY / RETRY_MAX_DELAY: 退避的初始与最大间隔秒数（默认 0.5 / 8）
+        QUERY_DEADLINE: 一个 query 执行工具链的总时限秒数（默认 120）
+    """
+
+    def __init__(self, max_attempts: dict = None, base_delay: float = None,
+                 max_delay: float = None, deadline: float = None):
+        default_attempts = int(os.getenv("RETRY_MAX_ATTEMPTS", 3))
+        self.max_attempts = {
+            TRANSIENT: default_attempts,
+            TOOL_ERROR: default_attempts,
+            IRRELEVANT: int(os.getenv("RETRY_IRRELEVANT_ATTEMPTS", 2)),
+            PERMANENT: 1,
+        }
+        if max_attempts:
+            self.max_attempts.update(max_attempts)
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv("RETRY_BASE_DELAY", 0.5))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("RETRY_MAX_DELAY", 8))
+        self.deadline = deadline if deadline is not None else float(os.getenv("QUERY_DEADLINE", 120))
+
+    def should_retry(self, error_class: str, attempts: int) -> bool:
+        return attempts < self.max_attempts.get(error_class, 1)
+
+    def backoff(self, attempts: int) -> float:
+        """
+        full jitter 的指数退避：在 [0, min(max_delay, base_delay * 2^(attempts-1))] 中随机取值
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return random.uniform(0, cap)
+
+    async def sleep_before_retry(self, attempts: int, deadline_at: float) -> bool:
+        """
+        等待退避时间后返回 True；若等待后会超过 query 的时限，则不等待直接返回 False
+        """
+        delay = self.backoff(attempts)
+        loop = asyncio.get_running_loop()
+        if loop.time() + delay >= deadline_at:
+            return False
+        await asyncio.sleep(delay)
+        return True
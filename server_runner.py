@@ -0,0 +1,38 @@
+import os
+import argparse
+from contextlib import nullcontext
+from typing import AsyncContextManager, Callable
+import anyio
+from mcp.server.fastmcp import FastMCP
+import telemetry
+
+
+def run_server(mcp: FastMCP, lifespan: Callable[[], AsyncContextManager] = None):
+    """
+    按命令行参数或环境变量选择传输方式启动 server，默认为 stdio
+    使用 sse / streamable-http 时可以在不同端口启动同一个 server 的多个副本，例如：
+        python Server_web_brower.py --transport streamable-http --port 8001
+    环境变量：MCP_TRANSPORT、MCP_HOST（默认 127.0.0.1）、MCP_PORT（默认 8000）
+    lifespan 管理整个进程共享的资源（HTTP 客户端、缓存、邮件队列等），进程启动时进入一次、退出时关闭
+    不能用 FastMCP 的 lifespan：sse / streamable-http 下它在每个连接上各执行一次，一个 client 断开就会关闭其他会话正在用的资源
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transport", default=os.getenv("MCP_TRANSPORT", "stdio"),
+                        choices=["stdio", "sse", "streamable-http"])
+    parser.add_argument("--host", default=os.getenv("MCP_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MCP_PORT", 8000)))
+    args = parser.parse_args()
+    mcp.settings.host = args.host
+    mcp.settings.port = args.port
+    telemetry.instrument_server(mcp)
+    transports = {
+        "stdio": mcp.run_stdio_async,
+        "sse": mcp.run_sse_async,
+        "streamable-http": mcp.run_streamable_http_async,
+    }
+
+    async def serve():
+        async with (lifespan() if lifespan is not None else nullcontext()):
+            await transports[args.transport]()
+
+    anyio.run(serve)
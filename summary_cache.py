@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from plan_cache import normalize_query
+import telemetry
+
+## 每种结果对应的 stats 字段，以及命中时在 summary_cache_hits_total 中的 tier 标签
+STATS_KEYS = {"memory": "memory_hits", "disk": "disk_hits", "inflight": "collapsed", "miss": "llm_calls"}
+
+
+class _LeaderCancelled(Exception):
+    """
+    负责计算的请求被取消，等待的请求需要重新计算
+    """
+
+
+class SummaryCache:
+    """
+    大模型摘要结果的缓存，key 为 (内容哈希, 归一化后的 subquery, 模型)
+    内存中为 LRU，指定 path 时再加一层 SQLite 磁盘缓存
+    同一个 key 同时有多个请求时只调用一次大模型，其余请求等待同一个结果
+    可通过环境变量配置：SUMMARY_CACHE_SIZE（默认 512）、SUMMARY_CACHE_PATH（默认不落盘）
+    除了 stats，命中与省下的调用次数还记录为指标 summary_cache_hits_total（按 tier）、summary_calls_saved_total、
+    summary_llm_calls_total，每次查询记录一个 summary span，cache 属性为结果（memory、disk、inflight、miss）
+    """
+
+    def __init__(self, max_size: int = None, path: str = None):
+        self.max_size = max_size or int(os.getenv("SUMMARY_CACHE_SIZE", 512))
+        self.path = path or os.getenv("SUMMARY_CACHE_PATH")
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "collapsed": 0, "llm_calls": 0}
+        self.conn = None
+        if self.path:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS summary (key TEXT PRIMARY KEY, summary TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self.conn.commit()
+
+    @property
+    def saved_calls(self) -> int:
+        return self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["collapsed"]
+
+    @staticmethod
+    def make_key(content: str, subquery: str, model: str) -> str:
+        content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        return hashlib.sha1(f"{content_hash}\n{normalize_query(subquery)}\n{model}".encode("utf-8")).hexdigest()
+
+    async def get_or_compute(self, content: str, subquery: str, model: str,
+                             compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        命中缓存则直接返回，否则调用 compute() 生成摘要并写入缓存
+        compute 抛出的异常不会被缓存，会原样传给所有等待该 key 的请求
+        负责计算的请求被取消时（比如超时的请求）不影响等待的请求，它们重新检查缓存，由其中一个接着计算
+        """
+        key = self.make_key(content, subquery, model)
+        with telemetry.span("summary") as current:
+            while True:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    self._record("memory", current)
+                    return self._memory[key]
+                summary = self._get_disk(key)
+                if summary is not None:
+                    self._record("disk", current)
+                    self._put_memory(key, summary)
+                    return summary
+                if key not in self._inflight:
+                    self._record("miss", current)
+                    return await self._compute(key, compute)
+                self._record("inflight", current)
+                try:
+                    return await asyncio.shield(self._inflight[key])
+                except _LeaderCancelled:
+                    continue
+
+    def _record(self, result: str, current):
+        self.stats[STATS_KEYS[result]] += 1
+        current.set(cache=result)
+        if result == "miss":
+            telemetry.metrics.inc("summary_llm_calls_total")
+            return
+        telemetry.metrics.inc("summary_cache_hits_total", tier=result)
+        telemetry.metrics.inc("summary_calls_saved_total")
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            summary = await compute()
+            self._put_memory(key, summary)
+            self._put_disk(key, summary)
+            future.set_result(summary)
+            return summary
+        except asyncio.CancelledError:
+            # 不能把 CancelledError 传给其他请求，否则会取消与之无关的 web_search
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他请求等待时，避免出现 "exception was never retrieved" 的警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _put_memory(self, key: str, summary: str):
+        self._memory[key] = summary
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _get_disk(self, key: str):
+        if self.conn is None:
+            return None
+        row = self.conn.execute("SELECT summary FROM summary WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _put_disk(self, key: str, summary: str):
+        if self.conn is None:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO summary (key, summary, created_at) VALUES (?, ?, ?)",
+            (key, summary, time.time()),
+        )
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
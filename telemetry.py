@@ -0,0 +1,352 @@
+"""
+链路追踪与指标：client 与各个 server 共用
+    span: 记录一段操作的耗时，按 trace_id 串联一次 query 中的规划、工具调用、相关性判定、网页抓取与最终回答
+          client 调用工具时把 trace_id 与当前 span 放在请求的 _meta 中，server 端的 span 挂在同一条链路下
+    metrics: 计数器与直方图（span 耗时、LLM token 用量、工具调用次数与错误类型、重试次数、请求与返回的字节数）
+环境变量：
+    TELEMETRY: 为 0 时关闭，span 与指标都换成空操作，几乎没有开销（默认 1）
+    TELEMETRY_TRACE_PATH: JSONL 追踪文件，每个结束的 span 写一行，client 与各个 server 可以写同一个文件（默认不写）
+    TELEMETRY_METRICS_PORT / TELEMETRY_METRICS_HOST: 在该地址提供 Prometheus 文本格式的 /metrics
+        （默认不开启，只在 client 进程中开启，server 的数据通过追踪文件查看）
+    TELEMETRY_SERVICE: span 中记录的服务名（默认为脚本名）
+设置在第一次使用时读取（server 在 instrument_server 时重新读取），而不是在导入时：
+各个 server 在 load_dotenv 之前就导入了本模块，client 通过 stdio 启动的 server 的环境变量见 Client.load_server_config
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+
+## 由 configure 从环境变量读取的设置与对应的实现：ENABLED、TRACE_PATH、METRICS_PORT、SERVICE_NAME、metrics、span
+_SETTINGS = ("ENABLED", "TRACE_PATH", "METRICS_PORT", "SERVICE_NAME", "metrics", "span")
+_configured = False
+
+## 直方图的桶（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_span = contextvars.ContextVar("telemetry_span", default=None)
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "duration", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": SERVICE_NAME,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """
+    关闭时使用的 span，所有操作都是空操作
+    """
+    trace_id = None
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_NOOP_CONTEXT = nullcontext(NOOP_SPAN)
+
+
+class Metrics:
+    """
+    进程内的计数器与直方图，标签以 (name, 排序后的标签) 为 key
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self) -> str:
+        """
+        Prometheus 文本格式
+        """
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class _NoopMetrics:
+
+    def inc(self, name: str, value: float = 1, **labels):
+        pass
+
+    def observe(self, name: str, value: float, **labels):
+        pass
+
+    def render(self) -> str:
+        return ""
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _TraceWriter:
+    """
+    把结束的 span 追加到 JSONL 文件，多个进程追加同一个文件时每行一次 write
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line)
+            except OSError as e:
+                # 追踪文件写不进去时不影响正常的调用
+                print(f"追踪写入失败: {e}", file=sys.stderr)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_trace_writer = None
+
+
+@contextmanager
+def _span(name: str, trace_id: str = None, parent_id: str = None, **attributes):
+    parent = _current_span.get()
+    if parent is not None:
+        trace_id = trace_id or parent.trace_id
+        parent_id = parent_id or parent.span_id
+    current = Span(name, trace_id or new_id(), parent_id, attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except GeneratorExit:
+        # 流式 query 的消费方提前结束，不算作出错
+        raise
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 异步生成器在其他上下文中被关闭时无法还原，忽略即可
+            pass
+        metrics.observe("span_duration_seconds", current.duration, span=name)
+        if _trace_writer is not None:
+            _trace_writer.write(current.to_dict())
+
+
+def _noop_span(name: str, trace_id: str = None, parent_id: str = None, **attributes):
+    return _NOOP_CONTEXT
+
+
+def configure():
+    """
+    从环境变量读取设置，第一次访问 ENABLED、metrics、span 等属性时自动调用，可以重复调用
+    关闭时 metrics 与 span 直接换成空实现，调用处不需要判断是否开启；已经记录的指标在重新读取时保留
+    """
+    global ENABLED, TRACE_PATH, METRICS_PORT, SERVICE_NAME, metrics, span, _trace_writer, _configured
+    ENABLED = os.getenv("TELEMETRY", "1") != "0"
+    TRACE_PATH = os.getenv("TELEMETRY_TRACE_PATH")
+    METRICS_PORT = os.getenv("TELEMETRY_METRICS_PORT")
+    SERVICE_NAME = os.getenv("TELEMETRY_SERVICE") or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+    if not ENABLED:
+        metrics = _NoopMetrics()
+    elif not isinstance(globals().get("metrics"), Metrics):
+        metrics = Metrics()
+    span = _span if ENABLED else _noop_span
+    path = TRACE_PATH if ENABLED else None
+    if _trace_writer is not None and _trace_writer.path != path:
+        _trace_writer.close()
+        _trace_writer = None
+    if path and _trace_writer is None:
+        _trace_writer = _TraceWriter(path)
+    _configured = True
+
+
+def __getattr__(name: str):
+    ## 模块属性第一次被访问时才读取设置
+    if name in _SETTINGS and not _configured:
+        configure()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _ensure_configured():
+    if not _configured:
+        configure()
+
+
+def current_span():
+    _ensure_configured()
+    return _current_span.get() if ENABLED else None
+
+
+def trace_meta():
+    """
+    调用工具时放入请求 _meta 的链路信息，没有进行中的 span 时返回 None
+    """
+    current = current_span()
+    if current is None:
+        return None
+    return {"trace_id": current.trace_id, "parent_span_id": current.span_id}
+
+
+def record_llm_usage(call_site: str, usage):
+    """
+    记录一次 completion 的 token 用量，usage 为 response.usage（可能为 None）
+    """
+    _ensure_configured()
+    if not ENABLED or usage is None:
+        return
+    metrics.inc("llm_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, call_site=call_site, type="prompt")
+    metrics.inc("llm_tokens_total", getattr(usage, "completion_tokens", 0) or 0, call_site=call_site, type="completion")
+    current = current_span()
+    if current is not None:
+        current.set(prompt_tokens=getattr(usage, "prompt_tokens", None),
+                    completion_tokens=getattr(usage, "completion_tokens", None))
+
+
+def instrument_server(mcp):
+    """
+    为 FastMCP server 的工具调用加上 span：从请求的 _meta 中取出 client 传来的 trace_id，
+    工具内部的大模型调用、网页抓取等 span 都挂在这条链路下
+    server 在这里重新读取设置，此时 .env 已经加载
+    """
+    configure()
+    if not ENABLED:
+        return
+
+    async def call_tool(name: str, arguments: dict):
+        try:
+            meta = mcp.get_context().request_context.meta
+        except (LookupError, ValueError):
+            meta = None
+        trace_id = getattr(meta, "trace_id", None)
+        parent_id = getattr(meta, "parent_span_id", None)
+        with span(f"server.{name}", trace_id=trace_id, parent_id=parent_id, tool=name) as current:
+            request_bytes = len(json.dumps(arguments, ensure_ascii=False).encode("utf-8"))
+            result = await mcp.call_tool(name, arguments)
+            response_bytes = sum(len(getattr(item, "text", "").encode("utf-8")) for item in result)
+            current.set(request_bytes=request_bytes, response_bytes=response_bytes)
+            metrics.inc("server_tool_calls_total", tool=name)
+            return result
+
+    ## 覆盖 FastMCP 注册的 tools/call 处理函数
+    mcp._mcp_server.call_tool()(call_tool)
+
+
+async def start_metrics_server(port: int = None):
+    """
+    启动 Prometheus 的 /metrics 端点，未配置端口或已关闭时返回 None
+    """
+    _ensure_configured()
+    port = port or METRICS_PORT
+    if not ENABLED or not port:
+        return None
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            path = request_line.split()[1] if len(request_line.split()) > 1 else b"/"
+            if path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", metrics.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("utf-8") + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    host = os.getenv("TELEMETRY_METRICS_HOST", "127.0.0.1")
+    server = await asyncio.start_server(handle, host, int(port))
+    print(f"指标端点：http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+from Client import MCPClient, replica_count
+
+
+class ServerConcurrencyTest(unittest.IsolatedAsyncioTestCase):
+
+    def test_replica_count(self):
+        self.assertEqual(replica_count({"command": "python", "replicas": 3}), 3)
+        self.assertEqual(replica_count({"transport": "sse", "urls": ["http://a/sse", "http://b/sse"]}), 2)
+        self.assertEqual(replica_count({"transport": "streamable-http", "url": "http://a/mcp"}), 1)
+
+    async def test_lazy_server_limit_scales_with_replicas(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            manifest_path = os.path.join(work_dir, "tool_manifest.json")
+            tool = {"name": "get_time", "description": "获取当前时间", "inputSchema": {"type": "object", "properties": {}}}
+            with open(manifest_path, "w", encoding="utf-8") as file:
+                json.dump({"Server_main": [tool]}, file)
+            client = MCPClient()
+            try:
+                await client.connect_all({
+                    "servers": {"Server_main": {"command": "python", "args": ["Server_main.py"], "lazy": True, "replicas": 3}},
+                    "manifest_path": manifest_path,
+                })
+                ## lazy 的 server 只注册了工具，没有启动进程
+                self.assertNotIn("Server_main", client.replicas)
+                self.assertEqual(client.server_semaphores["Server_main"]._value, client.server_concurrency * 3)
+            finally:
+                await client.cleanup()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from expression_eval import evaluate, evaluate_batch
+
+
+class ResourceLimitTest(unittest.TestCase):
+
+    def assertRejectedQuickly(self, expression: str):
+        start = time.perf_counter()
+        with self.assertRaises(ValueError):
+            evaluate(expression)
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_nested_powers_are_bounded(self):
+        self.assertRejectedQuickly("(9**9999)**999")
+        self.assertRejectedQuickly("((9**9)**9)**9**9")
+        self.assertRejectedQuickly("9**9**9")
+        self.assertRejectedQuickly("(2**1000)**(2**1000)")
+
+    def test_comb_and_perm_are_bounded(self):
+        self.assertRejectedQuickly("comb(10**9, 5*10**8)")
+        self.assertRejectedQuickly("perm(10**7)")
+        self.assertRejectedQuickly("perm(10**9, 10**6)")
+
+    def test_normal_expressions(self):
+        self.assertEqual(evaluate("(1 + 2) * 3 ^ 2"), 27)
+        self.assertEqual(evaluate("9**9999 % 7"), pow(9, 9999, 7))
+        self.assertEqual(evaluate("comb(10, 3) + perm(5, 2)"), 140)
+        self.assertEqual(evaluate("(-2)**3"), -8)
+        self.assertEqual(evaluate("2**-3"), 0.125)
+        self.assertEqual(evaluate("0.5**100000"), 0.0)
+
+    def test_batch_reports_limit_per_item(self):
+        results = evaluate_batch(expressions=["2**10", "(9**9999)**999"])
+        self.assertEqual(results[0], 1024)
+        self.assertIn("结果过大", str(results[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
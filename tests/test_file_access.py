@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import file_access
+from file_access import apply_operations, atomic_write, read_chunk, read_range, resolve_path, workspace_root, AppendBuffer
+from retry_policy import RetryPolicy, classify_output, PERMANENT
+
+
+class TempDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="file-access-test-")
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def read(self, name: str) -> str:
+        with open(self.path(name), "r", encoding="utf-8") as file:
+            return file.read()
+
+    def leftovers(self) -> list:
+        return sorted(name for name in os.listdir(self.dir) if ".tmp-" in name or ".bak-" in name)
+
+
+class WorkspaceTest(TempDirTest):
+
+    def test_relative_paths_resolve_to_workspace(self):
+        self.assertEqual(resolve_path("poem.txt", self.dir), self.path("poem.txt"))
+        absolute = os.path.join(tempfile.gettempdir(), "other.txt")
+        self.assertEqual(resolve_path(absolute, self.dir), absolute)
+
+    def test_workspace_from_environment(self):
+        with mock.patch.dict(os.environ, {"FS_WORKSPACE": self.dir}):
+            self.assertEqual(workspace_root(), os.path.abspath(self.dir))
+            self.assertEqual(resolve_path("a.txt"), os.path.join(os.path.abspath(self.dir), "a.txt"))
+
+
+class ApplyOperationsTest(TempDirTest):
+
+    def setUp(self):
+        super().setUp()
+        atomic_write(self.path("a.txt"), "A")
+        atomic_write(self.path("b.txt"), "B")
+
+    def test_operations_on_one_file_are_merged(self):
+        result = apply_operations([
+            {"op": "append", "file_name": self.path("a.txt"), "content": "+1"},
+            {"op": "create", "file_name": self.path("c.txt"), "content": "C"},
+            {"op": "append", "file_name": self.path("c.txt"), "content": "+2"},
+            {"op": "delete", "file_name": self.path("b.txt")},
+        ])
+        self.assertTrue(result["ok"])
+        self.assertEqual(self.read("a.txt"), "A+1")
+        self.assertEqual(self.read("c.txt"), "C+2")
+        self.assertFalse(os.path.exists(self.path("b.txt")))
+        self.assertEqual(self.leftovers(), [])
+
+    def test_all_or_nothing_leaves_files_untouched(self):
+        result = apply_operations([
+            {"op": "write", "file_name": self.path("a.txt"), "content": "X"},
+            {"op": "delete", "file_name": self.path("b.txt")},
+            {"op": "delete", "file_name": self.path("missing.txt")},
+        ], all_or_nothing=True)
+        self.assertFalse(result["ok"])
+        self.assertEqual([item["status"] for item in result["results"]], ["rolled_back", "rolled_back", "error"])
+        self.assertEqual((self.read("a.txt"), self.read("b.txt")), ("A", "B"))
+        self.assertEqual(self.leftovers(), [])
+
+    def test_failed_replace_is_rolled_back(self):
+        real_replace = os.replace
+
+        def failing_replace(source, target):
+            if target == self.path("c.txt"):
+                raise OSError("disk full")
+            return real_replace(source, target)
+
+        with mock.patch.object(file_access.os, "replace", failing_replace):
+            result = apply_operations([
+                {"op": "write", "file_name": self.path("a.txt"), "content": "X"},
+                {"op": "delete", "file_name": self.path("b.txt")},
+                {"op": "write", "file_name": self.path("c.txt"), "content": "C"},
+            ], all_or_nothing=True)
+        self.assertFalse(result["ok"])
+        self.assertEqual({item["status"] for item in result["results"]}, {"rolled_back"})
+        self.assertEqual((self.read("a.txt"), self.read("b.txt")), ("A", "B"))
+        self.assertFalse(os.path.exists(self.path("c.txt")))
+        self.assertEqual(self.leftovers(), [])
+
+    def test_independent_files_commit_separately(self):
+        result = apply_operations([
+            {"op": "append", "file_name": self.path("a.txt"), "content": "+1"},
+            {"op": "rename", "file_name": self.path("b.txt")},
+        ])
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["changed"], [self.path("a.txt")])
+        self.assertEqual(self.read("a.txt"), "A+1")
+        self.assertEqual(self.read("b.txt"), "B")
+
+    def test_partial_batch_is_not_retried(self):
+        """
+        部分生效的批量操作重试会重复追加，server 返回的错误必须被判定为不可重试
+        """
+        message = "批量文件操作部分生效，不可重试，请只重新执行出错的操作 network.txt"
+        error_class = classify_output(message)
+        self.assertEqual(error_class, PERMANENT)
+        self.assertFalse(RetryPolicy().should_retry(error_class, 1))
+
+    def test_directory_target_is_rejected(self):
+        os.mkdir(self.path("folder"))
+        result = apply_operations([{"op": "write", "file_name": self.path("folder"), "content": "X"}])
+        self.assertEqual(result["results"][0]["status"], "error")
+        self.assertTrue(os.path.isdir(self.path("folder")))
+
+
+class ChunkedReadTest(TempDirTest):
+
+    TEXT = "床前明月光，疑是地上霜。😀\nascii line\n举头望明月"
+
+    def test_small_chunks_always_advance(self):
+        atomic_write(self.path("poem.txt"), self.TEXT)
+        for chunk_size in (1, 2, 3, 5):
+            parts, cursor = [], ""
+            for _ in range(len(self.TEXT.encode("utf-8")) + 1):
+                result = read_chunk(self.path("poem.txt"), cursor, chunk_size)
+                self.assertTrue(result["text"])
+                parts.append(result["text"])
+                cursor = result["cursor"]
+                if not cursor:
+                    break
+            self.assertEqual(cursor, "", f"chunk_size={chunk_size} 没有读完")
+            self.assertEqual("".join(parts), self.TEXT)
+
+    def test_small_range_returns_one_char(self):
+        atomic_write(self.path("poem.txt"), self.TEXT)
+        result = read_range(self.path("poem.txt"), 0, 1)
+        self.assertEqual(result["text"], "床")
+        self.assertEqual(result["next_offset"], 3)
+
+
+class AppendBufferTest(TempDirTest):
+
+    def test_flushes_on_size_in_order(self):
+        async def run():
+            buffer = AppendBuffer(max_bytes=8, flush_interval=60)
+            log = self.path("log.txt")
+            await buffer.append(log, "123")
+            self.assertFalse(os.path.exists(log))
+            await buffer.append(log, "45678")
+            self.assertEqual(self.read("log.txt"), "12345678")
+            await buffer.append(log, "9")
+            await buffer.close()
+            self.assertEqual(self.read("log.txt"), "123456789")
+        asyncio.run(run())
+
+    def test_flushes_on_time(self):
+        async def run():
+            flushed = []
+
+            async def on_flush(file_name, previous):
+                flushed.append((file_name, previous))
+
+            buffer = AppendBuffer(max_bytes=1024, flush_interval=0.05, on_flush=on_flush)
+            log = self.path("log.txt")
+            await buffer.append(log, "a")
+            await asyncio.sleep(0.2)
+            self.assertEqual(self.read("log.txt"), "a")
+            # 文件原来不存在，没有追加前的状态
+            self.assertEqual(flushed, [(log, None)])
+            await buffer.close()
+        asyncio.run(run())
+
+    def test_appends_during_flush_keep_order(self):
+        async def run():
+            buffer = AppendBuffer(max_bytes=1024, flush_interval=60)
+            log = self.path("log.txt")
+            real_write = AppendBuffer._write
+
+            def slow_write(file_name, data):
+                # 落盘期间事件循环中还会有新的追加
+                time.sleep(0.05)
+                return real_write(file_name, data)
+
+            with mock.patch.object(AppendBuffer, "_write", staticmethod(slow_write)):
+                for i in range(5):
+                    await buffer.append(log, f"{i},")
+                flush = asyncio.create_task(buffer.flush(log))
+                await asyncio.sleep(0.01)
+                for i in range(5, 10):
+                    await buffer.append(log, f"{i},")
+                await asyncio.gather(flush, buffer.flush(log))
+                await buffer.close()
+            self.assertEqual(self.read("log.txt"), "".join(f"{i}," for i in range(10)))
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
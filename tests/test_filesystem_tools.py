@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+import telemetry
+from Client import MCPClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FilesystemToolResultTest(unittest.IsolatedAsyncioTestCase):
+    """
+    通过 stdio 启动真实的 Server_filesystem，按 client 的方式判定工具调用是否成功
+    """
+
+    async def asyncSetUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.workspace = os.path.join(self.work_dir.name, "workspace")
+        os.makedirs(self.workspace)
+        self.log = os.path.join(self.workspace, "app.log")
+        with open(self.log, "w", encoding="utf-8") as file:
+            file.write("2025-06-01 INFO started\n2025-06-01 ERROR write error: disk full\n2025-06-01 WARN retrying\n")
+        env = dict(os.environ, FS_WORKSPACE=self.workspace,
+                   FS_INDEX_PATH=os.path.join(self.work_dir.name, "fs_index.sqlite3"))
+        self.client = MCPClient()
+        await self.client.connect_all({
+            "servers": {"Server_filesystem": {
+                "command": sys.executable, "args": [os.path.join(ROOT, "Server_filesystem.py")], "env": env,
+            }},
+            "workspace": self.workspace,
+        })
+
+    async def asyncTearDown(self):
+        await self.client.cleanup()
+        self.work_dir.cleanup()
+
+    async def call(self, tool_name: str, tool_args: dict):
+        replica = self.client.pick_replica("Server_filesystem")
+        return await self.client._call_step("查看日志的最新内容", tool_name, tool_args, replica, telemetry.NOOP_SPAN)
+
+    async def test_tail_of_log_with_error_lines_succeeds(self):
+        ok, output, error_class = await self.call("tail_file", {"file_name": self.log, "num_lines": 2})
+        self.assertTrue(ok, output)
+        self.assertIsNone(error_class)
+        self.assertEqual(json.loads(output)["text"], "2025-06-01 ERROR write error: disk full\n2025-06-01 WARN retrying\n")
+
+    async def test_head_of_log_with_error_lines_succeeds(self):
+        ok, output, _ = await self.call("head_file", {"file_name": self.log, "num_lines": 2})
+        self.assertTrue(ok, output)
+        self.assertIn("ERROR write error: disk full", json.loads(output)["text"])
+
+    async def test_search_without_hits_returns_json(self):
+        replica = self.client.pick_replica("Server_filesystem")
+        ok, output, _ = await self.client._call_step("查找 segfault", "search_files", {"query": "segfault"}, replica,
+                                                     telemetry.NOOP_SPAN, judge=False)
+        self.assertTrue(ok, output)
+        self.assertEqual(json.loads(output)["results"], [])
+
+    async def test_missing_file_is_still_an_error(self):
+        ok, output, _ = await self.call("tail_file", {"file_name": os.path.join(self.workspace, "missing.log")})
+        self.assertFalse(ok)
+        self.assertIn("error", json.loads(output))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import asyncio
+import unittest
+
+import httpx
+from openai import AsyncOpenAI
+
+from llm_backend import LLMBackend
+
+
+def completion_stream(request: httpx.Request) -> httpx.Response:
+    events = []
+    for text in ("你", "好"):
+        chunk = {
+            "id": "chunk", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+            "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+        }
+        events.append(f"data: {json.dumps(chunk)}\n\n")
+    events.append("data: [DONE]\n\n")
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, content="".join(events).encode())
+
+
+class StreamConcurrencyTest(unittest.IsolatedAsyncioTestCase):
+    """
+    流式返回在读取期间一直占用并发名额，读完或关闭后才释放
+    """
+
+    async def asyncSetUp(self):
+        self.backend = LLMBackend(api_key="test", base_url="http://llm.test/v1", model="mock", max_concurrency=1)
+        await self.backend.aclose()
+        self.backend.client = AsyncOpenAI(
+            api_key="test", base_url="http://llm.test/v1",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(completion_stream)),
+        )
+
+    async def asyncTearDown(self):
+        await self.backend.aclose()
+
+    async def open_stream(self):
+        return await self.backend.chat([{"role": "user", "content": "hi"}], stream=True)
+
+    async def first_chunk(self, stream):
+        chunk = await stream.__anext__()
+        return chunk.choices[0].delta.content
+
+    async def test_second_stream_waits_until_first_is_consumed(self):
+        first = await self.open_stream()
+        self.assertEqual(await self.first_chunk(first), "你")
+
+        second = await self.open_stream()
+        pending = asyncio.create_task(self.first_chunk(second))
+        await asyncio.sleep(0.1)
+        self.assertFalse(pending.done())
+
+        self.assertEqual([chunk.choices[0].delta.content async for chunk in first], ["好"])
+        self.assertEqual(await asyncio.wait_for(pending, timeout=5), "你")
+        await second.aclose()
+
+    async def test_closing_stream_early_releases_slot(self):
+        first = await self.open_stream()
+        await self.first_chunk(first)
+        await first.aclose()
+
+        second = await self.open_stream()
+        self.assertEqual(await asyncio.wait_for(self.first_chunk(second), timeout=5), "你")
+        await second.aclose()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from plan_executor import PlanExecutor
+from retry_policy import RetryPolicy
+
+
+class PlanExecutorDeadlineTest(unittest.IsolatedAsyncioTestCase):
+
+    def make_executor(self, delay: float) -> PlanExecutor:
+        async def run_step(step, arguments):
+            await asyncio.sleep(delay)
+            return True, "ok", None
+
+        return PlanExecutor(run_step=run_step, server_of=lambda name: None,
+                            retry_policy=RetryPolicy(deadline=10), resolve_references=False)
+
+    async def test_runs_share_the_given_deadline(self):
+        executor = self.make_executor(0.05)
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + 0.08
+        first = await executor.run([{"name": "a", "arguments": {}}], deadline_at=deadline_at)
+        self.assertEqual(first[0].status, "done")
+        ## 第二次只剩下约 0.03 秒，不会重新获得 retry_policy.deadline 的完整时限
+        second = await executor.run([{"name": "b", "arguments": {}}], deadline_at=deadline_at)
+        self.assertEqual(second[0].status, "failed")
+
+    async def test_expired_deadline_runs_nothing(self):
+        executor = self.make_executor(0)
+        deadline_at = asyncio.get_running_loop().time() - 1
+        steps = await executor.run([{"name": "a", "arguments": {}}], deadline_at=deadline_at)
+        self.assertEqual(steps[0].status, "failed")
+
+
+if __name__ == "__main__":
+    unittest.main()
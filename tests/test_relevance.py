@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from relevance import RelevanceJudge, overlap_score
+from plan_executor import PlanExecutor
+from retry_policy import RetryPolicy, IRRELEVANT
+
+POEM_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Test box", "poem.txt")
+QUERY = "读取poem.txt然后发邮件给我"
+
+
+class FakeChoice:
+
+    def __init__(self, content: str):
+        self.message = type("Message", (), {"content": content})()
+
+
+class FakeLLM:
+    """
+    记录调用次数，按给定的内容回复
+    """
+
+    def __init__(self, reply: str = "True"):
+        self.reply = reply
+        self.calls = 0
+
+    async def chat(self, messages, **kwargs):
+        self.calls += 1
+        return type("Response", (), {"choices": [FakeChoice(self.reply)]})()
+
+
+def read_poem() -> str:
+    with open(POEM_PATH, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+class RelevanceJudgeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_file_contents_are_relevant_without_llm(self):
+        llm = FakeLLM(reply="False")
+        judge = RelevanceJudge(llm, mode="local")
+        self.assertEqual(overlap_score(QUERY, read_poem()), 0.0)
+        self.assertTrue(await judge.judge(QUERY, "read_file", read_poem()))
+        self.assertEqual(llm.calls, 0)
+
+    async def test_low_score_falls_back_to_llm(self):
+        llm = FakeLLM(reply="True")
+        judge = RelevanceJudge(llm, mode="local")
+        self.assertTrue(await judge.judge("今天的天气", "web_search", "完全无关的 unrelated text"))
+        self.assertEqual(llm.calls, 1)
+
+    async def test_high_score_skips_llm(self):
+        llm = FakeLLM(reply="False")
+        judge = RelevanceJudge(llm, mode="local")
+        self.assertTrue(await judge.judge("广州天气", "web_search", "广州天气晴，气温 25 度"))
+        self.assertEqual(llm.calls, 0)
+
+    async def test_read_file_then_send_email_chain(self):
+        """
+        读取文件再通过 {{read_file}} 发送邮件：读取的结果不能被判定为无关，否则发送邮件的步骤会被取消
+        """
+        judge = RelevanceJudge(FakeLLM(reply="False"), mode="local")
+        poem = read_poem()
+        sent = []
+
+        async def run_step(step, arguments):
+            if step.name == "read_file":
+                output = poem
+            else:
+                sent.append(arguments["body"])
+                output = "邮件已成功发送给 me@example.com"
+            if not await judge.judge(QUERY, step.name, output):
+                return False, output, IRRELEVANT
+            return True, output, None
+
+        executor = PlanExecutor(run_step=run_step, server_of=lambda name: None, retry_policy=RetryPolicy())
+        steps = await executor.run([
+            {"name": "read_file", "arguments": {"file_name": "poem.txt"}},
+            {"name": "send_email", "arguments": {"to": "me@example.com", "subject": "poem", "body": "{{read_file}}",
+                                                 "attachmentfilename": "noattach"}},
+        ])
+        self.assertEqual([step.status for step in steps], ["done", "done"])
+        self.assertEqual([step.attempts for step in steps], [1, 1])
+        self.assertEqual(sent, [poem])
+
+
+if __name__ == "__main__":
+    unittest.main()
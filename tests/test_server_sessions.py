@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import socket
+import asyncio
+import tempfile
+import unittest
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SharedResourcesTest(unittest.IsolatedAsyncioTestCase):
+    """
+    sse 传输下每个连接都是一个独立的会话，一个 client 断开不能关闭其他会话正在使用的共享资源
+    """
+
+    async def asyncSetUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        ## 网页延迟较长，保证另一个会话断开时抓取还在进行
+        self.stubs = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "benchmarks", "stub_services.py"),
+            "--llm-latency", "0.01", "--page-latency", "0.5",
+            stdout=asyncio.subprocess.PIPE,
+        )
+        ports = json.loads(await asyncio.wait_for(self.stubs.stdout.readline(), timeout=10))
+        http = f"http://127.0.0.1:{ports['http_port']}"
+        self.port = free_port()
+        env = dict(
+            os.environ,
+            BASE_URL=f"{http}/v1", DASHSCOPE_API_KEY="test", MODEL="mock",
+            GOOGLE_SEARCH_ENDPOINT=f"{http}/customsearch/v1", GOOGLE_SEARCH_API_KEY="test", GOOGLE_CSE_ID="test",
+            WEB_CACHE_ENABLED="0", SUMMARY_CACHE_PATH=os.path.join(self.work_dir.name, "summary.sqlite3"),
+        )
+        self.server = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "Server_web_brower.py"), "--transport", "sse", "--port", str(self.port),
+            env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        for _ in range(100):
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+
+    async def asyncTearDown(self):
+        for process in (self.server, self.stubs):
+            process.terminate()
+            await process.wait()
+        self.work_dir.cleanup()
+
+    async def open_session(self, ready: asyncio.Event, leave: asyncio.Event):
+        async with sse_client(f"http://127.0.0.1:{self.port}/sse") as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                ready.session = session
+                ready.set()
+                await leave.wait()
+
+    async def test_closing_one_session_keeps_others_working(self):
+        first_ready, first_leave = asyncio.Event(), asyncio.Event()
+        second_ready, second_leave = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(self.open_session(first_ready, first_leave))
+        second = asyncio.create_task(self.open_session(second_ready, second_leave))
+        await asyncio.wait_for(asyncio.gather(first_ready.wait(), second_ready.wait()), timeout=10)
+
+        call = asyncio.create_task(second_ready.session.call_tool(
+            "web_search", {"subquery": "测试", "keyword": "测试", "num_results": 2}
+        ))
+        await asyncio.sleep(0.2)
+        ## 第二个会话的网页抓取进行中时，第一个会话断开
+        first_leave.set()
+        await first
+        result = await asyncio.wait_for(call, timeout=20)
+        text = "".join(getattr(item, "text", "") for item in result.content)
+        self.assertFalse(result.isError, text)
+        self.assertNotIn("error", text)
+
+        second_leave.set()
+        await second
+
+
+if __name__ == "__main__":
+    unittest.main()
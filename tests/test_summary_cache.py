@@ -0,0 +1,85 @@
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import telemetry
+from summary_cache import SummaryCache
+
+
+class SummaryCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_requests_are_collapsed(self):
+        cache = SummaryCache(max_size=8)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "摘要"
+
+        results = await asyncio.gather(*(cache.get_or_compute("内容", "问题", "m", compute) for _ in range(3)))
+        self.assertEqual(results, ["摘要"] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats["collapsed"], 2)
+
+    async def test_cancelled_leader_does_not_cancel_waiters(self):
+        cache = SummaryCache(max_size=8)
+        started = asyncio.Event()
+
+        async def slow_compute():
+            started.set()
+            await asyncio.sleep(10)
+            return "不会返回"
+
+        async def fast_compute():
+            return "等待方自己计算的摘要"
+
+        leader = asyncio.create_task(cache.get_or_compute("内容", "问题", "m", slow_compute))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_compute("内容", "问题", "m", fast_compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.assertEqual(await waiter, "等待方自己计算的摘要")
+        self.assertEqual(cache.stats["llm_calls"], 2)
+
+    async def test_hits_and_saved_calls_are_exported_as_metrics(self):
+        def counter(name: str, **labels) -> float:
+            return telemetry.metrics.counters.get(telemetry.Metrics._key(name, labels), 0)
+
+        with mock.patch.dict(os.environ, {"TELEMETRY": "1"}):
+            telemetry.configure()
+        self.addCleanup(telemetry.configure)
+        cache = SummaryCache(max_size=8)
+        saved, hits, calls = (counter("summary_calls_saved_total"), counter("summary_cache_hits_total", tier="memory"),
+                              counter("summary_llm_calls_total"))
+
+        async def compute():
+            return "摘要"
+
+        for _ in range(3):
+            await cache.get_or_compute("内容", "问题", "m", compute)
+        self.assertEqual(counter("summary_llm_calls_total") - calls, 1)
+        self.assertEqual(counter("summary_cache_hits_total", tier="memory") - hits, 2)
+        self.assertEqual(counter("summary_calls_saved_total") - saved, cache.saved_calls)
+
+    async def test_errors_are_not_cached(self):
+        cache = SummaryCache(max_size=8)
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        async def working():
+            return "ok"
+
+        with self.assertRaises(RuntimeError):
+            await cache.get_or_compute("内容", "问题", "m", failing)
+        self.assertEqual(await cache.get_or_compute("内容", "问题", "m", working), "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+import telemetry
+from Client import MCPClient, load_server_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TraceLinkTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.trace_path = os.path.join(self.work_dir.name, "trace.jsonl")
+        self.saved_env = {key: os.environ.get(key) for key in ("TELEMETRY", "TELEMETRY_TRACE_PATH")}
+        os.environ["TELEMETRY"] = "1"
+        os.environ["TELEMETRY_TRACE_PATH"] = self.trace_path
+        telemetry.configure()
+
+    async def asyncTearDown(self):
+        for key, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        telemetry.configure()
+        self.work_dir.cleanup()
+
+    def write_config(self) -> str:
+        path = os.path.join(self.work_dir.name, "servers.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({
+                "servers": {"Server_main": {"command": sys.executable, "args": [os.path.join(ROOT, "Server_main.py")]}},
+                "workspace": self.work_dir.name,
+                "manifest_path": "tool_manifest.json",
+            }, file)
+        return path
+
+    def test_server_env_carries_telemetry_settings(self):
+        config = load_server_config(self.write_config())
+        env = config["servers"]["Server_main"]["env"]
+        self.assertEqual(env["TELEMETRY_TRACE_PATH"], self.trace_path)
+        self.assertEqual(env["TELEMETRY"], "1")
+
+    async def test_server_span_carries_client_trace_id(self):
+        client = MCPClient()
+        try:
+            await client.connect_all(load_server_config(self.write_config()))
+            with telemetry.span("query") as query_span:
+                result = await client.call_tool(client.sessions["Server_main"]["session"], "get_time", {})
+            self.assertFalse(result.isError)
+        finally:
+            await client.cleanup()
+        with open(self.trace_path, "r", encoding="utf-8") as file:
+            records = [json.loads(line) for line in file]
+        server_spans = [record for record in records if record["name"] == "server.get_time"]
+        self.assertEqual(len(server_spans), 1)
+        self.assertEqual(server_spans[0]["service"], "Server_main")
+        self.assertEqual(server_spans[0]["trace_id"], query_span.trace_id)
+        self.assertEqual(server_spans[0]["parent_id"], query_span.span_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from file_access import append_text, atomic_write
+from text_index import TextIndex
+
+
+class TextIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.workspace = os.path.join(self.work_dir.name, "workspace")
+        os.makedirs(self.workspace)
+        self.index = self.open_index("fs_index.sqlite3")
+
+    def tearDown(self):
+        self.index.conn.close()
+        self.work_dir.cleanup()
+
+    def open_index(self, name: str) -> TextIndex:
+        return TextIndex(self.workspace, os.path.join(self.work_dir.name, name), scan_interval=3600)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.workspace, name)
+
+    @staticmethod
+    def entries(index: TextIndex, relative: str):
+        postings = dict(index.conn.execute("SELECT term, tf FROM postings WHERE path = ?", (relative,)))
+        doc = index.conn.execute("SELECT mtime_ns, size, length FROM docs WHERE path = ?", (relative,)).fetchone()
+        return postings, doc
+
+    def test_append_matches_full_reindex(self):
+        log = self.path("log.txt")
+        atomic_write(log, "服务启动 hel")
+        self.assertTrue(self.index.update(log))
+        ## 接长末尾的单词、接上末尾的中文串、单字的中文串变成 bigram
+        for content in ("lo world\n", "检查磁盘", "满\n完", "成 error"):
+            previous = append_text(log, content)
+            self.assertTrue(self.index.append(log, *previous))
+        fresh = self.open_index("fresh.sqlite3")
+        self.assertTrue(fresh.update(log))
+        self.assertEqual(self.entries(self.index, "log.txt"), self.entries(fresh, "log.txt"))
+        fresh.conn.close()
+
+    def test_append_to_stale_entry_reindexes_before_search(self):
+        log = self.path("log.txt")
+        atomic_write(log, "first line\n")
+        self.index.update(log)
+        # 在索引不知道的情况下被改写过，不能在旧的条目上累加
+        atomic_write(log, "rewritten\n")
+        previous = append_text(log, "appended\n")
+        self.assertFalse(self.index.append(log, *previous))
+        self.assertEqual([result["file"] for result in self.index.search("rewritten")], ["log.txt"])
+        self.assertEqual(self.index.search("first"), [])
+
+    def test_writes_are_indexed_before_the_next_search(self):
+        poem = self.path("poem.txt")
+        atomic_write(poem, "床前明月光")
+        self.index.mark_dirty(poem)
+        self.assertEqual(self.entries(self.index, "poem.txt"), ({}, None))
+        self.assertEqual([result["file"] for result in self.index.search("明月")], ["poem.txt"])
+
+    def test_single_cjk_character_matches(self):
+        atomic_write(self.path("poem.txt"), "床前明月光，疑是地上霜。")
+        atomic_write(self.path("weather.txt"), "今天有霜")
+        self.index.scan()
+        self.assertEqual({result["file"] for result in self.index.search("霜")}, {"poem.txt", "weather.txt"})
+        self.assertEqual([result["file"] for result in self.index.search("床")], ["poem.txt"])
+        self.assertEqual(self.index.search("雪"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import unittest
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retry_policy import is_error_output
+from expression_eval import evaluate_batch
+from mail_delivery import MailJob, MailQueue
+
+
+class ErrorOutputTest(unittest.TestCase):
+
+    def test_error_results(self):
+        self.assertTrue(is_error_output(json.dumps({"error": "文件'a.txt'未找到"}, ensure_ascii=False)))
+        self.assertTrue(is_error_output(json.dumps([{"error": "Google API error"}])))
+        self.assertTrue(is_error_output("Error executing tool read_file: boom"))
+
+    def test_fields_mentioning_error_are_not_failures(self):
+        self.assertFalse(is_error_output(json.dumps(
+            {"id": "abc", "status": "failed", "attempts": 3, "last_failure": "SMTPServerDisconnected error"}
+        )))
+        self.assertFalse(is_error_output("27"))
+
+    def test_batch_with_one_bad_item_is_not_a_failure(self):
+        results = evaluate_batch(expressions=["1 + 1", "sqrt(-1)", "1 / 0"])
+        self.assertEqual(results[0], 2)
+        self.assertIn("failed", results[1])
+        self.assertFalse(is_error_output(json.dumps(results, ensure_ascii=False)))
+
+
+class MailStatusTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_status_omits_error_key(self):
+        queue = MailQueue()
+        job = MailJob(EmailMessage())
+        queue._jobs[job.id] = job
+        status = queue.status(job.id)
+        self.assertNotIn("error", status)
+        self.assertNotIn("last_failure", status)
+        self.assertFalse(is_error_output(json.dumps(status)))
+
+        job.error = "Connection unexpectedly closed"
+        self.assertEqual(queue.status(job.id)["last_failure"], "Connection unexpectedly closed")
+
+
+if __name__ == "__main__":
+    unittest.main()
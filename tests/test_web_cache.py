@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import tempfile
+import unittest
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from web_cache import WebCache
+
+URL = "http://example.com/page"
+
+
+class WebCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        # 清理按注册的相反顺序执行，目录在关闭缓存之后才删除
+        self.addCleanup(self.work_dir.cleanup)
+        self.requests = []
+
+    def make_cache(self, **kwargs) -> WebCache:
+        cache = WebCache(path=os.path.join(self.work_dir.name, "web_cache.sqlite3"), **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def make_client(self, body: str = "<p>正文</p>") -> httpx.AsyncClient:
+        """
+        带 ETag 与 Last-Modified 的网页，请求中的验证器与之相符时返回 304
+        """
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(200, text=body, headers={
+                "ETag": '"v1"', "Last-Modified": "Sun, 01 Jun 2025 00:00:00 GMT",
+            })
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        self.addAsyncCleanup(client.aclose)
+        return client
+
+    async def test_fresh_page_is_served_without_a_request(self):
+        cache, client = self.make_cache(page_ttl=3600), self.make_client()
+        self.assertEqual(await cache.fetch_page(client, URL), (200, "<p>正文</p>", False))
+        self.assertEqual(await cache.fetch_page(client, URL), (200, "<p>正文</p>", True))
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(cache.stats["page_hits"], 1)
+
+    async def test_expired_page_is_revalidated_with_304(self):
+        cache, client = self.make_cache(page_ttl=0), self.make_client()
+        await cache.fetch_page(client, URL)
+        time.sleep(0.01)
+        self.assertEqual(await cache.fetch_page(client, URL), (200, "<p>正文</p>", True))
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1].headers["If-None-Match"], '"v1"')
+        self.assertEqual(self.requests[1].headers["If-Modified-Since"], "Sun, 01 Jun 2025 00:00:00 GMT")
+        self.assertEqual(cache.stats["page_revalidated"], 1)
+
+    def test_expired_search_results_are_a_miss(self):
+        cache = self.make_cache(search_ttl=0.05)
+        cache.put_search("天气", 3, "zh", "cn", [{"title": "晴"}])
+        self.assertEqual(cache.get_search("天气", 3, "zh", "cn"), [{"title": "晴"}])
+        time.sleep(0.1)
+        self.assertIsNone(cache.get_search("天气", 3, "zh", "cn"))
+        self.assertEqual(cache.stats, {**cache.stats, "search_hits": 1, "search_misses": 1})
+
+    def test_least_recently_accessed_entry_is_evicted(self):
+        cache = self.make_cache(max_bytes=250)
+        for name in ("a", "b"):
+            cache.put_page(f"{URL}/{name}", name * 100)
+            time.sleep(0.01)
+        # a 的访问时间只记在内存中，淘汰时需要先写入，否则会淘汰掉刚访问过的 a
+        self.assertIsNotNone(cache.get_page(f"{URL}/a"))
+        time.sleep(0.01)
+        cache.put_page(f"{URL}/c", "c" * 100)
+        self.assertIsNotNone(cache.get_page(f"{URL}/a"))
+        self.assertIsNone(cache.get_page(f"{URL}/b"))
+        self.assertIsNotNone(cache.get_page(f"{URL}/c"))
+        self.assertLessEqual(cache.total_size(), 250)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,327 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import threading
+from collections import Counter
+from relevance import tokenize, CJK_PATTERN, WORD_PATTERN
+from file_access import workspace_root
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fs_index.sqlite3")
+## BM25 参数
+K1 = 1.2
+B = 0.75
+## 增量追加时向前读取的字节数，用于找出被追加内容接上的末尾片段（未结束的英文单词或中文串）
+TAIL_BYTES = 256
+TRAILING_RUN = re.compile(f"(?:{WORD_PATTERN.pattern}|{CJK_PATTERN.pattern})$")
+TERM_SQL = ("SELECT postings.path, postings.tf, docs.length FROM postings JOIN docs ON docs.path = postings.path "
+            "WHERE postings.term = ?")
+## 单个汉字没有对应的 bigram：匹配以该字开头或结尾的 bigram（以及单字的条目），词频取两者中较大的一个
+SINGLE_CJK_SQL = ("SELECT postings.path, MAX(SUM(CASE WHEN substr(postings.term, 1, 1) = ? THEN postings.tf ELSE 0 END), "
+                  "SUM(CASE WHEN substr(postings.term, 2, 1) = ? THEN postings.tf ELSE 0 END)), docs.length "
+                  "FROM postings JOIN docs ON docs.path = postings.path "
+                  "WHERE substr(postings.term, 1, 1) = ? OR substr(postings.term, 2, 1) = ? GROUP BY postings.path")
+
+
+class TextIndex:
+    """
+    工作目录下文本文件的全文倒排索引（SQLite 持久化），分词与相关性判定相同：英文按单词，中文按相邻两字的 bigram
+    docs 表: path（相对工作目录）-> mtime、大小、词数；postings 表: (term, path) -> 词频
+    增量更新：文件工具整体写入后调用 mark_dirty，在下一次搜索前才重建该文件的条目，连续多次写入只重建一次；
+    追加后调用 append，只对追加的部分分词；删除后调用 remove
+    另外每次搜索前如果距离上次扫描超过 scan_interval，按 mtime 与大小扫描一遍工作目录，处理在工具之外发生的修改
+    搜索按 BM25 排序，返回每个文件中最相关的片段及其字节偏移，单个汉字按以它开头或结尾的 bigram 匹配
+    可通过环境变量配置：FS_WORKSPACE（默认为 ./Test box）、FS_INDEX_PATH、FS_INDEX_SCAN_INTERVAL（秒，默认 5）、
+    FS_INDEX_MAX_BYTES（超过该大小的文件不建索引，默认 10MB）
+    """
+
+    def __init__(self, workspace: str = None, path: str = None, scan_interval: float = None, max_bytes: int = None):
+        self.workspace = os.path.abspath(workspace) if workspace else workspace_root()
+        self.path = path or os.getenv("FS_INDEX_PATH", DEFAULT_INDEX_PATH)
+        self.scan_interval = scan_interval if scan_interval is not None else float(os.getenv("FS_INDEX_SCAN_INTERVAL", 5))
+        self.max_bytes = max_bytes or int(os.getenv("FS_INDEX_MAX_BYTES", 10 * 1024 * 1024))
+        self.last_scan = 0.0
+        self._lock = threading.Lock()
+        # 等待在下一次搜索前重建的文件（相对路径）
+        self._dirty = set()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                path TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, path)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_path ON postings (path);
+        """)
+        self.conn.commit()
+
+    def relative(self, file_name: str):
+        """
+        工作目录内的文件返回相对路径，否则返回 None（不建索引）
+        """
+        full = os.path.abspath(file_name)
+        try:
+            if os.path.commonpath([os.path.normcase(full), os.path.normcase(self.workspace)]) != os.path.normcase(self.workspace):
+                return None
+        except ValueError:
+            # Windows 上不同盘符的路径无法比较
+            return None
+        return os.path.relpath(full, self.workspace).replace(os.sep, "/")
+
+    def _read_text(self, full_path: str):
+        """
+        读取文本文件，过大或不是 UTF-8 文本的文件返回 None
+        """
+        if os.path.getsize(full_path) > self.max_bytes:
+            return None
+        with open(full_path, "rb") as file:
+            data = file.read()
+        if b"\0" in data:
+            return None
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+    def update(self, file_name: str) -> bool:
+        """
+        重建一个文件的索引条目，返回是否已建索引
+        """
+        relative = self.relative(file_name)
+        if relative is None:
+            return False
+        with self._lock:
+            indexed = self._index_file(relative)
+            self.conn.commit()
+        return indexed
+
+    def mark_dirty(self, file_name: str):
+        """
+        文件被整体写入：在下一次搜索前重建它的条目，不在写入时同步重建
+        """
+        relative = self.relative(file_name)
+        if relative is not None:
+            self._dirty.add(relative)
+
+    def append(self, file_name: str, previous_mtime_ns: int, previous_size: int) -> bool:
+        """
+        文件在追加前的 mtime 与大小为 previous_mtime_ns、previous_size：只对追加的部分分词，把词频加到已有的条目上，
+        耗时与追加的长度成正比而不是整个文件；追加的内容与文件末尾未结束的单词或中文串一起分词，边界上的词与整体分词一致
+        索引中的条目不是追加前的状态、文件过大或不是文本时，改为在下一次搜索前重建，返回是否已增量更新
+        """
+        relative = self.relative(file_name)
+        if relative is None:
+            return False
+        with self._lock:
+            row = self.conn.execute("SELECT mtime_ns, size FROM docs WHERE path = ?", (relative,)).fetchone()
+            delta = None
+            if row == (previous_mtime_ns, previous_size) and relative not in self._dirty:
+                try:
+                    delta = self._append_delta(os.path.join(self.workspace, relative), previous_size)
+                except OSError:
+                    delta = None
+            if delta is None:
+                self._dirty.add(relative)
+                return False
+            mtime_ns, size, terms = delta
+            self.conn.executemany(
+                "INSERT INTO postings (term, path, tf) VALUES (?, ?, ?) "
+                "ON CONFLICT (term, path) DO UPDATE SET tf = tf + excluded.tf",
+                ((term, relative, tf) for term, tf in terms.items() if tf != 0),
+            )
+            # 末尾的单词被接长时，原来的词频会减到 0
+            self.conn.executemany(
+                "DELETE FROM postings WHERE term = ? AND path = ? AND tf <= 0",
+                ((term, relative) for term, tf in terms.items() if tf < 0),
+            )
+            self.conn.execute(
+                "UPDATE docs SET mtime_ns = ?, size = ?, length = length + ? WHERE path = ?",
+                (mtime_ns, size, sum(terms.values()), relative),
+            )
+            self.conn.commit()
+        return True
+
+    def _append_delta(self, full_path: str, previous_size: int):
+        """
+        返回 (mtime_ns, 大小, 词频的变化)，无法增量更新时返回 None
+        """
+        start = max(0, previous_size - TAIL_BYTES)
+        with open(full_path, "rb") as file:
+            file.seek(start)
+            data = file.read()
+            stat = os.fstat(file.fileno())
+        size = start + len(data)
+        # 读取期间又有写入，或者文件变得过大
+        if stat.st_size != size or size > self.max_bytes or b"\0" in data:
+            return None
+        try:
+            appended = data[previous_size - start:].decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        # 向前读取的起点可能落在一个字符中间，丢掉不完整的字节即可
+        tail = data[:previous_size - start].decode("utf-8", errors="ignore")
+        match = TRAILING_RUN.search(tail)
+        if match is not None and match.start() == 0 and start > 0:
+            # 末尾的片段比向前读取的范围还长，无法确定它的完整内容
+            return None
+        boundary = match.group(0) if match else ""
+        terms = Counter(tokenize(boundary + appended))
+        terms.subtract(tokenize(boundary))
+        return stat.st_mtime_ns, size, terms
+
+    def remove(self, file_name: str):
+        relative = self.relative(file_name)
+        if relative is None:
+            return
+        with self._lock:
+            self._remove(relative)
+            self.conn.commit()
+
+    def _index_dirty(self):
+        if not self._dirty:
+            return
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for relative in dirty:
+                self._index_file(relative)
+            self.conn.commit()
+
+    def _postings(self, term: str) -> list:
+        """
+        一个词的 (path, 词频, 文件词数)
+        """
+        if len(term) == 1 and CJK_PATTERN.fullmatch(term):
+            # substr 没有索引可用，需要扫描整个 postings 表，只在查询单个汉字时使用
+            return self.conn.execute(SINGLE_CJK_SQL, (term, term, term, term)).fetchall()
+        return self.conn.execute(TERM_SQL, (term,)).fetchall()
+
+    def _remove(self, relative: str):
+        self.conn.execute("DELETE FROM postings WHERE path = ?", (relative,))
+        self.conn.execute("DELETE FROM docs WHERE path = ?", (relative,))
+
+    def _index_file(self, relative: str) -> bool:
+        full_path = os.path.join(self.workspace, relative)
+        self._remove(relative)
+        try:
+            stat = os.stat(full_path)
+            text = self._read_text(full_path)
+        except OSError:
+            return False
+        if text is None:
+            return False
+        terms = Counter(tokenize(text))
+        self.conn.execute(
+            "INSERT INTO docs (path, mtime_ns, size, length) VALUES (?, ?, ?, ?)",
+            (relative, stat.st_mtime_ns, stat.st_size, sum(terms.values())),
+        )
+        self.conn.executemany(
+            "INSERT INTO postings (term, path, tf) VALUES (?, ?, ?)",
+            ((term, relative, tf) for term, tf in terms.items()),
+        )
+        return True
+
+    def scan(self) -> dict:
+        """
+        按 mtime 与大小对比工作目录与索引，只重建有变化的文件，删除已不存在的文件
+        """
+        stats = {"indexed": 0, "removed": 0, "unchanged": 0}
+        if not os.path.isdir(self.workspace):
+            return stats
+        with self._lock:
+            known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                     self.conn.execute("SELECT path, mtime_ns, size FROM docs")}
+            seen = set()
+            for directory, _, files in os.walk(self.workspace):
+                for name in files:
+                    full_path = os.path.join(directory, name)
+                    # 分块上传、原子写入的临时文件与批量操作的备份不建索引
+                    if ".upload-" in name or ".tmp-" in name or ".bak-" in name:
+                        continue
+                    relative = os.path.relpath(full_path, self.workspace).replace(os.sep, "/")
+                    seen.add(relative)
+                    try:
+                        stat = os.stat(full_path)
+                    except OSError:
+                        continue
+                    if known.get(relative) == (stat.st_mtime_ns, stat.st_size):
+                        stats["unchanged"] += 1
+                        continue
+                    if self._index_file(relative):
+                        stats["indexed"] += 1
+            for relative in known.keys() - seen:
+                self._remove(relative)
+                stats["removed"] += 1
+            self.conn.commit()
+            self.last_scan = time.monotonic()
+        return stats
+
+    def search(self, query: str, top_k: int = 5, snippets: int = 3, window: int = 40) -> list:
+        """
+        BM25 排序，返回 [{"file", "score", "snippets": [{"offset", "line", "text"}]}]，offset 为片段在文件中的字节偏移
+        """
+        self._index_dirty()
+        if time.monotonic() - self.last_scan > self.scan_interval:
+            self.scan()
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            total_docs, total_length = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+            if total_docs == 0:
+                return []
+            average_length = total_length / total_docs or 1
+            scores = Counter()
+            for term in terms:
+                rows = self._postings(term)
+                if not rows:
+                    continue
+                idf = math.log(1 + (total_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                for path, tf, length in rows:
+                    scores[path] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+        results = []
+        for path, score in scores.most_common(top_k):
+            try:
+                text = self._read_text(os.path.join(self.workspace, path))
+            except OSError:
+                continue
+            if text is None:
+                continue
+            results.append({
+                "file": path,
+                "score": round(score, 4),
+                "snippets": find_snippets(text, terms, snippets, window),
+            })
+        return results
+
+
+def find_snippets(text: str, terms: list, limit: int, window: int) -> list:
+    """
+    以命中的位置为中心取前后 window 个字符，重叠的窗口合并，按窗口内命中的不同词数取前 limit 个，再按位置排序
+    """
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    windows = []
+    for match in pattern.finditer(text):
+        start, end = max(0, match.start() - window), min(len(text), match.end() + window)
+        term = match.group(0).lower()
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+            windows[-1][2].add(term)
+        else:
+            windows.append([start, end, {term}])
+    best = sorted(windows, key=lambda item: (-len(item[2]), item[0]))[:limit]
+    snippets = []
+    for start, end, _ in sorted(best):
+        snippets.append({
+            "offset": len(text[:start].encode("utf-8")),
+            "line": text.count("\n", 0, start) + 1,
+            "text": " ".join(text[start:end].split()),
+        })
+    return snippets
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web_cache.sqlite3")
+
+
+class WebCache:
+    """
+    web_search 使用的本地持久化缓存（SQLite）
+    search 表: (keyword, num_results, lang, country) -> 搜索结果，超过 search_ttl 后重新请求
+    page 表: url -> 网页正文及 ETag / Last-Modified，超过 page_ttl 后用条件 GET 重新验证
+    总大小超过 max_bytes 时按最近访问时间淘汰；命中时的访问时间先记在内存中，随下一次写入一起提交，读取不触发磁盘同步
+    方法都是同步的，可以在线程中调用（fetch_page 中的 SQLite 操作都在线程中执行，不阻塞事件循环）
+    可通过环境变量配置：WEB_CACHE_PATH、WEB_CACHE_SEARCH_TTL（默认 86400）、WEB_CACHE_PAGE_TTL（默认 3600）、WEB_CACHE_MAX_BYTES（默认 50MB）
+    """
+
+    def __init__(self, path: str = None, search_ttl: float = None, page_ttl: float = None, max_bytes: int = None):
+        self.path = path or os.getenv("WEB_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.search_ttl = search_ttl if search_ttl is not None else float(os.getenv("WEB_CACHE_SEARCH_TTL", 86400))
+        self.page_ttl = page_ttl if page_ttl is not None else float(os.getenv("WEB_CACHE_PAGE_TTL", 3600))
+        self.max_bytes = max_bytes or int(os.getenv("WEB_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+        self.stats = {"search_hits": 0, "search_misses": 0, "page_hits": 0, "page_revalidated": 0, "page_misses": 0}
+        self._lock = threading.Lock()
+        # (表名, key) -> 尚未写入的访问时间
+        self._accessed = {}
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS search (
+                key TEXT PRIMARY KEY,
+                results TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS page (
+                url TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def search_key(keyword: str, num_results: int, lang: str, country: str) -> str:
+        return json.dumps([keyword, num_results, lang, country], ensure_ascii=False)
+
+    def get_search(self, keyword: str, num_results: int, lang: str, country: str) -> Optional[list]:
+        key = self.search_key(keyword, num_results, lang, country)
+        with self._lock:
+            row = self.conn.execute("SELECT results, fetched_at FROM search WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[1] > self.search_ttl:
+                self.stats["search_misses"] += 1
+                return None
+            self._accessed["search", key] = time.time()
+            self.stats["search_hits"] += 1
+        return json.loads(row[0])
+
+    def put_search(self, keyword: str, num_results: int, lang: str, country: str, results: list):
+        key = self.search_key(keyword, num_results, lang, country)
+        data = json.dumps(results, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(("search", key), None)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO search (key, results, size, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def get_page(self, url: str) -> Optional[dict]:
+        """
+        返回缓存的网页：{"body", "etag", "last_modified", "fresh"}，fresh 为 False 时需要条件 GET 重新验证
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM page WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._accessed["page", url] = time.time()
+        return {
+            "body": row[0],
+            "etag": row[1],
+            "last_modified": row[2],
+            "fresh": time.time() - row[3] <= self.page_ttl,
+        }
+
+    def put_page(self, url: str, body: str, etag: str = None, last_modified: str = None):
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(("page", url), None)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO page (url, body, etag, last_modified, size, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, body, etag, last_modified, len(body.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def touch_page(self, url: str):
+        """
+        条件 GET 返回 304 时，刷新网页的获取时间
+        """
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(("page", url), None)
+            self.conn.execute("UPDATE page SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self._write_accessed()
+            self.conn.commit()
+
+    async def fetch_page(self, client, url: str, headers: dict = None, read_body=None):
+        """
+        带缓存的网页获取：新鲜的缓存直接返回，过期的缓存用 If-None-Match / If-Modified-Since 重新验证
+        read_body(response) 用于流式读取响应，返回实际读取的正文（可以只是前面一部分），不传则读取完整正文
+        返回 (状态码, 正文, 是否来自缓存)，命中或 304 时状态码为 200
+        """
+        cached = await asyncio.to_thread(self.get_page, url)
+        if cached is not None and cached["fresh"]:
+            self.stats["page_hits"] += 1
+            return 200, cached["body"], True
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if cached["etag"]:
+                request_headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                request_headers["If-Modified-Since"] = cached["last_modified"]
+        async with client.stream("GET", url, headers=request_headers) as response:
+            if response.status_code == 304 and cached is not None:
+                self.stats["page_revalidated"] += 1
+                await asyncio.to_thread(self.touch_page, url)
+                return 200, cached["body"], True
+            self.stats["page_misses"] += 1
+            if response.status_code != 200:
+                return response.status_code, "", False
+            if read_body is not None:
+                body = await read_body(response)
+            else:
+                await response.aread()
+                body = response.text
+            await asyncio.to_thread(
+                self.put_page, url, body, response.headers.get("ETag"), response.headers.get("Last-Modified")
+            )
+            return 200, body, False
+
+    def total_size(self) -> int:
+        with self._lock:
+            return self._total_size()
+
+    def _total_size(self) -> int:
+        row = self.conn.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM search) + (SELECT COALESCE(SUM(size), 0) FROM page)"
+        ).fetchone()
+        return row[0]
+
+    def _write_accessed(self):
+        """
+        把内存中的访问时间写入表中，随调用方的事务一起提交
+        """
+        if not self._accessed:
+            return
+        accessed, self._accessed = self._accessed, {}
+        for table, column in (("search", "key"), ("page", "url")):
+            self.conn.executemany(
+                f"UPDATE {table} SET accessed_at = ? WHERE {column} = ?",
+                ((accessed_at, key) for (name, key), accessed_at in accessed.items() if name == table),
+            )
+
+    def _evict(self):
+        """
+        总大小超过上限时，按最近访问时间从旧到新淘汰，调用方持有锁并负责提交
+        """
+        self._write_accessed()
+        total = self._total_size()
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute(
+            "SELECT 'search', key, size, accessed_at FROM search "
+            "UNION ALL SELECT 'page', url, size, accessed_at FROM page ORDER BY accessed_at"
+        ).fetchall()
+        for table, key, size, _ in rows:
+            if total <= self.max_bytes:
+                break
+            column = "key" if table == "search" else "url"
+            self.conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+            total -= size
+
+    def close(self):
+        with self._lock:
+            self._write_accessed()
+            self.conn.commit()
+            self.conn.close()